@@ -0,0 +1,80 @@
+import os
+import time
+import logging
+from typing import Dict, Iterable, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ITEMS = int(os.getenv("ANSWER_CACHE_MAX_ITEMS", "4096"))
+ANSWER_CACHE_TTL_HOURS = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "24"))
+
+class SemanticAnswerCache:
+    # Stored answers are found by brute-force cosine similarity over a
+    # preallocated float32 matrix; at a few thousand rows one matvec is
+    # cheaper than maintaining an ANN structure.
+    def __init__(self, threshold: float, max_items: int, ttl_seconds: float, dim: int = 384):
+        self.threshold = threshold
+        self.ttl = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._vectors = np.zeros((max_items, dim), dtype=np.float32)
+        self._stored_at = np.full(max_items, -np.inf)
+        self._entries = [None] * max_items
+
+    def _live(self) -> np.ndarray:
+        return self._stored_at > time.time() - self.ttl
+
+    def lookup(self, embedding) -> Optional[Dict]:
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self._vectors @ query
+        scores[~self._live()] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info(f"Semantic answer cache hit (cosine {scores[best]:.3f})")
+        return self._entries[best]["response"]
+
+    def store(self, embedding, response: Dict, specialties: Iterable[str]) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        # Expired or invalidated slots have the oldest stamps, so they go first
+        slot = int(np.argmin(self._stored_at))
+        self._vectors[slot] = vector / (np.linalg.norm(vector) or 1.0)
+        self._stored_at[slot] = time.time()
+        self._entries[slot] = {"response": response, "specialties": set(specialties)}
+
+    def invalidate_specialties(self, specialties: Iterable[str]) -> int:
+        # Answers that drew on no indexed papers are dropped too: new chunks
+        # may now cover them
+        specialties = set(specialties)
+        dropped = 0
+        for slot, entry in enumerate(self._entries):
+            if entry is None or not np.isfinite(self._stored_at[slot]):
+                continue
+            if not entry["specialties"] or entry["specialties"] & specialties:
+                self._stored_at[slot] = -np.inf
+                self._entries[slot] = None
+                dropped += 1
+        self.invalidations += dropped
+        return dropped
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "items": int(self._live().sum())
+        }
+
+answer_cache = SemanticAnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ITEMS, ANSWER_CACHE_TTL_HOURS * 3600)
@@ -0,0 +1,142 @@
+import os
+import hashlib
+import logging
+import tempfile
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CACHE_DIR = os.getenv("PMC_ARCHIVE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "archive_cache"))
+ARCHIVE_CACHE_MAX_MB = int(os.getenv("PMC_ARCHIVE_CACHE_MAX_MB", "2048"))
+# Temp files older than this are left over from a crashed writer; younger ones may
+# belong to a download still running in another worker process
+STALE_PART_SECONDS = 3600
+
+class ArchiveCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size = None
+        self._remove_stale_parts()
+
+    def _remove_stale_parts(self) -> None:
+        cutoff = time.time() - STALE_PART_SECONDS
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".part"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        logger.info(f"Removed leftover partial download {path}")
+                except FileNotFoundError:
+                    continue
+
+    def path_for(self, file_path: str, version: Optional[str] = None) -> str:
+        # PMC replaces updated packages at the same path, so entries are keyed on the
+        # paper's last_updated too; superseded versions age out through the LRU
+        key = file_path if version is None else f"{file_path}@{version}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], f"{digest}.tar.gz")
+
+    def contains(self, file_path: str, version: Optional[str] = None) -> bool:
+        return os.path.exists(self.path_for(file_path, version))
+
+    def get(self, file_path: str, version: Optional[str] = None) -> Optional[str]:
+        path = self.path_for(file_path, version)
+        try:
+            # mtime doubles as the LRU clock
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    @contextmanager
+    def writer(self, file_path: str, version: Optional[str] = None) -> Iterator:
+        # Written to a temp file in the same directory and renamed on success,
+        # so readers never see a partial archive
+        path = self.path_for(file_path, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                # Two downloads of the same paper replace one entry; count it once
+                try:
+                    size -= os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+                os.replace(tmp_path, path)
+                if self._size is not None:
+                    self._size += size
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._evict()
+
+    def put(self, file_path: str, data: bytes, version: Optional[str] = None) -> str:
+        with self.writer(file_path, version) as f:
+            f.write(data)
+        return self.path_for(file_path, version)
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tar.gz"):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            if self._size <= self.max_bytes:
+                return
+            for _, size, path in sorted(self._entries()):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self._size -= size
+                self.evictions += 1
+                logger.info(f"Evicted {path} from archive cache")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size_bytes": self._size
+            }
+
+archive_cache = ArchiveCache(ARCHIVE_CACHE_DIR, ARCHIVE_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,1197 @@
+import os
+import csv
+import time
+import random
+import logging
+import argparse
+import tempfile
+import statistics
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+def _timeit(fn, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def bench_oa_index(args):
+    import oa_index
+
+    workdir = tempfile.mkdtemp(prefix="bench-oa-")
+    csv_path = os.path.join(workdir, "oa_file_list.csv")
+    db_path = os.path.join(workdir, "oa_file_list.sqlite")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["File", "Article Citation", "Accession ID", "Last Updated (YYYY-MM-DD HH:MM:SS)", "PMID", "License", "Retracted"])
+        for i in range(args.rows):
+            writer.writerow([f"oa_package/{i % 256:02x}/{i % 97:02x}/PMC{i}.tar.gz", f"Paper {i}. J Med. 2024", f"PMC{i}", "2024-01-01 00:00:00", str(i), "CC BY", "no"])
+
+    started = time.perf_counter()
+    oa_index.build_index(csv_path, db_path)
+    print(f"build: {args.rows} rows in {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    oa_index.build_index(csv_path, db_path)
+    print(f"delta merge (no changes): {time.perf_counter() - started:.2f}s")
+
+    for n in (30, 1000, 100000):
+        pmcids = [f"PMC{random.randrange(args.rows)}" for _ in range(n)]
+        elapsed = _timeit(lambda: oa_index.lookup(pmcids, db_path))
+        print(f"lookup {n:>6} pmcids: {elapsed * 1000:9.2f} ms")
+
+    if args.baseline:
+        # The previous implementation: full CSV scan with list membership
+        pmcids = [f"PMC{random.randrange(args.rows)}" for _ in range(30)]
+        def scan():
+            with open(csv_path, newline="", encoding="utf-8") as f:
+                return [row for row in csv.DictReader(f) if row["Accession ID"] in pmcids]
+        print(f"csv scan     30 pmcids: {_timeit(scan, repeat=1) * 1000:9.2f} ms")
+
+def _make_paper_archive(i: int, pages: int = 4, supplement_bytes: int = 0) -> bytes:
+    import io
+    import tarfile
+    import fitz
+
+    nxml = (
+        f"<article><front><article-meta><abstract><p>Abstract of synthetic paper {i}.</p></abstract>"
+        f"</article-meta></front><body><sec><title>Introduction</title><p>Body of paper {i}.</p></sec></body>"
+        f"<back><ref-list><ref>Reference {i}</ref></ref-list></back></article>"
+    ).encode()
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Paper {i} page {page_no}. " + "Clinical findings were consistent. " * 10)
+    pdf = doc.tobytes()
+    doc.close()
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        members = [(f"PMC{i}/paper.nxml", nxml), (f"PMC{i}/paper.pdf", pdf)]
+        if supplement_bytes:
+            members.append((f"PMC{i}/supplement.bin", os.urandom(supplement_bytes)))
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+def _serve_fake_pmc(archives: dict, latency: float = 0.0) -> str:
+    # Stand-in for ftp.ncbi.nlm.nih.gov: serves in-memory tarballs under /pub/pmc
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            data = archives.get(self.path.removeprefix("/pub/pmc/"))
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-gzip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/pub/pmc"
+
+def bench_fetch(args):
+    import asyncio
+
+    archives = {f"oa_package/PMC{i}.tar.gz": _make_paper_archive(i) for i in range(args.papers)}
+    os.environ["PMC_BASE_URL"] = _serve_fake_pmc(archives, args.latency)
+    os.environ["PMC_ARCHIVE_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-cache-")
+    os.environ["NCBI_REQUESTS_PER_SECOND"] = str(args.rate)
+    import utils
+    from archive_cache import ArchiveCache
+
+    file_paths = list(archives)
+    started = time.perf_counter()
+    serial = [utils.extract_paper_content(file_path) for file_path in file_paths]
+    serial_elapsed = time.perf_counter() - started
+
+    # An empty cache so the concurrent pass downloads everything too
+    utils.archive_cache = ArchiveCache(tempfile.mkdtemp(prefix="bench-cache-"), utils.archive_cache.max_bytes)
+    started = time.perf_counter()
+    concurrent = asyncio.run(utils.fetch_papers(utils.extract_paper_content, file_paths))
+    concurrent_elapsed = time.perf_counter() - started
+
+    assert serial == concurrent, "concurrent fetch returned results out of order"
+    print(f"serial:     {args.papers} papers in {serial_elapsed:.2f}s")
+    print(f"concurrent: {args.papers} papers in {concurrent_elapsed:.2f}s "
+          f"({args.rate:g} req/s, {utils.FETCH_CONCURRENCY_PER_HOST} per host)")
+
+class _StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class _StubGemini:
+    def __init__(self, latency: float, chunks: int = 20):
+        self.latency = latency
+        self.chunks = chunks
+
+    async def _stream(self):
+        import asyncio
+        # The same total generation time, delivered in pieces
+        for i in range(self.chunks):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield _StubResponse(f"token{i} ")
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        import asyncio
+        if stream:
+            return self._stream()
+        await asyncio.sleep(self.latency)
+        if "Return only a JSON array" in prompt:
+            import re
+            import json
+            count = len(re.findall(r"^\s*\d+\. ", prompt, re.MULTILINE))
+            return _StubResponse(json.dumps(["myocardial infarction with dyspnea"] * count))
+        return _StubResponse("myocardial infarction with dyspnea")
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self.latency)
+        return _StubResponse("myocardial infarction with dyspnea")
+
+class _StubEmbedder:
+    # Holds its executor thread for a fixed time per call, like a forward pass
+    def __init__(self, seconds_per_call: float):
+        self.seconds_per_call = seconds_per_call
+
+    def encode(self, texts, convert_to_numpy=True, **kwargs):
+        import numpy as np
+        time.sleep(self.seconds_per_call)
+        return np.random.rand(len(texts), 384).astype("float32")
+
+class _StubIndex:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def query(self, vector=None, top_k=10, include_metadata=True, filter=None, **kwargs):
+        time.sleep(self.latency)
+        return {"matches": [
+            {"id": f"PMC{i}_0", "score": 0.9 - i * 0.01, "metadata": {
+                "pmcid": f"PMC{i}", "title": f"Paper {i}", "specialty": "cardiology",
+                "chunk_id": 0, "text": "treatment of myocardial infarction", "last_updated": 1700000000}}
+            for i in range(top_k)
+        ]}
+
+    def upsert(self, vectors=None, **kwargs):
+        time.sleep(self.latency)
+
+    def namespaces(self):
+        return [""]
+
+class _StubSearch:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def results(self, query, max_results=5):
+        time.sleep(self.latency)
+        return [{"link": f"https://example.org/{i}", "snippet": "web result"} for i in range(max_results)]
+
+def _import_rag_with_stubs(args):
+    os.environ.setdefault("QUERY_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-qc-"), "query_cache.sqlite"))
+    os.environ.setdefault("CHUNK_STORE_DIR", tempfile.mkdtemp(prefix="bench-chunks-"))
+
+    # Importing rag no longer touches Pinecone, Gemini or the model; set stubs before init_services would
+    import rag
+    rag.gemini = _StubGemini(args.llm_latency)
+    rag.embedder = _StubEmbedder(args.embed_latency)
+    rag.embedding_service = rag.EmbeddingService(rag.embedder)
+    rag.vector_store = _StubIndex(args.index_latency)
+    rag.search = _StubSearch(args.index_latency)
+    return rag
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def bench_load(args):
+    import asyncio
+    import httpx
+    from fastapi import FastAPI
+
+    rag = _import_rag_with_stubs(args)
+    app = FastAPI()
+    app.post("/rag-query")(rag.rag_query)
+    app.post("/analyze-case")(rag.analyze_case)
+    case = {"patient_history": "smoker", "current_symptoms": "chest pain", "patient_perspective": "worried",
+            "doctor_opinion": "possible MI", "specialties": ["cardiology"]}
+
+    async def run(clients: int):
+        latencies = []
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def worker(worker_id: int):
+                for i in range(args.requests):
+                    started = time.perf_counter()
+                    # Unique text per request so the query cache doesn't hide backend latency
+                    if (worker_id + i) % 2:
+                        response = await client.post("/analyze-case", json={**case, "patient_history": f"smoker {worker_id} {i}"})
+                    else:
+                        response = await client.post("/rag-query", json={"query": f"heart attack treatment {worker_id} {i}"})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(w) for w in range(clients)))
+            elapsed = time.perf_counter() - started
+        return latencies, elapsed
+
+    print(f"{'clients':>7} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for clients in (1, 2, 4, 8, 16, 32, 64):
+        latencies, elapsed = asyncio.run(run(clients))
+        print(f"{clients:>7} {_percentile(latencies, 0.5) * 1000:8.1f} {_percentile(latencies, 0.99) * 1000:8.1f} "
+              f"{len(latencies) / elapsed:8.1f}")
+
+def _clustered_vectors(rng, centers, n: int):
+    # Gaussian blobs around topic centres look more like sentence embeddings than uniform noise
+    import numpy as np
+    vectors = centers[rng.integers(0, len(centers), n)] + 1.0 * rng.standard_normal((n, centers.shape[1]))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def bench_vector_store(args):
+    import numpy as np
+    from vector_store import LocalStore, EMBEDDING_DIM
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.topics, EMBEDDING_DIM))
+    specialties = ["neurology", "cardiology", "oncology", "pediatrics"]
+    queries = _clustered_vectors(rng, centers, args.queries)
+
+    for size in args.sizes:
+        store = LocalStore(tempfile.mkdtemp(prefix="bench-vs-"), ivf_min_rows=size + 1)
+        started = time.perf_counter()
+        for start in range(0, size, 10000):
+            block = _clustered_vectors(rng, centers, min(10000, size - start))
+            store.upsert([
+                {"id": f"PMC{start + i}_0", "values": vector,
+                 "metadata": {"pmcid": f"PMC{start + i}", "specialty": specialties[(start + i) % len(specialties)],
+                              "last_updated": 1600000000 + start + i}}
+                for i, vector in enumerate(block)
+            ])
+        load_elapsed = time.perf_counter() - started
+        store.ivf_min_rows = 0
+        started = time.perf_counter()
+        store.train()
+        print(f"\n{size} vectors: load {load_elapsed:.1f}s, IVF train {time.perf_counter() - started:.1f}s")
+
+        truth = []
+        started = time.perf_counter()
+        for q in queries:
+            truth.append({m["id"] for m in store.query(q, top_k=10, include_metadata=False, exact=True)["matches"]})
+        exact_ms = (time.perf_counter() - started) / len(queries) * 1000
+        print(f"{'mode':>12} {'recall@10':>10} {'ms/query':>9}")
+        print(f"{'exact':>12} {1.0:10.3f} {exact_ms:9.2f}")
+        for nprobe in args.nprobe:
+            hits = 0
+            started = time.perf_counter()
+            for q, expected in zip(queries, truth):
+                found = {m["id"] for m in store.query(q, top_k=10, include_metadata=False, nprobe=nprobe)["matches"]}
+                hits += len(found & expected)
+            elapsed_ms = (time.perf_counter() - started) / len(queries) * 1000
+            print(f"{f'nprobe={nprobe}':>12} {hits / (10 * len(queries)):10.3f} {elapsed_ms:9.2f}")
+
+        started = time.perf_counter()
+        for q in queries:
+            store.query(q, top_k=10, filter={"specialty": {"$in": ["cardiology"]}, "last_updated": {"$gte": 1600000000 + size // 2}})
+        print(f"{'filtered':>12} {'':>10} {(time.perf_counter() - started) / len(queries) * 1000:9.2f}")
+
+class _StubSnapshot:
+    def __init__(self, doc_id: str, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data or {})
+
+class _StubDocument:
+    def __init__(self, docs: dict, path: str):
+        self.docs = docs
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return _StubFirestore(self.docs, f"{self.path}/{name}")
+
+    def get(self):
+        return _StubSnapshot(self.id, self.docs.get(self.path))
+
+    def set(self, data, merge=False):
+        from firebase_admin import firestore
+        current = self.docs.get(self.path, {}) if merge else {}
+        for field, value in data.items():
+            if isinstance(value, firestore.ArrayUnion):
+                value = current.get(field, []) + [v for v in value.values if v not in current.get(field, [])]
+            current[field] = value
+        self.docs[self.path] = current
+
+    def update(self, data):
+        from firebase_admin import firestore
+        for field, value in data.items():
+            if value is firestore.DELETE_FIELD:
+                self.docs[self.path].pop(field, None)
+            else:
+                self.docs[self.path][field] = value
+
+class _StubBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref, data, merge))
+
+    def commit(self):
+        for ref, data, merge in self.writes:
+            ref.set(data, merge=merge)
+
+class _StubFirestore:
+    # In-memory stand-in for the parts of the Firestore client index_papers uses
+    def __init__(self, docs: dict = None, path: str = ""):
+        self.docs = {} if docs is None else docs
+        self.path = path
+
+    def collection(self, name):
+        return _StubFirestore(self.docs, f"{self.path}/{name}" if self.path else name)
+
+    def document(self, name):
+        return _StubDocument(self.docs, f"{self.path}/{name}")
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+    def batch(self):
+        return _StubBatch()
+
+def bench_pipeline(args):
+    import asyncio
+
+    archives = {f"oa_package/PMC{i}.tar.gz": _make_paper_archive(i, pages=args.pages) for i in range(args.papers * 2)}
+    os.environ["PMC_BASE_URL"] = _serve_fake_pmc(archives, args.latency)
+    os.environ["PMC_ARCHIVE_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-cache-")
+    os.environ["NCBI_REQUESTS_PER_SECOND"] = str(args.rate)
+    rag = _import_rag_with_stubs(args)
+    # The generated papers share their text, which dedup would rightly skip; see `bench.py dedup`
+    rag.INDEX_DEDUP = False
+    import utils
+    from archive_cache import ArchiveCache
+
+    papers = [{"pmcid": f"PMC{i}", "file_path": file_path, "title": f"Paper {i}", "last_updated": "2024-01-01 00:00:00"}
+              for i, file_path in enumerate(archives)]
+    async def search(niche, batch_size, *args):
+        return [paper["pmcid"] for paper in papers]
+    rag.search_open_access_pmcids = search
+    rag.get_paper_metadata = lambda pmcids: papers
+
+    async def sequential(subset):
+        # The previous indexer: download, embed and upsert one paper after another
+        for paper in subset:
+            text = await utils.fetch_paper(utils.extract_pdf_text, paper["file_path"])
+            chunks = [f"[Medical Specialty: bench] {chunk}" for chunk in utils.chunk_text(text)]
+            embeddings = await rag.embed(chunks)
+            vectors = rag._paper_vectors("bench", paper, chunks, embeddings)
+            for i in range(0, len(vectors), 100):
+                await rag.run_blocking(rag.vector_store.upsert, vectors=vectors[i:i + 100])
+
+    async def run():
+        # One event loop for both runs: the rate limiter and host semaphores bind to it
+        started = time.perf_counter()
+        await sequential(papers[:args.papers])
+        sequential_elapsed = time.perf_counter() - started
+
+        # Fresh archive cache and membership so the pipelined run downloads everything too
+        utils.archive_cache = ArchiveCache(tempfile.mkdtemp(prefix="bench-cache-"), utils.archive_cache.max_bytes)
+        started = time.perf_counter()
+        db = _StubFirestore()
+        runs = []
+        # The second run resumes with the papers the first left over; by the third
+        # nothing has changed upstream and the ledger makes it a no-op
+        for _ in range(3):
+            started = time.perf_counter()
+            result = await rag.index_papers({"niche": "bench", "num_papers": args.papers}, db)
+            runs.append((result["message"], time.perf_counter() - started))
+        return sequential_elapsed, runs
+
+    sequential_elapsed, runs = asyncio.run(run())
+    print(f"sequential: {args.papers} papers in {sequential_elapsed:.2f}s ({args.papers / sequential_elapsed * 60:.1f} papers/min)")
+    message, elapsed = runs[0]
+    print(f"pipelined:  {message} in {elapsed:.2f}s ({args.papers / elapsed * 60:.1f} papers/min)")
+    for label, (message, elapsed) in zip(("resumed:", "no-op:"), runs[1:]):
+        print(f"{label:<11} {message} in {elapsed:.2f}s")
+
+def _make_long_pdf(i: int, pages: int, reference_pages: int) -> bytes:
+    import fitz
+
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page()
+        lines = [f"Paper {i} page {page_no}."] + ["Clinical findings were consistent across cohorts."] * 45
+        if page_no == pages - reference_pages:
+            lines = ["Discussion continues here.", "References"] + [f"{n}. Author A. Title. J Med. 2020." for n in range(40)]
+        page.insert_text((40, 40), "\n".join(lines), fontsize=9)
+    pdf = doc.tobytes()
+    doc.close()
+    return pdf
+
+def bench_pdf(args):
+    import asyncio
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import utils
+
+    # No sample PDFs ship with the repo, so generate text-dense ones with a reference list at the end
+    pdfs = [_make_long_pdf(i, args.pages, args.reference_pages) for i in range(args.docs)]
+    total_pages = args.docs * args.pages
+
+    def concatenate():
+        # The previous extract_pdf_text loop
+        import fitz
+        for pdf in pdfs:
+            doc = fitz.open(stream=pdf, filetype="pdf")
+            text = ""
+            for page in doc:
+                text += page.get_text("text")
+            doc.close()
+
+    print(f"{'mode':>24} {'pages/s':>9}")
+    elapsed = _timeit(concatenate, repeat=1)
+    print(f"{'serial +=':>24} {total_pages / elapsed:9.1f}")
+    elapsed = _timeit(lambda: [utils.pdf_bytes_to_text(pdf, skip_back_matter=False) for pdf in pdfs], repeat=1)
+    print(f"{'serial join':>24} {total_pages / elapsed:9.1f}")
+    elapsed = _timeit(lambda: [utils.pdf_bytes_to_text(pdf, skip_back_matter=True) for pdf in pdfs], repeat=1)
+    print(f"{'serial join, skip refs':>24} {total_pages / elapsed:9.1f}")
+
+    async def parse_all():
+        return await asyncio.gather(*(utils.parse_pdf(pdf) for pdf in pdfs))
+
+    for workers in args.workers:
+        utils.process_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        asyncio.run(parse_all())  # start the workers outside the timed run
+        elapsed = _timeit(lambda: asyncio.run(parse_all()), repeat=1)
+        utils.process_executor.shutdown()
+        print(f"{f'pool, {workers} processes':>24} {total_pages / elapsed:9.1f}")
+
+def _serve_fake_esearch(per_window: int, latency: float) -> str:
+    # Stand-in for eutils ESearch: every year-long window holds per_window papers,
+    # numbered from the window's maxdate so neighbouring windows don't collide
+    import json
+    from urllib.parse import parse_qs, urlparse
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            maxdate = query.get("maxdate") or query["WebEnv"]
+            base = int(maxdate.replace("/", "")) * 1000
+            retstart = int(query.get("retstart", 0))
+            retmax = min(int(query.get("retmax", 20)), max(per_window - retstart, 0))
+            body = json.dumps({"esearchresult": {
+                "count": str(per_window),
+                "idlist": [str(base + i) for i in range(retstart, retstart + retmax)],
+                "webenv": maxdate,
+                "querykey": "1"
+            }}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/entrez/eutils"
+
+def bench_search(args):
+    import asyncio
+
+    os.environ["NCBI_EUTILS_URL"] = _serve_fake_esearch(args.per_window, args.latency)
+    os.environ["NCBI_REQUESTS_PER_SECOND"] = str(args.rate)
+    import utils
+
+    print(f"{'papers':>7} {'serial s':>9} {'windowed s':>11} {'history s':>10}")
+    for num_papers in args.papers:
+        started = time.perf_counter()
+        serial = utils.fetch_open_access_pmcids("neurology", num_papers, "2025/01/01")
+        serial_elapsed = time.perf_counter() - started
+
+        async def windowed(use_history: bool):
+            utils.PMC_SEARCH_USE_HISTORY = use_history
+            started = time.perf_counter()
+            pmcids = await utils.search_open_access_pmcids("neurology", num_papers, "2025/01/01")
+            return pmcids, time.perf_counter() - started
+
+        async def run():
+            return await windowed(False), await windowed(True)
+
+        (plain, plain_elapsed), (history, history_elapsed) = asyncio.run(run())
+        assert plain == history == list(dict.fromkeys(serial)), "windowed search returned different PMCIDs"
+        print(f"{num_papers:>7} {serial_elapsed:9.2f} {plain_elapsed:11.2f} {history_elapsed:10.2f}")
+
+def bench_stream(args):
+    import asyncio
+    import socket
+    import httpx
+    import uvicorn
+    from fastapi import FastAPI
+
+    rag = _import_rag_with_stubs(args)
+    app = FastAPI()
+    app.post("/rag-query")(rag.rag_query)
+    app.post("/analyze-case")(rag.analyze_case)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    case = {"patient_history": "smoker", "current_symptoms": "chest pain", "patient_perspective": "worried",
+            "doctor_opinion": "possible MI", "specialties": ["cardiology"]}
+
+    async def measure(client, path: str, body: dict):
+        started = time.perf_counter()
+        async with client.stream("POST", path, json=body) as response:
+            response.raise_for_status()
+            first_byte = None
+            async for _ in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+        return first_byte, time.perf_counter() - started
+
+    async def run():
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            print(f"{'endpoint':>14} {'mode':>6} {'ttfb ms':>8} {'total ms':>9}")
+            for path in ("/rag-query", "/analyze-case"):
+                for stream in (False, True):
+                    samples = []
+                    for i in range(args.requests):
+                        # Unique text per request so neither cache answers it
+                        body = ({"query": f"heart attack treatment {stream} {i}"} if path == "/rag-query"
+                                else {**case, "patient_history": f"smoker {stream} {i}"})
+                        samples.append(await measure(client, path, {**body, "stream": stream}))
+                    ttfb = statistics.median(sample[0] for sample in samples)
+                    total = statistics.median(sample[1] for sample in samples)
+                    print(f"{path:>14} {'sse' if stream else 'json':>6} {ttfb * 1000:8.1f} {total * 1000:9.1f}")
+
+    asyncio.run(run())
+    server.should_exit = True
+
+def bench_batch(args):
+    import asyncio
+    import json
+    import httpx
+    from fastapi import FastAPI
+
+    rag = _import_rag_with_stubs(args)
+    app = FastAPI()
+    app.post("/rag-query")(rag.rag_query)
+    app.post("/rag-query/batch")(rag.rag_query_batch)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Unique questions per mode so neither run is served from the caches
+            started = time.perf_counter()
+            for i in range(args.queries):
+                response = await client.post("/rag-query", json={"query": f"heart attack treatment one-by-one {i}"})
+                response.raise_for_status()
+            one_by_one = time.perf_counter() - started
+
+            started = time.perf_counter()
+            response = await client.post("/rag-query/batch", json={"queries": [f"heart attack treatment batch {i}" for i in range(args.queries)]})
+            response.raise_for_status()
+            batch = time.perf_counter() - started
+            answers = [json.loads(line) for line in response.text.splitlines()]
+            assert sorted(answer["index"] for answer in answers) == list(range(args.queries))
+            assert not any("error" in answer for answer in answers)
+        return one_by_one, batch
+
+    one_by_one, batch = asyncio.run(run())
+    print(f"one by one: {args.queries} queries in {one_by_one:.2f}s ({args.queries / one_by_one:.1f} q/s)")
+    print(f"batch:      {args.queries} queries in {batch:.2f}s ({args.queries / batch:.1f} q/s, "
+          f"{rag.RAG_BATCH_GENERATION_CONCURRENCY} concurrent generations)")
+
+def bench_startup(args):
+    import socket
+    import subprocess
+    import sys
+    import urllib.error
+    import urllib.request
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=here,
+                            capture_output=True, text=True)
+    # Children are printed before their parent, one extra indent (two spaces) per level
+    children, total, direct, started_main = [], 0, [], False
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative), name.strip()))
+        elif name.strip() == "main":
+            total, direct = int(cumulative), children
+        elif name.strip() == "site" and not started_main:
+            # Interpreter start-up ends at the first site import; what follows is import main
+            children = []
+            started_main = True
+    if result.returncode:
+        print(result.stderr.splitlines()[-1])
+    print(f"import main: {total / 1000:.0f} ms")
+    for cumulative, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms {name}")
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    def status(path: str) -> int:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return 0
+
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                              cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        live = ready = None
+        while time.perf_counter() - started < args.timeout and ready is None:
+            if live is None and status("/healthz") == 200:
+                live = time.perf_counter() - started
+            if live is not None and status("/readyz") == 200:
+                ready = time.perf_counter() - started
+            time.sleep(0.05)
+        print(f"live (/healthz):  {f'{live:.2f}s' if live is not None else 'timed out'}")
+        if ready is not None:
+            print(f"ready (/readyz):  {ready:.2f}s")
+        else:
+            # Usually missing credentials in a bench environment; show which dependency is holding it up
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1)
+            except urllib.error.HTTPError as e:
+                print(f"ready (/readyz):  not ready after {args.timeout:.0f}s: {e.read().decode()}")
+            except OSError as e:
+                print(f"ready (/readyz):  unreachable: {e}")
+    finally:
+        server.terminate()
+        server.wait()
+
+def _bench_texts(n: int, seed: int = 0):
+    # Chunk-like passages of varied length, so batches carry realistic padding
+    rng = random.Random(seed)
+    words = ("patients myocardial infarction treatment randomized trial dose mortality cohort risk "
+             "inflammation biomarker therapy outcome clinical receptor diagnosis chronic acute "
+             "hypertension insulin tumor response adverse events follow-up imaging").split()
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(8, 200))) for _ in range(n)]
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def _embed_worker(args):
+    # One backend per process, so resident memory isn't shared between the two
+    import json
+    import numpy as np
+
+    texts = _bench_texts(args.texts)
+    before = _rss_mb()
+    started = time.perf_counter()
+    if args.worker == "onnx":
+        from onnx_embedder import OnnxEmbedder
+        model = OnnxEmbedder(model_path=args.onnx_model)
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+    loaded = time.perf_counter() - started
+    model.encode(texts[:args.batch], batch_size=args.batch)
+
+    started = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=args.batch)
+    elapsed = time.perf_counter() - started
+    latencies = []
+    for text in texts[:args.latency_samples]:
+        started = time.perf_counter()
+        model.encode([text])
+        latencies.append(time.perf_counter() - started)
+    np.save(args.dump, np.asarray(embeddings, dtype=np.float32))
+    print(json.dumps({"load": loaded, "throughput": len(texts) / elapsed, "p50": _percentile(latencies, 0.5),
+                      "p99": _percentile(latencies, 0.99), "rss": _rss_mb() - before}))
+
+def bench_embedding(args):
+    import json
+    import subprocess
+    import sys
+    import numpy as np
+
+    if args.worker:
+        return _embed_worker(args)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    tmpdir = tempfile.mkdtemp(prefix="bench-embed-")
+    results, embeddings = {}, {}
+    for backend in args.backends:
+        dump = os.path.join(tmpdir, f"{backend}.npy")
+        command = [sys.executable, os.path.abspath(__file__), "embedding", "--worker", backend, "--dump", dump,
+                   "--texts", str(args.texts), "--batch", str(args.batch), "--latency-samples", str(args.latency_samples)]
+        if args.onnx_model:
+            command += ["--onnx-model", args.onnx_model]
+        result = subprocess.run(command, cwd=here, capture_output=True, text=True)
+        if result.returncode:
+            print(f"{backend}: failed: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode}")
+            continue
+        results[backend] = json.loads(result.stdout.strip().splitlines()[-1])
+        embeddings[backend] = np.load(dump)
+
+    print(f"{args.texts} texts, batch {args.batch}")
+    for backend, result in results.items():
+        print(f"{backend:6s} load {result['load']:5.1f}s  {result['throughput']:7.1f} texts/s  "
+              f"single p50 {result['p50'] * 1000:6.1f} ms  p99 {result['p99'] * 1000:6.1f} ms  RSS +{result['rss']:.0f} MB")
+    if "torch" in embeddings and "onnx" in embeddings:
+        # Both backends return unit vectors, so the row-wise dot product is the cosine
+        cosines = (embeddings["torch"] * embeddings["onnx"]).sum(axis=1)
+        print(f"cosine(torch, onnx): mean {cosines.mean():.4f}  min {cosines.min():.4f}  "
+              f"p1 {np.percentile(cosines, 1):.4f}")
+
+def _bench_paper(rng, words, sentences: int) -> str:
+    return " ".join(" ".join(rng.choice(words) for _ in range(rng.randint(8, 25))).capitalize() + "."
+                    for _ in range(sentences))
+
+def bench_dedup(args):
+    from dedup import ChunkDeduplicator
+    from utils import chunk_text
+
+    rng = random.Random(0)
+    words = [f"{a}{b}" for a in ("cardio", "neuro", "onco", "hepato", "nephro", "derma", "immuno", "endo")
+             for b in ("logy", "pathy", "genic", "toxic", "vascular", "cyte", "plasty", "megaly", "itis", "trophic")]
+    words += "patients treatment trial dose mortality cohort risk outcome therapy diagnosis with of in the and".split()
+    # Journal back matter PMC PDFs repeat across papers: licence, funding and conflict templates, about-the-journal
+    boilerplate = _bench_paper(random.Random(1), words, 40)
+
+    def corpus(with_duplicates: bool):
+        papers = []
+        for i in range(args.papers):
+            text = _bench_paper(rng, words, args.sentences)
+            if with_duplicates:
+                text += f" Page {i} " + boilerplate
+                if rng.random() < args.repeat_fraction:
+                    # A section the PDF carries twice, e.g. a structured abstract reprinted in the body
+                    text += " " + text[:3000]
+            papers.append((f"PMC{i}", text))
+        if with_duplicates:
+            # Reprints and corrections: the same article under another PMCID, page numbers changed
+            for i in range(int(args.papers * args.reprint_fraction)):
+                papers.append((f"PMC{args.papers + i}", papers[i][1].replace(f"Page {i} ", f"Page {i + 7} ")))
+        return papers
+
+    for label, with_duplicates in (("unique text", False), ("with boilerplate", True)):
+        deduplicator = ChunkDeduplicator(os.path.join(tempfile.mkdtemp(prefix="bench-dedup-"), "signatures.sqlite"))
+        totals = {"chunks": 0, "repeated_in_paper": 0, "already_indexed": 0}
+        papers = corpus(with_duplicates)
+        started = time.perf_counter()
+        for pmcid, text in papers:
+            _, counts = deduplicator.filter("cardiology", pmcid, chunk_text(text))
+            for key, count in counts.items():
+                totals[key] += count
+        elapsed = time.perf_counter() - started
+        dropped = totals["repeated_in_paper"] + totals["already_indexed"]
+        print(f"{label}: {len(papers)} papers, {totals['chunks']} chunks, {dropped} skipped "
+              f"({totals['repeated_in_paper']} in paper, {totals['already_indexed']} across corpus, "
+              f"{dropped / totals['chunks']:.1%} fewer embeddings and vectors); "
+              f"dedup {elapsed / totals['chunks'] * 1000:.2f} ms/chunk, "
+              f"~{dropped * args.embed_ms / 1000:.1f}s of embedding saved at {args.embed_ms:.0f} ms/chunk")
+
+def _jats_paper(rng, i: int, facts: list, syllables: list, sections: int, paragraphs: int):
+    # A JATS article plus the text a PDF of it would give: running page headers,
+    # a table as loose numbers, acknowledgements and the reference list
+    from xml.sax.saxutils import escape
+
+    def sentence():
+        words = [rng.choice(syllables) + rng.choice(syllables) for _ in range(rng.randint(8, 22))]
+        return " ".join(words).capitalize() + "."
+
+    body, flat = [], [f"Synthetic article {i}", "Abstract"]
+    abstract = " ".join(sentence() for _ in range(6))
+    flat.append(abstract)
+    fact_sentences = [f"In the {cohort} cohort, {drug} reduced {outcome} by {n} percent." for cohort, drug, outcome, n in facts]
+    slots = rng.sample(range(sections * paragraphs), len(facts))
+    for s in range(sections):
+        title = ["Introduction", "Methods", "Results", "Discussion", "Conclusions"][s % 5]
+        flat.append(title)
+        paras = []
+        for p in range(paragraphs):
+            sentences = [sentence() for _ in range(rng.randint(3, 9))]
+            if s * paragraphs + p in slots:
+                sentences.insert(rng.randint(0, len(sentences)), fact_sentences[slots.index(s * paragraphs + p)])
+            citation = f' <xref ref-type="bibr" rid="r{p}">{p + 1}</xref>'
+            paras.append(f"<p>{escape(' '.join(sentences))}{citation}</p>")
+            flat.append(" ".join(sentences) + f" [{p + 1}]")
+        if s == 2:
+            cells = " ".join(f"{rng.uniform(0, 100):.1f}" for _ in range(60))
+            paras.append(f"<table-wrap><caption><p>Baseline characteristics</p></caption><table><tr><td>{cells}</td></tr></table></table-wrap>")
+            flat.append(f"Table 1 Baseline characteristics {cells}")
+        body.append(f"<sec><title>{title}</title>{''.join(paras)}</sec>")
+    # Citations talk about the same things the facts do, which is what makes them distracting
+    refs = [f"Author{r} A, Other B, et al. Long-term {facts[r % len(facts)][2]} in the {facts[r % len(facts)][0]} population. "
+            f"J Synth Med. 20{10 + r % 14};{r}:{100 + r}-{110 + r}." for r in range(40)]
+    acknowledgements = "We thank the participants. Funding was provided by the synthetic research council. The authors declare no competing interests."
+    flat += ["Acknowledgements", acknowledgements, "References"] + [f"{r + 1}. {ref}" for r, ref in enumerate(refs)]
+    nxml = (f"<article><front><article-meta><title-group><article-title>Synthetic article {i}</article-title></title-group>"
+            f"<abstract><p>{escape(abstract)}</p></abstract></article-meta></front><body>{''.join(body)}</body>"
+            f"<back><ack><p>{acknowledgements}</p></ack><ref-list>"
+            + "".join(f'<ref id="r{r}"><mixed-citation>{escape(ref)}</mixed-citation></ref>' for r, ref in enumerate(refs))
+            + "</ref-list></back></article>")
+
+    # PyMuPDF text comes page by page, each with the journal's running header
+    text = "\n".join(flat)
+    pages = [f"J Synth Med 2024; {i}: page {n + 1}\n" + text[start:start + 3500]
+             for n, start in enumerate(range(0, len(text), 3500))]
+    return nxml.encode(), pages
+
+class _HashingEmbedder:
+    # TF-IDF stand-in when no model is available: lexical, but it sees the same
+    # 256-token window the model would, so truncated chunks lose their tails.
+    # Wide, so hash collisions don't blur the rare words retrieval hinges on.
+    dim = 1 << 14
+
+    def __init__(self, count_tokens):
+        self.count_tokens = count_tokens
+        self.idf = None
+
+    def _counts(self, texts):
+        import zlib
+        import numpy as np
+        counts = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            used = 2
+            for word in text.lower().split():
+                used += self.count_tokens(word)
+                if used > 256:
+                    break
+                counts[row, zlib.crc32(word.strip(".,;:?()[]").encode()) % self.dim] += 1
+        return counts
+
+    def encode(self, texts, fit: bool = False, **kwargs):
+        import numpy as np
+        counts = self._counts(texts)
+        if fit:
+            self.idf = np.log((1 + len(texts)) / (1 + (counts > 0).sum(axis=0))) + 1
+        vectors = counts * self.idf
+        return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9, None)
+
+def bench_chunking(args):
+    import io
+    import tracemalloc
+    import numpy as np
+    import xml.etree.ElementTree as ET
+    from chunking import iter_nxml_chunks, token_counter
+    from utils import _join_pages, chunk_text, PDF_SKIP_BACK_MATTER, PDF_MAX_TEXT_CHARS
+
+    count_tokens = token_counter()
+    rng = random.Random(0)
+    syllables = ["car", "dio", "neu", "ro", "pa", "thy", "gen", "ic", "vas", "cu", "lar", "on", "co", "lo", "gy", "im", "mu", "no"]
+    outcomes = ["mortality", "readmission", "stroke", "infarction", "hospitalisation", "relapse", "seizures", "bleeding"]
+    papers, facts = [], []
+    for i in range(args.papers):
+        paper_facts = [(f"cohort{i}x{f}", f"drug{i}x{f}", rng.choice(outcomes), rng.randint(5, 60)) for f in range(args.facts)]
+        papers.append(_jats_paper(rng, i, paper_facts, syllables, args.sections, args.paragraphs))
+        facts += paper_facts
+
+    prefix = "[Medical Specialty: cardiology] "
+    chunkers = {
+        "chars": lambda nxml, pages: chunk_text(_join_pages(pages, PDF_SKIP_BACK_MATTER, PDF_MAX_TEXT_CHARS)),
+        "nxml": lambda nxml, pages: list(iter_nxml_chunks(io.BytesIO(nxml), count_tokens=count_tokens)),
+    }
+    if args.backend == "hashing":
+        embedder = _HashingEmbedder(count_tokens)
+    elif args.backend == "onnx":
+        from onnx_embedder import OnnxEmbedder
+        embedder = OnnxEmbedder()
+    else:
+        from sentence_transformers import SentenceTransformer
+        embedder = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+    queries = [f"How much did the treatment reduce {outcome} in the {cohort} cohort?" for cohort, _, outcome, _ in facts]
+
+    print(f"{args.papers} papers, {len(facts)} facts, {args.backend} embeddings")
+    for name, chunker in chunkers.items():
+        started = time.perf_counter()
+        chunks = [prefix + chunk for nxml, pages in papers for chunk in chunker(nxml, pages)]
+        chunking = time.perf_counter() - started
+        tokens = [count_tokens(chunk) + 2 for chunk in chunks]
+        started = time.perf_counter()
+        if args.backend == "hashing":
+            vectors = embedder.encode(chunks, fit=True)
+        else:
+            vectors = embedder.encode(chunks, batch_size=64)
+        embedding = time.perf_counter() - started
+
+        scores = embedder.encode(queries) @ vectors.T
+        hits1 = hits5 = reciprocal = references = 0
+        for row, (_, drug, _, _) in enumerate(facts):
+            ranked = np.argsort(-scores[row])[:10]
+            relevant = [rank for rank, c in enumerate(ranked) if drug + " " in chunks[c]]
+            hits1 += bool(relevant) and relevant[0] == 0
+            hits5 += bool(relevant) and relevant[0] < 5
+            reciprocal += 1 / (relevant[0] + 1) if relevant else 0
+            references += sum("et al." in chunks[c] for c in ranked[:5])
+        print(f"{name:5s} {len(chunks):6d} chunks, {statistics.mean(tokens):5.0f} tokens avg, "
+              f"{sum(t > 256 for t in tokens)} over 256 ({sum(max(0, t - 256) for t in tokens)} tokens never embedded); "
+              f"chunking {chunking:.2f}s, embedding {embedding:.2f}s")
+        print(f"      recall@1 {hits1 / len(facts):.3f}  recall@5 {hits5 / len(facts):.3f}  MRR@10 {reciprocal / len(facts):.3f}  "
+              f"reference chunks in top 5: {references / (5 * len(facts)):.1%}")
+
+    # Peak memory on one very long paper: streaming chunker vs parsing the whole tree first
+    nxml, _ = _jats_paper(random.Random(1), 0, [("c", "d", "stroke", 1)], syllables, 5, args.paragraphs * 200)
+    for label, run in (("streaming", lambda: sum(1 for _ in iter_nxml_chunks(io.BytesIO(nxml), count_tokens=count_tokens))),
+                       ("whole tree", lambda: len(ET.fromstring(nxml)))):
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{len(nxml) / 1e6:.1f} MB NXML, {label}: peak {peak / 1e6:.1f} MB")
+
+def bench_chunk_store(args):
+    import json
+    import numpy as np
+    from chunk_store import ChunkStore
+
+    rng = random.Random(0)
+    vocabulary = [rng.choice("bcdfghklmnprstv") + rng.choice("aeiou") + rng.choice("lmnrst") + rng.choice("aeiouy")
+                  for _ in range(3000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    def paper_chunks(i):
+        # Zipf-distributed words, roughly the redundancy of real article text
+        title = " ".join(rng.choices(vocabulary, weights, k=12)).capitalize()
+        return title, ["[Medical Specialty: cardiology] " + " ".join(rng.choices(vocabulary, weights, k=170))
+                       for _ in range(args.chunks_per_paper)]
+
+    store = ChunkStore(tempfile.mkdtemp(prefix="bench-chunk-store-"))
+    raw = 0
+    ids = []
+    started = time.perf_counter()
+    for i in range(args.papers):
+        title, chunks = paper_chunks(i)
+        records = {f"PMC{i}_{c}": {"title": title, "text": chunk} for c, chunk in enumerate(chunks)}
+        raw += sum(len(json.dumps(record).encode()) for record in records.values())
+        store.put(records)
+        ids += records
+    written = time.perf_counter() - started
+    stats = store.stats()
+
+    vector = np.random.default_rng(0).standard_normal(384).tolist()
+    old_metadata = {"pmcid": "PMC1", "title": title, "specialty": "cardiology", "chunk_id": 0, "text": chunks[0],
+                    "last_updated": 1700000000}
+    new_metadata = {key: value for key, value in old_metadata.items() if key not in ("title", "text")}
+    old_vector = len(json.dumps({"id": "PMC1_0", "values": vector, "metadata": old_metadata}))
+    new_vector = len(json.dumps({"id": "PMC1_0", "values": vector, "metadata": new_metadata}))
+    old_match = len(json.dumps({"id": "PMC1_0", "score": 0.9, "metadata": old_metadata}))
+    new_match = len(json.dumps({"id": "PMC1_0", "score": 0.9, "metadata": new_metadata}))
+
+    latencies = []
+    for _ in range(args.queries):
+        top_k = rng.sample(ids, args.top_k)
+        started = time.perf_counter()
+        assert len(store.get(top_k)) == args.top_k
+        latencies.append(time.perf_counter() - started)
+
+    print(f"{len(ids)} chunks written in {written:.2f}s: {raw / 1e6:.1f} MB of records in {stats['bytes'] / 1e6:.1f} MB "
+          f"of segments ({raw / stats['bytes']:.1f}x)")
+    print(f"upsert payload per vector: {old_vector} -> {new_vector} bytes; "
+          f"query response per match: {old_match} -> {new_match} bytes")
+    print(f"top-{args.top_k} text fetch: p50 {_percentile(latencies, 0.5) * 1000:.2f} ms  "
+          f"p99 {_percentile(latencies, 0.99) * 1000:.2f} ms")
+
+def bench_partitions(args):
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    from vector_store import LocalStore, EMBEDDING_DIM
+
+    rng = np.random.default_rng(0)
+    specialties = [f"specialty{s}" for s in range(args.specialties)]
+    # Each specialty has its own topics, so a query's neighbours are mostly in one partition
+    centers = {name: rng.standard_normal((args.topics, EMBEDDING_DIM)) for name in specialties}
+    single = LocalStore(tempfile.mkdtemp(prefix="bench-single-"))
+    partitioned = LocalStore(tempfile.mkdtemp(prefix="bench-partitioned-"))
+    started = time.perf_counter()
+    for name in specialties:
+        vectors = [{"id": f"{name}_{i}", "values": vector, "metadata": {"specialty": name, "last_updated": 0}}
+                   for i, vector in enumerate(_clustered_vectors(rng, centers[name], args.vectors))]
+        single.upsert(vectors)
+        partitioned.upsert(vectors, namespace=name)
+    print(f"{args.specialties} specialties x {args.vectors} vectors loaded in {time.perf_counter() - started:.1f}s")
+
+    # Stand-in for the specialty-name embeddings rag_query routes on: each specialty's mean direction
+    directions = np.stack([centers[name].mean(axis=0) for name in specialties])
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    targets = rng.integers(0, len(specialties), args.queries)
+    queries = [_clustered_vectors(rng, centers[specialties[t]], 1)[0] for t in targets]
+    truth = [{m["id"] for m in single.query(q, top_k=10, include_metadata=False, exact=True)["matches"]} for q in queries]
+    pool = ThreadPoolExecutor(max_workers=args.specialties)
+
+    def fan_out(q, namespaces, filter=None):
+        responses = list(pool.map(lambda namespace: partitioned.query(q, top_k=10, include_metadata=False,
+                                                                       filter=filter, namespace=namespace), namespaces))
+        return sorted((m for r in responses for m in r["matches"]), key=lambda m: m["score"], reverse=True)[:10]
+
+    modes = {
+        "one index, no filter (rag_query before)": lambda q, t: single.query(q, top_k=10, include_metadata=False)["matches"],
+        "one index, specialty filter (analyze_case before)": lambda q, t: single.query(
+            q, top_k=10, include_metadata=False, filter={"specialty": {"$in": [specialties[t]]}})["matches"],
+        "fan-out, all partitions": lambda q, t: fan_out(q, specialties),
+        "fan-out, given specialty (analyze_case)": lambda q, t: fan_out(q, [specialties[t]]),
+        f"fan-out, routed to top {args.route}": lambda q, t: fan_out(
+            q, [specialties[r] for r in np.argsort(-(directions @ q))[:args.route]]),
+    }
+    print(f"{'mode':>50} {'recall@10':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, run in modes.items():
+        latencies, hits = [], 0
+        for q, t, expected in zip(queries, targets, truth):
+            started = time.perf_counter()
+            found = run(q, t)
+            latencies.append(time.perf_counter() - started)
+            hits += len({m["id"] for m in found} & expected)
+        print(f"{label:>50} {hits / (10 * len(queries)):10.3f} {_percentile(latencies, 0.5) * 1000:8.2f} "
+              f"{_percentile(latencies, 0.99) * 1000:8.2f}")
+    pool.shutdown()
+
+BENCHMARKS = {
+    "oa-index": bench_oa_index,
+    "fetch": bench_fetch,
+    "load": bench_load,
+    "vector-store": bench_vector_store,
+    "pipeline": bench_pipeline,
+    "pdf": bench_pdf,
+    "search": bench_search,
+    "stream": bench_stream,
+    "batch": bench_batch,
+    "startup": bench_startup,
+    "embedding": bench_embedding,
+    "dedup": bench_dedup,
+    "chunking": bench_chunking,
+    "chunk-store": bench_chunk_store,
+    "partitions": bench_partitions,
+}
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="MedAlpine rag-sv benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    oa_parser = subparsers.add_parser("oa-index", help="OA file list lookup latency")
+    oa_parser.add_argument("--rows", type=int, default=1000000)
+    oa_parser.add_argument("--baseline", action="store_true", help="also time the old CSV scan")
+
+    fetch_parser = subparsers.add_parser("fetch", help="serial vs concurrent paper extraction against a fake PMC host")
+    fetch_parser.add_argument("--papers", type=int, default=30)
+    fetch_parser.add_argument("--latency", type=float, default=0.2, help="seconds of server latency per request")
+    fetch_parser.add_argument("--rate", type=float, default=10, help="NCBI requests per second")
+
+    load_parser = subparsers.add_parser("load", help="p50/p99 latency of /rag-query and /analyze-case vs concurrent clients")
+    load_parser.add_argument("--requests", type=int, default=10, help="requests per client")
+    load_parser.add_argument("--llm-latency", type=float, default=0.3)
+    load_parser.add_argument("--embed-latency", type=float, default=0.005)
+    load_parser.add_argument("--index-latency", type=float, default=0.05)
+
+    vs_parser = subparsers.add_parser("vector-store", help="local vector store recall vs latency against brute force")
+    vs_parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    vs_parser.add_argument("--queries", type=int, default=100)
+    vs_parser.add_argument("--topics", type=int, default=2000)
+    vs_parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="papers/minute of the sequential vs pipelined indexer")
+    pipeline_parser.add_argument("--papers", type=int, default=30)
+    pipeline_parser.add_argument("--pages", type=int, default=20)
+    pipeline_parser.add_argument("--latency", type=float, default=0.2, help="seconds of server latency per request")
+    pipeline_parser.add_argument("--rate", type=float, default=10, help="NCBI requests per second")
+    pipeline_parser.add_argument("--llm-latency", type=float, default=0.0)
+    pipeline_parser.add_argument("--embed-latency", type=float, default=0.05)
+    pipeline_parser.add_argument("--index-latency", type=float, default=0.05)
+
+    pdf_parser = subparsers.add_parser("pdf", help="PDF text extraction pages/sec, serial vs process pool")
+    pdf_parser.add_argument("--docs", type=int, default=8)
+    pdf_parser.add_argument("--pages", type=int, default=60)
+    pdf_parser.add_argument("--reference-pages", type=int, default=6)
+    pdf_parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+
+    search_parser = subparsers.add_parser("search", help="serial vs windowed ESearch against a fake eutils host")
+    search_parser.add_argument("--papers", type=int, nargs="+", default=[60, 500, 2000])
+    search_parser.add_argument("--per-window", type=int, default=400, help="papers per year-long window")
+    search_parser.add_argument("--latency", type=float, default=0.3, help="seconds of server latency per request")
+    search_parser.add_argument("--rate", type=float, default=10, help="NCBI requests per second")
+
+    stream_parser = subparsers.add_parser("stream", help="time to first byte of JSON vs SSE answers over HTTP")
+    stream_parser.add_argument("--requests", type=int, default=5)
+    stream_parser.add_argument("--llm-latency", type=float, default=2.0, help="seconds to generate a full answer")
+    stream_parser.add_argument("--embed-latency", type=float, default=0.005)
+    stream_parser.add_argument("--index-latency", type=float, default=0.05)
+
+    batch_parser = subparsers.add_parser("batch", help="sequential /rag-query calls vs one /rag-query/batch call")
+    batch_parser.add_argument("--queries", type=int, default=100)
+    batch_parser.add_argument("--llm-latency", type=float, default=0.3)
+    batch_parser.add_argument("--embed-latency", type=float, default=0.005)
+    batch_parser.add_argument("--index-latency", type=float, default=0.05)
+
+    startup_parser = subparsers.add_parser("startup", help="import time of main and time until /healthz and /readyz answer")
+    startup_parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    startup_parser.add_argument("--timeout", type=float, default=60)
+
+    embedding_parser = subparsers.add_parser("embedding", help="throughput, latency, RSS and cosine agreement of torch vs int8 ONNX embeddings")
+    embedding_parser.add_argument("--texts", type=int, default=1000)
+    embedding_parser.add_argument("--batch", type=int, default=64)
+    embedding_parser.add_argument("--latency-samples", type=int, default=100)
+    embedding_parser.add_argument("--backends", nargs="+", choices=["torch", "onnx"], default=["torch", "onnx"])
+    embedding_parser.add_argument("--onnx-model", help="local ONNX file, default is the published int8 export")
+    embedding_parser.add_argument("--worker", choices=["torch", "onnx"], help=argparse.SUPPRESS)
+    embedding_parser.add_argument("--dump", help=argparse.SUPPRESS)
+
+    dedup_parser = subparsers.add_parser("dedup", help="chunks and embeddings saved by near-duplicate elimination")
+    dedup_parser.add_argument("--papers", type=int, default=300)
+    dedup_parser.add_argument("--sentences", type=int, default=120, help="unique sentences per paper")
+    dedup_parser.add_argument("--reprint-fraction", type=float, default=0.05, help="papers also indexed under a second PMCID")
+    dedup_parser.add_argument("--repeat-fraction", type=float, default=0.2, help="papers carrying a section twice")
+    dedup_parser.add_argument("--embed-ms", type=float, default=15, help="CPU embedding cost per chunk, for the estimate")
+
+    chunking_parser = subparsers.add_parser("chunking", help="character windows vs NXML chunks: count, embedding time, retrieval")
+    chunking_parser.add_argument("--papers", type=int, default=50)
+    chunking_parser.add_argument("--facts", type=int, default=5, help="answerable facts per paper, one query each")
+    chunking_parser.add_argument("--sections", type=int, default=5)
+    chunking_parser.add_argument("--paragraphs", type=int, default=6, help="paragraphs per section")
+    chunking_parser.add_argument("--backend", choices=["torch", "onnx", "hashing"], default="torch",
+                                 help="hashing is a lexical stand-in for hosts without the model")
+
+    chunk_store_parser = subparsers.add_parser("chunk-store", help="compression, payload size and top-k fetch latency of the chunk store")
+    chunk_store_parser.add_argument("--papers", type=int, default=2000)
+    chunk_store_parser.add_argument("--chunks-per-paper", type=int, default=40)
+    chunk_store_parser.add_argument("--queries", type=int, default=500)
+    chunk_store_parser.add_argument("--top-k", type=int, default=10)
+
+    partitions_parser = subparsers.add_parser("partitions", help="one index vs per-specialty namespaces with fan-out and routing")
+    partitions_parser.add_argument("--specialties", type=int, default=16)
+    partitions_parser.add_argument("--vectors", type=int, default=10000, help="vectors per specialty")
+    partitions_parser.add_argument("--topics", type=int, default=50, help="topic centres per specialty")
+    partitions_parser.add_argument("--queries", type=int, default=200)
+    partitions_parser.add_argument("--route", type=int, default=2, help="specialties a routed query searches")
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
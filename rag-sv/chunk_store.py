@@ -0,0 +1,150 @@
+import os
+import json
+import mmap
+import fcntl
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Tuple
+import zstandard
+from dotenv import load_dotenv
+from vector_store import VECTOR_STORE
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", os.path.join(os.path.dirname(__file__), "chunk_store"))
+CHUNK_STORE_SEGMENT_MB = int(os.getenv("CHUNK_STORE_SEGMENT_MB", "256"))
+CHUNK_STORE_ZSTD_LEVEL = int(os.getenv("CHUNK_STORE_ZSTD_LEVEL", "9"))
+# Also keep text and title in vector metadata. On by default unless the vectors
+# are local too: the chunk store is a directory on this host, so with Pinecone it
+# is only safe to turn off when CHUNK_STORE_DIR is a durable volume every instance mounts
+CHUNK_TEXT_IN_METADATA = os.getenv("CHUNK_TEXT_IN_METADATA", "false" if VECTOR_STORE == "local" else "true").lower() == "true"
+SQLITE_MAX_PARAMS = 900
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL
+);
+"""
+
+class ChunkStore:
+    # Chunk records ({"text", "title"}) keyed by vector id, so the vector index
+    # only carries ids and filter fields. Each put() appends one zstd frame with a
+    # paper's records to the current segment file, and SQLite maps every id to its
+    # frame and its byte range within the decompressed frame. Segments are read
+    # through mmap, so a lookup decompresses only the frames it needs. Re-indexing
+    # a paper appends a new frame and repoints its ids; the old frame stays behind.
+    def __init__(self, root: str = CHUNK_STORE_DIR, segment_bytes: int = CHUNK_STORE_SEGMENT_MB * 1024 * 1024,
+                 level: int = CHUNK_STORE_ZSTD_LEVEL):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.level = level
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        segments = [int(name[8:13]) for name in os.listdir(root) if name.startswith("segment-") and name.endswith(".zst")]
+        self._segment = max(segments, default=0)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.root, f"segment-{segment:05d}.zst")
+
+    def put(self, records: Dict[str, Dict]) -> None:
+        if not records:
+            return
+        parts, ranges, size = [], [], 0
+        for record_id, record in records.items():
+            data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            parts.append(data)
+            ranges.append((record_id, size, size + len(data)))
+            size += len(data)
+        # One frame per paper: its chunks share vocabulary, which is where zstd gets its ratio
+        frame = zstandard.ZstdCompressor(level=self.level).compress(b"".join(parts))
+
+        with self._lock:
+            path = self._segment_path(self._segment)
+            if os.path.exists(path) and os.path.getsize(path) + len(frame) > self.segment_bytes:
+                self._segment += 1
+                path = self._segment_path(self._segment)
+            with open(path, "ab") as f:
+                # Appends from other worker processes on the host queue up behind this one
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(frame)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (id, segment, offset, length, start, stop) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(record_id, self._segment, offset, len(frame), start, stop) for record_id, start, stop in ranges]
+                )
+
+    def _map(self, segment: int, needed: int) -> mmap.mmap:
+        # Remapped when the frame asked for was appended after the current mapping was made
+        with self._lock:
+            mapped = self._maps.get(segment)
+            if mapped is None or len(mapped) < needed:
+                with open(self._segment_path(segment), "rb") as f:
+                    mapped = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return mapped
+
+    def get(self, ids: List[str]) -> Dict[str, Dict]:
+        rows = []
+        for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+            batch = ids[i:i + SQLITE_MAX_PARAMS]
+            with self._lock:
+                rows += self._conn.execute(
+                    f"SELECT id, segment, offset, length, start, stop FROM chunks WHERE id IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+        frames: Dict[Tuple[int, int, int], List[Tuple[str, int, int]]] = {}
+        for record_id, segment, offset, length, start, stop in rows:
+            frames.setdefault((segment, offset, length), []).append((record_id, start, stop))
+
+        records = {}
+        decompressor = zstandard.ZstdDecompressor()
+        for (segment, offset, length), members in frames.items():
+            try:
+                data = decompressor.decompress(self._map(segment, offset + length)[offset:offset + length])
+            except (OSError, zstandard.ZstdError) as e:
+                logger.error(f"Unreadable chunk store frame in segment {segment} at {offset}: {str(e)}")
+                continue
+            for record_id, start, stop in members:
+                records[record_id] = json.loads(data[start:stop])
+        with self._lock:
+            self.hits += len(records)
+            self.misses += len(set(ids)) - len(records)
+        return records
+
+    def lookup_stats(self) -> Dict:
+        # Misses are vectors whose text this host doesn't have, e.g. indexed on another instance
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "miss_rate": self.misses / lookups if lookups else 0.0}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        segments = [name for name in os.listdir(self.root) if name.startswith("segment-")]
+        return {
+            "chunks": count,
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(os.path.join(self.root, name)) for name in segments)
+        }
+
+chunk_store = ChunkStore()
@@ -0,0 +1,175 @@
+import os
+import re
+import math
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "chars": 1000-character windows of the PDF text (chunk_text); "nxml": section and
+# paragraph aware chunks from the JATS XML in the OA package, PDF text as the fallback
+CHUNKER = os.getenv("CHUNKER", "chars").lower()
+# all-MiniLM-L6-v2 truncates at 256 tokens; this leaves room for [CLS], [SEP]
+# and the "[Medical Specialty: ...]" prefix the indexer puts on every chunk
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "240"))
+
+# Never indexed: citations, acknowledgements, appendices, reviewer reports, tables
+SKIPPED_ELEMENTS = {"back", "ref-list", "fn-group", "ack", "app-group", "sub-article", "response",
+                    "table-wrap", "table", "supplementary-material", "trans-abstract", "disp-formula"}
+# Inline maths markup is noise in a chunk; so are citation markers, see _block_text
+SKIPPED_INLINE = {"math", "inline-formula", "fig"}
+# Units of text a chunk is packed from
+BLOCK_ELEMENTS = {"p", "caption", "list-item", "def-item"}
+# Nested in a block, these start a new word rather than continue the one before
+SEPARATED_ELEMENTS = BLOCK_ELEMENTS | {"list", "def-list", "title", "label", "term", "def"}
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+# What's left of "(1, 2)" or "[3-5]" once the citation markers are gone
+EMPTY_BRACKETS = re.compile(r"\s*(\(\s*[,;\u2013-]*\s*\)|\[\s*[,;\u2013-]*\s*\])")
+SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([.,;:])")
+
+def estimate_tokens(text: str) -> int:
+    # WordPiece splits long biomedical terms into several pieces; this errs on the
+    # high side so chunks stay inside the model's window
+    return sum(1 if len(word) <= 6 else math.ceil(len(word) / 4) for word in re.findall(r"\w+|[^\w\s]", text))
+
+_token_counter: Optional[Callable[[str], int]] = None
+_token_counter_lock = threading.Lock()
+
+def token_counter() -> Callable[[str], int]:
+    # The embedding model's own tokenizer when it can be loaded, otherwise the estimate
+    global _token_counter
+    with _token_counter_lock:
+        if _token_counter is None:
+            try:
+                from tokenizers import Tokenizer
+                from onnx_embedder import EMBEDDING_MODEL, ONNX_TOKENIZER_PATH
+                if ONNX_TOKENIZER_PATH:
+                    tokenizer = Tokenizer.from_file(ONNX_TOKENIZER_PATH)
+                else:
+                    tokenizer = Tokenizer.from_pretrained(EMBEDDING_MODEL)
+                _token_counter = lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+            except Exception as e:
+                logger.warning(f"Embedding tokenizer unavailable, estimating chunk tokens: {str(e)}")
+                _token_counter = estimate_tokens
+        return _token_counter
+
+def _local(tag: str) -> str:
+    # Older NLM packages put the whole article in a default namespace
+    return tag.rsplit("}", 1)[-1]
+
+def _inner_text(element: ET.Element) -> str:
+    parts = [element.text or ""]
+    for child in element:
+        tag = _local(child.tag)
+        citation = tag == "xref" and child.get("ref-type") == "bibr"
+        if tag in SEPARATED_ELEMENTS:
+            parts.append(f" {_inner_text(child)} ")
+        elif not citation and tag not in SKIPPED_INLINE and tag not in SKIPPED_ELEMENTS:
+            parts.append(_inner_text(child))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+def _block_text(element: ET.Element) -> str:
+    text = EMPTY_BRACKETS.sub("", " ".join(_inner_text(element).split()))
+    return SPACE_BEFORE_PUNCTUATION.sub(r"\1", text)
+
+def iter_nxml_blocks(source) -> Iterator[Tuple[str, str]]:
+    # Yields (section heading, paragraph text) for the abstract and body of a JATS
+    # article, in document order, from a file object or path. Parsed elements are
+    # cleared as soon as they are used, so memory stays flat however long the paper.
+    path: List[str] = []
+    headings: List[str] = []
+    skipping = 0
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        tag = _local(element.tag)
+        if event == "start":
+            path.append(tag)
+            if tag in SKIPPED_ELEMENTS:
+                skipping += 1
+            elif tag == "sec":
+                headings.append("")
+            elif tag == "abstract":
+                headings.append("Abstract")
+            continue
+
+        path.pop()
+        in_content = "body" in path or "abstract" in path or tag in ("body", "abstract")
+        in_block = bool(BLOCK_ELEMENTS.intersection(path))
+        if tag in SKIPPED_ELEMENTS:
+            skipping -= 1
+            # Inside a paragraph its tail is still paragraph text; the paragraph is cleared as a whole
+            if not in_block:
+                element.clear()
+        elif skipping or not in_content:
+            element.clear()
+        elif tag == "title" and path and path[-1] == "sec" and headings:
+            headings[-1] = _block_text(element)
+        elif tag in ("sec", "abstract"):
+            headings.pop()
+            element.clear()
+        elif tag in BLOCK_ELEMENTS and not in_block:
+            # Outermost block only; lists and paragraphs nested in it are part of its text
+            text = _block_text(element)
+            if text:
+                yield " > ".join(heading for heading in headings if heading), text
+            element.clear()
+
+def _split_to_budget(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> Iterator[Tuple[str, int]]:
+    # A paragraph that doesn't fit is cut at sentence ends, and a sentence that
+    # doesn't fit at word boundaries
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        yield text, tokens
+        return
+    sentences = SENTENCE_END.split(text)
+    if len(sentences) == 1:
+        words: List[str] = []
+        used = 0
+        for word in text.split():
+            size = count_tokens(word)
+            if words and used + size > max_tokens:
+                yield " ".join(words), used
+                words, used = [], 0
+            words.append(word)
+            used += size
+        if words:
+            yield " ".join(words), used
+        return
+    for sentence in sentences:
+        yield from _split_to_budget(sentence, max_tokens, count_tokens)
+
+def pack_chunks(blocks: Iterable[Tuple[str, str]], max_tokens: int = CHUNK_MAX_TOKENS,
+                count_tokens: Optional[Callable[[str], int]] = None) -> Iterator[str]:
+    # Greedily packs whole paragraphs (or, for long ones, whole sentences) into
+    # chunks of at most max_tokens. A chunk starts with the heading of the section
+    # it is in, and names the new heading wherever a section starts inside it.
+    count_tokens = count_tokens or token_counter()
+    lines: List[str] = []
+    used = 0
+    current_heading = None
+    for heading, text in blocks:
+        heading_tokens = count_tokens(heading) if heading else 0
+        for piece, tokens in _split_to_budget(text, max(1, max_tokens - heading_tokens), count_tokens):
+            needs_heading = heading and (not lines or heading != current_heading)
+            if lines and used + tokens + (heading_tokens if heading != current_heading else 0) > max_tokens:
+                yield "\n".join(lines)
+                lines, used = [], 0
+                needs_heading = bool(heading)
+            if needs_heading:
+                lines.append(heading)
+                used += heading_tokens
+            current_heading = heading
+            lines.append(piece)
+            used += tokens
+    if lines:
+        yield "\n".join(lines)
+
+def iter_nxml_chunks(source, max_tokens: int = CHUNK_MAX_TOKENS,
+                     count_tokens: Optional[Callable[[str], int]] = None) -> Iterator[str]:
+    return pack_chunks(iter_nxml_blocks(source), max_tokens, count_tokens)
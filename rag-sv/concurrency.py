@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+# NCBI allows 3 requests/sec per client, or 10 with an API key
+NCBI_REQUESTS_PER_SECOND = float(os.getenv("NCBI_REQUESTS_PER_SECOND", "10" if NCBI_API_KEY else "3"))
+FETCH_CONCURRENCY_PER_HOST = int(os.getenv("FETCH_CONCURRENCY_PER_HOST", "8"))
+IO_THREADS = int(os.getenv("IO_THREADS", "32"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "1"))
+PDF_PROCESSES = int(os.getenv("PDF_PROCESSES", str(os.cpu_count() or 2)))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+# Torch already parallelises a forward pass across cores, so one or two
+# embedding threads is enough; more just thrash the CPU
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_THREADS, thread_name_prefix="embed")
+# PyMuPDF parsing holds the GIL; spawn (not fork) so workers don't inherit
+# the server's threads and sockets
+process_executor = ProcessPoolExecutor(max_workers=PDF_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+ncbi_limiter = TokenBucket(NCBI_REQUESTS_PER_SECOND)
+
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+def host_semaphore(host: str) -> asyncio.Semaphore:
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(FETCH_CONCURRENCY_PER_HOST)
+    return semaphore
+
+async def run_blocking(func: Callable, *args, executor=None, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or io_executor, functools.partial(func, *args, **kwargs))
+
+async def fetch_limited(func: Callable, item, host: str, limiter: TokenBucket = ncbi_limiter,
+                        skip_limit: Optional[Callable] = None):
+    # Runs one blocking fetch under the host's concurrency cap and the shared rate limit
+    async with host_semaphore(host):
+        if skip_limit is None or not skip_limit(item):
+            await limiter.acquire()
+        return await run_blocking(func, item)
+
+async def fetch_in_order(func: Callable, items: List, host: str, limiter: TokenBucket = ncbi_limiter,
+                         skip_limit: Optional[Callable] = None) -> List:
+    # Results come back in the order of items
+    return list(await asyncio.gather(*(fetch_limited(func, item, host, limiter, skip_limit) for item in items)))
@@ -0,0 +1,125 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INDEX_DEDUP = os.getenv("INDEX_DEDUP", "true").lower() == "true"
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", os.path.join(os.path.dirname(__file__), "chunk_signatures.sqlite"))
+# Chunks whose 64-bit SimHashes differ in at most this many bits count as the same text.
+# Four 16-bit bands: signatures within 3 bits of each other agree on at least one band.
+SIGNATURE_BANDS = 4
+DEDUP_MAX_DISTANCE = min(int(os.getenv("DEDUP_MAX_DISTANCE", "3")), SIGNATURE_BANDS - 1)
+SHINGLE_WORDS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_signatures (
+    specialty TEXT NOT NULL,
+    pmcid TEXT NOT NULL,
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    signature INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunk_signatures_band ON chunk_signatures (specialty, band, value);
+CREATE INDEX IF NOT EXISTS chunk_signatures_paper ON chunk_signatures (specialty, pmcid);
+"""
+
+_BIT_WEIGHTS = np.uint64(1) << np.arange(64, dtype=np.uint64)
+
+def simhash(text: str) -> Optional[int]:
+    # Word 3-shingles; digits are dropped so page numbers, years and DOIs don't
+    # tell otherwise identical boilerplate apart
+    words = re.findall(r"[a-z]+", text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    # blake2b rather than hash(): signatures are stored and must agree across processes
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little")
+                       for shingle in shingles], dtype=np.uint64)
+    votes = ((hashes[:, None] & _BIT_WEIGHTS) != 0).sum(axis=0)
+    return int.from_bytes(np.packbits(votes * 2 > len(hashes), bitorder="little").tobytes(), "little")
+
+def _bands(signature: int) -> List[Tuple[int, int]]:
+    width = 64 // SIGNATURE_BANDS
+    return [(band, (signature >> (band * width)) & ((1 << width) - 1)) for band in range(SIGNATURE_BANDS)]
+
+def _signed(signature: int) -> int:
+    # SQLite integers are signed 64-bit
+    return signature - (1 << 64) if signature >= 1 << 63 else signature
+
+class ChunkDeduplicator:
+    # SimHash signatures of every chunk indexed so far, banded in SQLite so a
+    # lookup only compares against signatures sharing a 16-bit band. Scoped per
+    # specialty: the same paper indexed under two specialties keeps its chunks in
+    # both. A paper's own earlier signatures are replaced when it is re-indexed.
+    def __init__(self, path: str, max_distance: int = DEDUP_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _indexed(self, specialty: str, signature: int) -> bool:
+        for band, value in _bands(signature):
+            rows = self._conn.execute(
+                "SELECT signature FROM chunk_signatures WHERE specialty = ? AND band = ? AND value = ?",
+                (specialty, band, value)
+            )
+            if any(((stored & ((1 << 64) - 1)) ^ signature).bit_count() <= self.max_distance for stored, in rows):
+                return True
+        return False
+
+    def filter(self, specialty: str, pmcid: str, chunks: List[str]) -> Tuple[List[str], Dict[str, int]]:
+        # Returns the chunks worth embedding, plus how many were dropped and why
+        signatures = [simhash(chunk) for chunk in chunks]
+        kept, rows = [], []
+        seen: Dict[Tuple[int, int], List[int]] = {}
+        counts = {"chunks": len(chunks), "repeated_in_paper": 0, "already_indexed": 0}
+        with self._lock, self._conn:
+            # Check and insert under one lock, so two papers parsed at once can't both keep the same text
+            self._conn.execute("DELETE FROM chunk_signatures WHERE specialty = ? AND pmcid = ?", (specialty, pmcid))
+            for chunk, signature in zip(chunks, signatures):
+                if signature is None:
+                    kept.append(chunk)
+                    continue
+                bands = _bands(signature)
+                if any((other ^ signature).bit_count() <= self.max_distance
+                       for key in bands for other in seen.get(key, [])):
+                    counts["repeated_in_paper"] += 1
+                elif self._indexed(specialty, signature):
+                    counts["already_indexed"] += 1
+                else:
+                    kept.append(chunk)
+                    for key in bands:
+                        seen.setdefault(key, []).append(signature)
+                        rows.append((specialty, pmcid, key[0], key[1], _signed(signature)))
+            self._conn.executemany(
+                "INSERT INTO chunk_signatures (specialty, pmcid, band, value, signature) VALUES (?, ?, ?, ?, ?)", rows
+            )
+        if chunks and not kept:
+            logger.info(f"Every chunk of {pmcid} duplicates text already indexed for {specialty}")
+        return kept, counts
+
+    def forget(self, specialty: str, pmcid: str) -> None:
+        # For papers that never made it into the index, so their text doesn't suppress others
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunk_signatures WHERE specialty = ? AND pmcid = ?", (specialty, pmcid))
+
+_deduplicator: Optional[ChunkDeduplicator] = None
+
+def chunk_deduplicator() -> ChunkDeduplicator:
+    # Opened by the first index job rather than at import
+    global _deduplicator
+    if _deduplicator is None:
+        _deduplicator = ChunkDeduplicator(DEDUP_INDEX_PATH)
+    return _deduplicator
@@ -0,0 +1,88 @@
+import os
+import time
+import asyncio
+import logging
+from typing import List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from concurrency import run_blocking, embed_executor
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+class EmbeddingService:
+    # Coalesces concurrent encode() calls into batched forward passes. Large
+    # requests are split into max_batch slices and each caller has at most one
+    # slice queued at a time, so a bulk index job can't starve queries.
+    def __init__(self, model, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.texts = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        parts = []
+        for i in range(0, len(texts), self.max_batch):
+            future = loop.create_future()
+            await self._queue.put((texts[i:i + self.max_batch], future))
+            parts.append(await future)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    async def _run(self) -> None:
+        pending = None
+        while True:
+            texts, future = pending or await self._queue.get()
+            pending = None
+            batch = [(texts, future)]
+            size = len(texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    texts, future = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if size + len(texts) > self.max_batch:
+                    # Doesn't fit; it leads the next batch instead
+                    pending = (texts, future)
+                    break
+                batch.append((texts, future))
+                size += len(texts)
+
+            batch = [(texts, future) for texts, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            flat = [text for texts, _ in batch for text in texts]
+            try:
+                embeddings = await run_blocking(self.model.encode, flat, convert_to_numpy=True, executor=embed_executor)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(flat)
+            offset = 0
+            for texts, future in batch:
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(texts)])
+                offset += len(texts)
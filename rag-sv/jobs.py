@@ -0,0 +1,179 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Optional
+from dotenv import load_dotenv
+from concurrency import run_blocking
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INDEX_JOB_WORKERS = int(os.getenv("INDEX_JOB_WORKERS", "2"))
+INDEX_JOBS_PER_NICHE = int(os.getenv("INDEX_JOBS_PER_NICHE", "1"))
+JOB_PROGRESS_FLUSH_SECONDS = float(os.getenv("JOB_PROGRESS_FLUSH_SECONDS", "2"))
+# A job whose dispatch failed (e.g. a transient Firestore error) is queued again after this long
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "30"))
+
+PROGRESS_STAGES = ("fetched", "extracted", "embedded", "upserted")
+
+class JobProgress:
+    # Counters are kept in memory and written to Firestore at most every
+    # JOB_PROGRESS_FLUSH_SECONDS so progress reporting doesn't throttle indexing
+    def __init__(self, doc_ref):
+        self.doc_ref = doc_ref
+        self.counts = {stage: 0 for stage in PROGRESS_STAGES}
+        self._flushed = 0.0
+
+    async def advance(self, stage: str, n: int = 1) -> None:
+        self.counts[stage] += n
+        if time.monotonic() - self._flushed >= JOB_PROGRESS_FLUSH_SECONDS:
+            await self.flush()
+
+    async def flush(self) -> None:
+        self._flushed = time.monotonic()
+        await run_blocking(self.doc_ref.update, {"progress": dict(self.counts)})
+
+class JobQueue:
+    def __init__(self, db, runner: Callable, workers: int = INDEX_JOB_WORKERS, per_niche: int = INDEX_JOBS_PER_NICHE):
+        self.db = db
+        self.runner = runner
+        self.workers = workers
+        self.per_niche = per_niche
+        self._queue: Optional[asyncio.Queue] = None
+        # Jobs running per niche, and jobs parked until their niche has a free slot
+        self._active: Dict[str, int] = {}
+        self._deferred: Dict[str, Deque[str]] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._worker_tasks = []
+
+    def _doc(self, job_id: str):
+        return self.db.collection("index_jobs").document(job_id)
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        # Jobs that were queued or mid-run when the process stopped are picked up again;
+        # index_papers skips papers that were already indexed
+        for status in ("running", "queued"):
+            docs = await run_blocking(lambda: list(self.db.collection("index_jobs").where("status", "==", status).stream()))
+            for doc in docs:
+                logger.info(f"Resuming index job {doc.id} ({status})")
+                await run_blocking(self._doc(doc.id).update, {"status": "queued"})
+                self._queue.put_nowait(doc.id)
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+
+    async def submit(self, request: Dict) -> str:
+        job_id = uuid.uuid4().hex
+        await run_blocking(self._doc(job_id).set, {
+            "status": "queued",
+            "request": request,
+            "niche": request.get("niche", "neurology").lower(),
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "progress": {stage: 0 for stage in PROGRESS_STAGES}
+        })
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        doc = await run_blocking(self._doc(job_id).get)
+        if not doc.exists:
+            return None
+        job = doc.to_dict()
+        job["job_id"] = job_id
+        started_at = job.get("started_at")
+        if started_at:
+            finished_at = job.get("finished_at") or time.time()
+            minutes = max(finished_at - started_at, 1e-6) / 60
+            job["throughput"] = {
+                f"{stage}_per_minute": round(count / minutes, 2)
+                for stage, count in job.get("progress", {}).items()
+            }
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        job = await self.get(job_id)
+        if not job or job["status"] not in ("queued", "running"):
+            return False
+        await run_blocking(self._doc(job_id).update, {"status": "cancelled", "finished_at": time.time()})
+        for deferred in self._deferred.values():
+            if job_id in deferred:
+                deferred.remove(job_id)
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._dispatch(job_id)
+            except Exception as e:
+                # One bad job must not take the worker down with it
+                logger.error(f"Index job {job_id} could not be run, retrying in {JOB_RETRY_SECONDS:.0f}s: {str(e)}",
+                             exc_info=True)
+                asyncio.get_running_loop().call_later(JOB_RETRY_SECONDS, self._queue.put_nowait, job_id)
+
+    async def _dispatch(self, job_id: str) -> None:
+        job = await self.get(job_id)
+        if not job or job["status"] != "queued":
+            # This may have been the job a finished run woke; pass its turn on
+            for niche in ([job["niche"]] if job else list(self._deferred)):
+                self._wake(niche)
+            return
+        niche = job["niche"]
+        if self._active.get(niche, 0) >= self.per_niche:
+            # Parked rather than holding a worker while it waits; requeued when the niche frees up
+            self._deferred.setdefault(niche, deque()).append(job_id)
+            return
+        self._active[niche] = self._active.get(niche, 0) + 1
+        try:
+            await self._run(job_id, job)
+        finally:
+            self._active[niche] -= 1
+            self._wake(niche)
+
+    def _wake(self, niche: str) -> None:
+        # Requeues as many parked jobs as the niche has free slots
+        deferred = self._deferred.get(niche)
+        free = self.per_niche - self._active.get(niche, 0)
+        while deferred and free > 0:
+            self._queue.put_nowait(deferred.popleft())
+            free -= 1
+
+    async def _run(self, job_id: str, job: Dict) -> None:
+        doc_ref = self._doc(job_id)
+        current = await run_blocking(doc_ref.get)
+        if (current.to_dict() or {}).get("status") == "cancelled":
+            return
+        await run_blocking(doc_ref.update, {"status": "running", "started_at": time.time()})
+        progress = JobProgress(doc_ref)
+        task = asyncio.create_task(self.runner(job["request"], self.db, progress=progress))
+        self._running[job_id] = task
+        try:
+            result = await task
+            await progress.flush()
+            await run_blocking(doc_ref.update, {"status": "completed", "result": result, "finished_at": time.time()})
+            logger.info(f"Index job {job_id} completed: {result}")
+        except asyncio.CancelledError:
+            await progress.flush()
+            logger.info(f"Index job {job_id} cancelled")
+            if not task.cancelled():
+                # The worker itself is shutting down; leave the job to be resumed
+                task.cancel()
+                raise
+        except Exception as e:
+            logger.error(f"Index job {job_id} failed: {str(e)}", exc_info=True)
+            await run_blocking(doc_ref.update, {"status": "failed", "error": str(e), "finished_at": time.time()})
+        finally:
+            self._running.pop(job_id, None)
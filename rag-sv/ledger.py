@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from concurrency import run_blocking
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FLUSH_SECONDS = float(os.getenv("LEDGER_FLUSH_SECONDS", "2"))
+# A failed paper is tried again by later runs until it has failed this many times
+INDEX_MAX_ATTEMPTS = int(os.getenv("INDEX_MAX_ATTEMPTS", "3"))
+FIRESTORE_BATCH_SIZE = 400
+
+def is_settled(entry: Dict) -> bool:
+    # A settled paper needs no more work until PMC updates it
+    if entry["status"] == "failed":
+        return entry.get("attempts", 1) >= INDEX_MAX_ATTEMPTS
+    return entry["status"] == "upserted"
+
+class IndexLedger:
+    # Per-specialty indexing state in Firestore:
+    #   index_ledger/{specialty}                 watermark and backfill cursor
+    #   index_ledger/{specialty}/papers/{pmcid}  status, the paper's last_updated
+    # The watermark is the date from which the forward search (papers added or
+    # updated since the last run) starts; it moves up one finished search window
+    # at a time. The cursor is where the backward search through older papers
+    # resumes. Both only move past papers that are settled, so a crash costs at
+    # most the statuses written since the last flush.
+    def __init__(self, db, specialty: str):
+        self.db = db
+        self.specialty = specialty
+        self.doc_ref = db.collection("index_ledger").document(specialty)
+        self.watermark: Optional[str] = None
+        self.cursor: Optional[str] = None
+        self._writes: Dict[str, Dict] = {}
+        self._flushed = time.monotonic()
+        # (search date, pmcids not settled yet) per backfill batch, and
+        # (window end date, pmcids not settled yet) per forward window, oldest first
+        self._batches: List[Tuple[str, Set[str]]] = []
+        self._forward: List[Tuple[str, Set[str]]] = []
+        self._next_cursor: Optional[str] = None
+        # (last_updated, attempts) as read by statuses(), to count repeated failures
+        self._attempts: Dict[str, Tuple[str, int]] = {}
+
+    def _paper_ref(self, pmcid: str):
+        return self.doc_ref.collection("papers").document(pmcid)
+
+    async def load(self) -> None:
+        doc = await run_blocking(self.doc_ref.get)
+        if doc.exists:
+            data = doc.to_dict()
+            self.watermark = data.get("watermark")
+            self.cursor = data.get("cursor")
+
+    async def statuses(self, pmcids: List[str]) -> Dict[str, Dict]:
+        entries = {}
+        for i in range(0, len(pmcids), FIRESTORE_BATCH_SIZE):
+            refs = [self._paper_ref(pmcid) for pmcid in pmcids[i:i + FIRESTORE_BATCH_SIZE]]
+            docs = await run_blocking(lambda: list(self.db.get_all(refs)))
+            entries.update({doc.id: doc.to_dict() for doc in docs if doc.exists})
+        for pmcid, entry in entries.items():
+            attempts = entry.get("attempts", 1 if entry["status"] == "failed" else 0)
+            self._attempts[pmcid] = (entry.get("last_updated"), attempts)
+        return entries
+
+    def track(self, search_date: str, papers: List[Dict]) -> None:
+        self._batches.append((search_date, {paper["pmcid"] for paper in papers}))
+
+    def track_forward(self, until: str, papers: List[Dict]) -> None:
+        # Called once per finished forward window; until becomes the watermark
+        # when its papers and every older window's are settled
+        self._forward.append((until, {paper["pmcid"] for paper in papers}))
+
+    def backfill_from(self, search_date: str) -> None:
+        self._next_cursor = search_date
+
+    async def mark(self, paper: Dict, status: str) -> None:
+        fields = {
+            "status": status,
+            "last_updated": paper["last_updated"],
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if status == "failed":
+            # Counted per version; an update from PMC starts the count again
+            last_updated, attempts = self._attempts.get(paper["pmcid"], (None, 0))
+            fields["attempts"] = (attempts if last_updated == paper["last_updated"] else 0) + 1
+        self._writes[paper["pmcid"]] = fields
+        if is_settled(fields):
+            for _, pending in self._batches + self._forward:
+                pending.discard(paper["pmcid"])
+        if time.monotonic() - self._flushed >= LEDGER_FLUSH_SECONDS:
+            await self.flush()
+
+    def _checkpoint(self) -> Dict:
+        fields = {}
+        cursor = self._next_cursor
+        for search_date, pending in self._batches:
+            if pending:
+                cursor = search_date
+                break
+        if cursor:
+            fields["cursor"] = cursor
+        for until, pending in self._forward:
+            if pending:
+                break
+            fields["watermark"] = until
+        return fields
+
+    async def flush(self) -> None:
+        self._flushed = time.monotonic()
+        writes, self._writes = list(self._writes.items()), {}
+        for i in range(0, len(writes), FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for pmcid, fields in writes[i:i + FIRESTORE_BATCH_SIZE]:
+                batch.set(self._paper_ref(pmcid), fields, merge=True)
+            await run_blocking(batch.commit)
+        checkpoint = self._checkpoint()
+        if checkpoint:
+            await run_blocking(self.doc_ref.set, checkpoint, merge=True)
+            self.watermark = checkpoint.get("watermark", self.watermark)
+            self.cursor = checkpoint.get("cursor", self.cursor)
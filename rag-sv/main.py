@@ -1,9 +1,11 @@
 import os
 import logging
 import json
-from fastapi import FastAPI, Depends
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
-from firebase_admin import credentials, initialize_app, firestore
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Dict
 ## import csv
@@ -15,18 +17,60 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Initialize Firebase Admin SDK
-firebase_credentials_path = os.getenv("FIREBASE_SERVICE_ACCOUNT_KEY", os.path.join(os.path.dirname(__file__), "firebase-credentials.json"))
-if firebase_credentials_path.startswith("{") and firebase_credentials_path.endswith("}"):
-    cred_dict = json.loads(firebase_credentials_path)
-else:
-    cred_dict = json.load(open(firebase_credentials_path))
-cred = credentials.Certificate(cred_dict)
-initialize_app(cred, {"projectId": os.getenv("NEXT_PUBLIC_FIREBASE_PROJECT_ID")})
-db = firestore.client()
+import startup
+from newsfeed import get_newsfeed, NewsfeedRequest
+from rag import rag_query, rag_query_batch, index_papers, init_services, QueryModel, analyze_case, CaseStudyModel
+from query_cache import query_cache
+from archive_cache import archive_cache
+from answer_cache import answer_cache
+from chunk_store import chunk_store
+from jobs import JobQueue
+
+# Firestore and the job queue that needs it are set up at startup, alongside the RAG services
+db = None
+job_queue = None
+startup.register("firebase", "job_queue")
+
+def init_firebase():
+    global db
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    # Initialize Firebase Admin SDK. A retry after initialize_app succeeded (e.g.
+    # firestore.client() failed) reuses the app rather than initializing it again
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_credentials_path = os.getenv("FIREBASE_SERVICE_ACCOUNT_KEY", os.path.join(os.path.dirname(__file__), "firebase-credentials.json"))
+        if firebase_credentials_path.startswith("{") and firebase_credentials_path.endswith("}"):
+            cred_dict = json.loads(firebase_credentials_path)
+        else:
+            cred_dict = json.load(open(firebase_credentials_path))
+        cred = credentials.Certificate(cred_dict)
+        firebase_admin.initialize_app(cred, {"projectId": os.getenv("NEXT_PUBLIC_FIREBASE_PROJECT_ID")})
+    db = firestore.client()
+
+async def start_job_queue():
+    global job_queue
+    # Indexing runs as background jobs; state lives in the index_jobs collection
+    queue = JobQueue(db, index_papers)
+    await queue.start()
+    job_queue = queue
+
+async def start_services():
+    await asyncio.gather(startup.initialize("firebase", init_firebase), init_services())
+    await startup.initialize("job_queue", start_job_queue)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve liveness checks straight away; readiness follows once everything is up
+    starting = asyncio.create_task(start_services())
+    yield
+    starting.cancel()
+    if job_queue:
+        await job_queue.stop()
 
 # Create FastAPI app
-app = FastAPI(title="MedAlpine API")
+app = FastAPI(title="MedAlpine API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -35,27 +79,73 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# What each endpoint needs; a dependency it doesn't use failing to start never takes it down
+RAG_SERVICES = ("vector_store", "gemini", "embedder", "search")
+CASE_SERVICES = ("vector_store", "gemini", "embedder")
+# The job queue only starts once Firestore and every RAG service are up
+JOB_SERVICES = ("firebase", "job_queue")
+
+def require_ready(*services: str):
+    def check():
+        if not startup.is_ready(*services):
+            pending = [name for name in services if startup.status.get(name) != "ready"]
+            raise HTTPException(status_code=503, detail=f"Service is starting: waiting on {', '.join(pending)}")
+    return check
+
 # Dependency to provide Firestore client
 def get_db():
+    require_ready("firebase")()
     return db
 
-# Import modules after Firebase initialization
-from newsfeed import get_newsfeed, NewsfeedRequest
-from rag import rag_query, index_papers, QueryModel, analyze_case, CaseStudyModel
+@app.get("/healthz")
+async def healthz_endpoint():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz_endpoint():
+    return JSONResponse(status_code=200 if startup.is_ready() else 503, content=startup.status)
 
 # Include endpoints with dependencies
 @app.post("/newsfeed")
 async def newsfeed_endpoint(request: NewsfeedRequest, db=Depends(get_db)):
     return await get_newsfeed(request, db)
 
-app.post("/rag-query")(rag_query)
-app.post("/analyze-case")(analyze_case)
+app.post("/rag-query", dependencies=[Depends(require_ready(*RAG_SERVICES))])(rag_query)
+app.post("/rag-query/batch", dependencies=[Depends(require_ready(*RAG_SERVICES))])(rag_query_batch)
+app.post("/analyze-case", dependencies=[Depends(require_ready(*CASE_SERVICES))])(analyze_case)
+
+@app.get("/cache-stats")
+async def cache_stats_endpoint():
+    return {
+        "query_cache": query_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "archive_cache": archive_cache.stats(),
+        "chunk_store": chunk_store.lookup_stats()
+    }
+
+@app.post("/index-papers", dependencies=[Depends(require_ready(*JOB_SERVICES))])
+async def index_papers_endpoint(request: Dict):
+    num_papers = request.get("num_papers", 30)
+    if not isinstance(num_papers, int) or isinstance(num_papers, bool) or num_papers < 1:
+        raise HTTPException(status_code=400, detail="num_papers must be a positive integer")
+    job_id = await job_queue.submit(request)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(require_ready(*JOB_SERVICES))])
+async def job_status_endpoint(job_id: str):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-@app.post("/index-papers")
-async def index_papers_endpoint(request: Dict, db=Depends(get_db)):
-    return await index_papers(request, db)
+@app.delete("/jobs/{job_id}", dependencies=[Depends(require_ready(*JOB_SERVICES))])
+async def cancel_job_endpoint(job_id: str):
+    if not await job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job is not queued or running")
+    return {"job_id": job_id, "status": "cancelled"}
 
 if __name__ == "__main__":
     logger.info("Starting MedAlpine API server on port 8000")
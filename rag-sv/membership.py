@@ -0,0 +1,93 @@
+import os
+import time
+import zlib
+import logging
+from typing import Dict, Iterable, Set, Tuple
+from dotenv import load_dotenv
+from concurrency import run_blocking
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Fixed once a specialty has data: changing it re-buckets every PMCID
+MEMBERSHIP_SHARDS = int(os.getenv("MEMBERSHIP_SHARDS", "64"))
+MEMBERSHIP_CACHE_SECONDS = float(os.getenv("MEMBERSHIP_CACHE_SECONDS", "300"))
+FIRESTORE_BATCH_SIZE = 400
+
+class MembershipStore:
+    # Indexed PMCIDs for a specialty, hash-bucketed across
+    # indexed_papers/{specialty}/shards/{bucket} so no single document grows
+    # towards Firestore's 1 MiB limit (64 shards hold a few million ids).
+    # Appends are ArrayUnion transforms, so concurrent jobs never read-modify-write.
+    # Shards that have been read are kept in memory for MEMBERSHIP_CACHE_SECONDS;
+    # a stale miss only means the ledger gets asked about that paper.
+    def __init__(self, db, specialty: str, shards: int = MEMBERSHIP_SHARDS):
+        self.db = db
+        self.specialty = specialty
+        self.shards = shards
+        self.doc_ref = db.collection("indexed_papers").document(specialty)
+        self._cache: Dict[int, Tuple[Set[str], float]] = {}
+        self._migrated = False
+
+    def bucket(self, pmcid: str) -> int:
+        # crc32 rather than hash(): it must agree across processes and restarts
+        return zlib.crc32(pmcid.encode()) % self.shards
+
+    def _shard_ref(self, bucket: int):
+        return self.doc_ref.collection("shards").document(f"{bucket:03d}")
+
+    async def _migrate(self) -> None:
+        # Moves the legacy single-array document into shards, once. Only marked done
+        # after it succeeds, so a failed attempt is retried by the next call; running
+        # it twice is harmless since shards are merged with ArrayUnion
+        if self._migrated:
+            return
+        doc = await run_blocking(self.doc_ref.get)
+        legacy = doc.to_dict().get("pmcids") if doc.exists else None
+        if legacy:
+            from firebase_admin import firestore
+            logger.info(f"Migrating {len(legacy)} indexed PMCIDs for {self.specialty} into {self.shards} shards")
+            await self.add(legacy)
+            await run_blocking(self.doc_ref.update, {"pmcids": firestore.DELETE_FIELD})
+        self._migrated = True
+
+    async def contains(self, pmcids: Iterable[str]) -> Set[str]:
+        await self._migrate()
+        pmcids = set(pmcids)
+        buckets = {self.bucket(pmcid) for pmcid in pmcids}
+        now = time.monotonic()
+        stale = [bucket for bucket in buckets
+                 if bucket not in self._cache or now - self._cache[bucket][1] >= MEMBERSHIP_CACHE_SECONDS]
+        if stale:
+            refs = [self._shard_ref(bucket) for bucket in stale]
+            docs = await run_blocking(lambda: list(self.db.get_all(refs)))
+            loaded = {int(doc.id): set(doc.to_dict().get("pmcids", [])) for doc in docs if doc.exists}
+            for bucket in stale:
+                self._cache[bucket] = (loaded.get(bucket, set()), now)
+        return {pmcid for pmcid in pmcids if pmcid in self._cache[self.bucket(pmcid)][0]}
+
+    async def add(self, pmcids: Iterable[str]) -> None:
+        from firebase_admin import firestore
+        by_bucket: Dict[int, Set[str]] = {}
+        for pmcid in pmcids:
+            by_bucket.setdefault(self.bucket(pmcid), set()).add(pmcid)
+        items = list(by_bucket.items())
+        # One batch commits atomically; each shard only receives the ids it is missing
+        for i in range(0, len(items), FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for bucket, members in items[i:i + FIRESTORE_BATCH_SIZE]:
+                batch.set(self._shard_ref(bucket), {"pmcids": firestore.ArrayUnion(sorted(members))}, merge=True)
+            await run_blocking(batch.commit)
+        for bucket, members in items:
+            if bucket in self._cache:
+                self._cache[bucket][0].update(members)
+
+_stores: Dict[str, MembershipStore] = {}
+
+def membership_store(db, specialty: str) -> MembershipStore:
+    # One store per specialty per process, so the shard cache outlives a single job
+    if specialty not in _stores:
+        _stores[specialty] = MembershipStore(db, specialty)
+    return _stores[specialty]
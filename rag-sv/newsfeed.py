@@ -1,49 +1,91 @@
+import os
+import asyncio
 from fastapi import HTTPException
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 from typing import List, Dict
 import logging
-from utils import fetch_open_access_pmcids, get_paper_metadata, extract_paper_content, parse_date
+from dotenv import load_dotenv
+from utils import search_open_access_pmcids, get_paper_metadata, extract_paper_content, fetch_papers, parse_date
+from concurrency import run_blocking
+
+# Load environment variables
+load_dotenv()
 
 logger = logging.getLogger(__name__)
+
+# Feeds older than this are served as-is while a background refresh runs
+NEWSFEED_REFRESH_HOURS = float(os.getenv("NEWSFEED_REFRESH_HOURS", "24"))
+
 class NewsfeedRequest(BaseModel):
     niche: str
     months: int = 6  # Default to last 6 months
 
-async def get_newsfeed(request: NewsfeedRequest, db):
-    niche = request.niche.lower()
-    cutoff_date = datetime.now() - timedelta(days=request.months * 30)
+# One rebuild per niche at a time; concurrent callers await the same task
+_refreshes: Dict[str, asyncio.Task] = {}
 
-    # Check Firestore for cached data
-    newsfeed_ref = db.collection("newsfeed").document(niche)
-    doc = newsfeed_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        last_fetched = parse_date(data.get("last_fetched", "1970-01-01 00:00:00"))
-        if last_fetched > cutoff_date:
-            return {"papers": data.get("papers", [])}
+async def _rebuild_newsfeed(niche: str, cached_papers: List[Dict], db) -> List[Dict]:
+    pmcids = await search_open_access_pmcids(niche)
+    papers = await run_blocking(get_paper_metadata, pmcids)
 
-    # Fetch new data
-    pmcids = fetch_open_access_pmcids(niche)
-    papers = get_paper_metadata(pmcids)
+    # Only papers that are new, or that PMC has updated, need extracting again
+    cached = {paper["pmcid"]: paper for paper in cached_papers}
+    stale = [paper for paper in papers
+             if paper["pmcid"] not in cached or cached[paper["pmcid"]]["last_updated"] != paper["last_updated"]]
+    contents = await fetch_papers(extract_paper_content, [paper["file_path"] for paper in stale],
+                                  [paper["last_updated"] for paper in stale])
+    extracted = {paper["pmcid"]: content for paper, content in zip(stale, contents)}
+    logger.info(f"Newsfeed refresh for {niche}: {len(stale)} papers extracted, {len(papers) - len(stale)} reused")
 
-    # Extract content for each paper
     result = []
     for paper in papers:
-        content = extract_paper_content(paper["file_path"])
+        if paper["pmcid"] not in extracted:
+            result.append(cached[paper["pmcid"]])
+            continue
         result.append({
             "pmcid": paper["pmcid"],
             "title": paper["title"],
             "publication_date": paper["last_updated"].split()[0],
             "last_updated": paper["last_updated"],
-            "content": content,
+            "content": extracted[paper["pmcid"]],
             "full_text_url": f"https://www.ncbi.nlm.nih.gov/pmc/articles/{paper['pmcid']}/"
         })
 
     # Save to Firestore
-    newsfeed_ref.set({
+    await run_blocking(db.collection("newsfeed").document(niche).set, {
         "papers": result,
         "last_fetched": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     })
+    return result
+
+def _refresh_done(niche: str, task: asyncio.Task) -> None:
+    _refreshes.pop(niche, None)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Newsfeed refresh for {niche} failed: {str(task.exception())}")
+
+def _refresh(niche: str, cached_papers: List[Dict], db) -> asyncio.Task:
+    task = _refreshes.get(niche)
+    if task is None:
+        task = _refreshes[niche] = asyncio.create_task(_rebuild_newsfeed(niche, cached_papers, db))
+        task.add_done_callback(lambda task: _refresh_done(niche, task))
+    return task
+
+async def get_newsfeed(request: NewsfeedRequest, db):
+    niche = request.niche.lower()
+    cutoff_date = datetime.now() - timedelta(days=request.months * 30)
+
+    # Check Firestore for cached data
+    doc = await run_blocking(db.collection("newsfeed").document(niche).get)
+    cached_papers = []
+    if doc.exists:
+        data = doc.to_dict()
+        cached_papers = data.get("papers", [])
+        last_fetched = parse_date(data.get("last_fetched", "1970-01-01 00:00:00"))
+        if last_fetched > cutoff_date:
+            if datetime.now() - last_fetched > timedelta(hours=NEWSFEED_REFRESH_HOURS):
+                # Stale while revalidate: answer now, refresh for the next caller
+                _refresh(niche, cached_papers, db)
+            return {"papers": cached_papers}
 
-    return {"papers": result}
\ No newline at end of file
+    # Shielded so a caller disconnecting doesn't cancel the rebuild others are waiting on
+    return {"papers": await asyncio.shield(_refresh(niche, cached_papers, db))}
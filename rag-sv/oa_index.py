@@ -0,0 +1,248 @@
+import os
+import csv
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OA_FILE_LIST_URL = "https://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_file_list.csv"
+OA_CSV_PATH = os.path.join(os.path.dirname(__file__), "oa_file_list.csv")
+OA_INDEX_PATH = os.getenv("OA_INDEX_PATH", os.path.join(os.path.dirname(__file__), "oa_file_list.sqlite"))
+OA_INDEX_MAX_AGE_HOURS = float(os.getenv("OA_INDEX_MAX_AGE_HOURS", "24"))
+
+LOOKUP_BATCH_SIZE = 500  # Stay well below SQLite's bound-parameter limit
+MERGE_BATCH_SIZE = 50000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    pmcid TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    title TEXT NOT NULL,
+    last_updated TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Only rows that are new or whose file/date changed are rewritten on refresh
+_MERGE_SQL = """
+INSERT INTO papers (pmcid, file_path, title, last_updated) VALUES (?, ?, ?, ?)
+ON CONFLICT(pmcid) DO UPDATE SET
+    file_path = excluded.file_path,
+    title = excluded.title,
+    last_updated = excluded.last_updated
+WHERE papers.file_path != excluded.file_path OR papers.last_updated != excluded.last_updated
+"""
+
+_local = threading.local()
+_refresh_lock = threading.Lock()
+_refresh_thread: Optional[threading.Thread] = None
+_refresh_thread_lock = threading.Lock()
+
+def _connect(db_path: str = OA_INDEX_PATH) -> sqlite3.Connection:
+    # One connection per thread; WAL lets lookups proceed while a refresh merges
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        connections[db_path] = conn
+    return conn
+
+def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _set_meta(conn: sqlite3.Connection, values: Dict[str, Optional[str]]) -> None:
+    conn.executemany(
+        "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        list(values.items())
+    )
+
+def _iter_csv_rows(csv_path: str) -> Iterator[Tuple[str, str, str, str]]:
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield (
+                row["Accession ID"],
+                row["File"],
+                row["Article Citation"].split(".")[0],
+                row["Last Updated (YYYY-MM-DD HH:MM:SS)"] or "1970-01-01 00:00:00"
+            )
+
+def merge_rows(rows: Iterable[Tuple[str, str, str, str]], db_path: str = OA_INDEX_PATH, prune: bool = False) -> int:
+    # With prune=True rows are the whole OA list, and papers missing from it
+    # (withdrawn from the OA subset) are deleted
+    conn = _connect(db_path)
+    before = conn.total_changes
+    batch = []
+    seen = 0
+    with conn:
+        if prune:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS listed (pmcid TEXT PRIMARY KEY) WITHOUT ROWID")
+            conn.execute("DELETE FROM listed")
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= MERGE_BATCH_SIZE:
+                _merge_batch(conn, batch, prune)
+                seen += len(batch)
+                batch = []
+        if batch:
+            _merge_batch(conn, batch, prune)
+            seen += len(batch)
+        # An empty list is a broken download, not a withdrawn archive
+        if prune and seen:
+            removed = conn.execute("DELETE FROM papers WHERE pmcid NOT IN (SELECT pmcid FROM listed)").rowcount
+            if removed:
+                logger.info(f"Removed {removed} papers no longer in the OA file list")
+        if prune:
+            conn.execute("DELETE FROM listed")
+    return conn.total_changes - before
+
+def _merge_batch(conn: sqlite3.Connection, batch: List[Tuple[str, str, str, str]], prune: bool) -> None:
+    conn.executemany(_MERGE_SQL, batch)
+    if prune:
+        conn.executemany("INSERT OR IGNORE INTO listed (pmcid) VALUES (?)", [(row[0],) for row in batch])
+
+def build_index(csv_path: str = OA_CSV_PATH, db_path: str = OA_INDEX_PATH, meta: Optional[Dict[str, Optional[str]]] = None) -> int:
+    # meta carries the download's validators; they are only stored once the merge
+    # has committed, so a failed merge is retried on the next refresh
+    started = time.time()
+    changed = merge_rows(_iter_csv_rows(csv_path), db_path, prune=True)
+    conn = _connect(db_path)
+    with conn:
+        _set_meta(conn, {**(meta or {}), "checked_at": str(time.time())})
+    logger.info(f"Merged {changed} changed rows from {csv_path} into {db_path} in {time.time() - started:.1f}s")
+    return changed
+
+def paper_count(db_path: str = OA_INDEX_PATH) -> int:
+    return _connect(db_path).execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+def _download_if_changed(session, conn: sqlite3.Connection, csv_path: str) -> Optional[Dict[str, Optional[str]]]:
+    # Returns the new list's validators, or None when the list hasn't changed
+    headers = {}
+    etag = _get_meta(conn, "etag")
+    last_modified = _get_meta(conn, "last_modified")
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    response = session.get(OA_FILE_LIST_URL, stream=True, timeout=10, headers=headers)
+    if response.status_code == 304:
+        logger.info("OA file list unchanged since last refresh")
+        return None
+    response.raise_for_status()
+
+    tmp_path = csv_path + ".part"
+    with open(tmp_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            if chunk:
+                f.write(chunk)
+    os.replace(tmp_path, csv_path)
+    logger.info("OA file list downloaded successfully")
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified")
+    }
+
+def _expired(conn: sqlite3.Connection) -> bool:
+    checked_at = float(_get_meta(conn, "checked_at") or 0)
+    return time.time() - checked_at >= OA_INDEX_MAX_AGE_HOURS * 3600
+
+def _refresh(session, csv_path: str, db_path: str, force: bool) -> None:
+    # Called with _refresh_lock held
+    conn = _connect(db_path)
+    if not force and not _expired(conn):
+        return
+    # A CSV dropped in place by hand seeds the first build without a download
+    if paper_count(db_path) == 0 and os.path.exists(csv_path):
+        logger.info(f"Building OA index from existing {csv_path}")
+        build_index(csv_path, db_path)
+        return
+    try:
+        validators = _download_if_changed(session, conn, csv_path)
+    except Exception as e:
+        if paper_count(db_path) == 0:
+            logger.error(f"Failed to download CSV file from NCBI: {str(e)}")
+            raise ValueError(f"Failed to download CSV file from NCBI: {str(e)}")
+        logger.warning(f"OA file list refresh failed, serving existing index: {str(e)}")
+        return
+    if validators is not None:
+        build_index(csv_path, db_path, validators)
+    else:
+        with conn:
+            _set_meta(conn, {"checked_at": str(time.time())})
+
+def _refresh_in_background(session, csv_path: str, db_path: str) -> None:
+    with _refresh_lock:
+        try:
+            _refresh(session, csv_path, db_path, False)
+        except Exception as e:
+            logger.error(f"Background OA index refresh failed: {str(e)}")
+
+def refresh_index(session, csv_path: str = OA_CSV_PATH, db_path: str = OA_INDEX_PATH, force: bool = False) -> None:
+    # An empty index is built before returning; an expired one is refreshed in a
+    # background thread while lookups keep serving from the current rows
+    global _refresh_thread
+    conn = _connect(db_path)
+    if not force and not _expired(conn):
+        return
+    if force or paper_count(db_path) == 0:
+        with _refresh_lock:
+            _refresh(session, csv_path, db_path, force)
+        return
+    with _refresh_thread_lock:
+        if _refresh_thread is None or not _refresh_thread.is_alive():
+            _refresh_thread = threading.Thread(
+                target=_refresh_in_background, args=(session, csv_path, db_path), name="oa-index-refresh", daemon=True
+            )
+            _refresh_thread.start()
+
+def lookup(pmcids: Iterable[str], db_path: str = OA_INDEX_PATH) -> List[Dict]:
+    conn = _connect(db_path)
+    unique_pmcids = list(dict.fromkeys(pmcids))
+    papers = []
+    for i in range(0, len(unique_pmcids), LOOKUP_BATCH_SIZE):
+        batch = unique_pmcids[i:i + LOOKUP_BATCH_SIZE]
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(
+            f"SELECT pmcid, file_path, title, last_updated FROM papers WHERE pmcid IN ({placeholders})",
+            batch
+        )
+        for pmcid, file_path, title, last_updated in rows:
+            papers.append({
+                "pmcid": pmcid,
+                "file_path": file_path,
+                "title": title,
+                "last_updated": last_updated
+            })
+    return papers
+
+if __name__ == "__main__":
+    import argparse
+    from utils import session
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build or refresh the PMC OA file list index")
+    parser.add_argument("command", choices=["build", "refresh"])
+    parser.add_argument("--csv", default=OA_CSV_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.csv)
+    else:
+        refresh_index(session, args.csv, force=True)
+    logger.info(f"OA index holds {paper_count()} papers")
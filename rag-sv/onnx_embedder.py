@@ -0,0 +1,98 @@
+import os
+import logging
+from typing import List, Union
+import numpy as np
+from dotenv import load_dotenv
+from vector_store import EMBEDDING_DIM
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Int8 dynamic-quantized export published alongside the model (AVX2 kernels run on
+# any x86-64 host). ONNX_MODEL_PATH / ONNX_TOKENIZER_PATH point at local files
+# instead, e.g. a model made with `python onnx_embedder.py quantize`
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "onnx/model_quint8_avx2.onnx")
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH")
+ONNX_TOKENIZER_PATH = os.getenv("ONNX_TOKENIZER_PATH")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 lets onnxruntime use every core
+# Same truncation as the SentenceTransformer config for this model
+EMBEDDING_MAX_TOKENS = 256
+
+class OnnxEmbedder:
+    # Stands in for SentenceTransformer('all-MiniLM-L6-v2') without torch: same
+    # tokenizer, mean pooling over the attention mask, then L2 normalisation, so
+    # the 384-dim vectors land next to the ones already in the index.
+    def __init__(self, model_path: str = None, tokenizer_path: str = None, threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        model_path = model_path or ONNX_MODEL_PATH
+        tokenizer_path = tokenizer_path or ONNX_TOKENIZER_PATH
+        if model_path is None or tokenizer_path is None:
+            from huggingface_hub import hf_hub_download
+            model_path = model_path or hf_hub_download(EMBEDDING_MODEL, ONNX_MODEL_FILE)
+            tokenizer_path = tokenizer_path or hf_hub_download(EMBEDDING_MODEL, "tokenizer.json")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(EMBEDDING_MAX_TOKENS)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.inputs = {model_input.name for model_input in self.session.get_inputs()}
+        logger.info(f"Loaded ONNX embedding model from {model_path}")
+
+        dim = self.encode(["dimension check"]).shape[1]
+        if dim != EMBEDDING_DIM:
+            raise ValueError(f"ONNX model {model_path} produces {dim}-dim embeddings, the index expects {EMBEDDING_DIM}")
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        # Keyword arguments SentenceTransformer.encode takes (convert_to_numpy, ...) are accepted and ignored
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size)[0]
+        if not texts:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+        # Longest first so each batch pads to similar lengths; rows go back in input order
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in rows])
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.inputs:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self.session.run(None, feeds)[0]
+
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings[rows] = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+def quantize(output_path: str) -> None:
+    # Int8 dynamic quantization of the fp32 export: weights stored as int8,
+    # activations quantized on the fly, no calibration data needed
+    from huggingface_hub import hf_hub_download
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    source = hf_hub_download(EMBEDDING_MODEL, "onnx/model.onnx")
+    quantize_dynamic(source, output_path, weight_type=QuantType.QInt8)
+    logger.info(f"Wrote quantized model to {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB, "
+                f"fp32 was {os.path.getsize(source) / 1e6:.1f} MB)")
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Prepare the ONNX embedding model")
+    parser.add_argument("command", choices=["quantize"])
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "model_qint8.onnx"))
+    args = parser.parse_args()
+
+    quantize(args.output)
@@ -0,0 +1,187 @@
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_DOWNLOADERS = int(os.getenv("PIPELINE_DOWNLOADERS", "8"))
+PIPELINE_PARSERS = int(os.getenv("PIPELINE_PARSERS", str(os.cpu_count() or 2)))
+PIPELINE_UPSERTERS = int(os.getenv("PIPELINE_UPSERTERS", "4"))
+PIPELINE_EMBED_BATCH = int(os.getenv("PIPELINE_EMBED_BATCH", "256"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+UPSERT_BATCH_SIZE = 100
+
+class IndexingPipeline:
+    # download -> parse -> embed -> upsert, each stage a pool of tasks joined
+    # by bounded queues so a slow stage backs up the ones before it instead of
+    # buffering whole papers in memory. A semaphore caps papers in flight plus
+    # papers indexed at the requested limit, so no work is wasted past it.
+    def __init__(self, fetch: Callable, parse: Callable, embed: Callable, upsert: Callable,
+                 build_vectors: Callable, on_indexed: Optional[Callable] = None,
+                 on_stage: Optional[Callable] = None, progress=None,
+                 downloaders: int = PIPELINE_DOWNLOADERS, parsers: int = PIPELINE_PARSERS,
+                 upserters: int = PIPELINE_UPSERTERS, embed_batch: int = PIPELINE_EMBED_BATCH,
+                 queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.fetch = fetch
+        self.parse = parse
+        self.embed = embed
+        self.upsert = upsert
+        self.build_vectors = build_vectors
+        self.on_indexed = on_indexed
+        self.on_stage = on_stage
+        self.progress = progress
+        self.downloaders = downloaders
+        self.parsers = parsers
+        self.upserters = upserters
+        self.embed_batch = embed_batch
+        self.queue_size = queue_size
+
+    async def _advance(self, stage: str, paper: Dict) -> None:
+        if self.progress is not None:
+            await self.progress.advance(stage)
+        if self.on_stage:
+            await self.on_stage(stage, paper)
+
+    async def run(self, papers: AsyncIterator[Dict], limit: int) -> List[str]:
+        if limit <= 0:
+            # Nothing to index; a zero-slot semaphore would block feed() forever
+            if hasattr(papers, "aclose"):
+                await papers.aclose()
+            return []
+        fetch_queue = asyncio.Queue(self.queue_size)
+        parse_queue = asyncio.Queue(self.queue_size)
+        embed_queue = asyncio.Queue(self.queue_size)
+        upsert_queue = asyncio.Queue(self.queue_size)
+        slots = asyncio.Semaphore(limit)
+        indexed = []
+
+        async def give_up(paper: Dict, reason: str) -> None:
+            logger.warning(f"{reason} for {paper['pmcid']}, skipping")
+            slots.release()
+            if self.on_stage:
+                await self.on_stage("failed", paper)
+
+        async def feed():
+            try:
+                async for paper in papers:
+                    await slots.acquire()
+                    if len(indexed) >= limit:
+                        break
+                    await fetch_queue.put(paper)
+            finally:
+                if hasattr(papers, "aclose"):
+                    await papers.aclose()
+
+        async def download():
+            while (paper := await fetch_queue.get()) is not None:
+                logger.info(f"Processing paper: {paper['pmcid']}")
+                try:
+                    pdf_content = await self.fetch(paper)
+                except Exception as e:
+                    logger.error(f"Download failed for {paper['pmcid']}: {str(e)}")
+                    pdf_content = None
+                if pdf_content:
+                    await self._advance("fetched", paper)
+                    await parse_queue.put((paper, pdf_content))
+                else:
+                    await give_up(paper, "No PDF downloaded")
+
+        async def parse():
+            while (item := await parse_queue.get()) is not None:
+                paper, pdf_content = item
+                try:
+                    chunks = await self.parse(paper, pdf_content)
+                except Exception as e:
+                    logger.error(f"PDF parsing failed for {paper['pmcid']}: {str(e)}")
+                    chunks = []
+                if chunks:
+                    await self._advance("extracted", paper)
+                    await embed_queue.put((paper, chunks))
+                else:
+                    await give_up(paper, "No text extracted")
+
+        async def embed():
+            upstream_done = False
+            while not upstream_done:
+                item = await embed_queue.get()
+                if item is None:
+                    break
+                # Fill the batch from whatever else is already waiting, across paper boundaries
+                batch = [item]
+                size = len(item[1])
+                while size < self.embed_batch:
+                    try:
+                        item = embed_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if item is None:
+                        upstream_done = True
+                        break
+                    batch.append(item)
+                    size += len(item[1])
+
+                try:
+                    embeddings = await self.embed([chunk for _, chunks in batch for chunk in chunks])
+                except Exception as e:
+                    logger.error(f"Embedding failed for {len(batch)} papers: {str(e)}")
+                    for paper, _ in batch:
+                        await give_up(paper, "Embedding failed")
+                    continue
+                offset = 0
+                for paper, chunks in batch:
+                    vectors = self.build_vectors(paper, chunks, embeddings[offset:offset + len(chunks)])
+                    offset += len(chunks)
+                    await self._advance("embedded", paper)
+                    await upsert_queue.put((paper, vectors))
+
+        async def upsert():
+            while (item := await upsert_queue.get()) is not None:
+                paper, vectors = item
+                try:
+                    await asyncio.gather(*(
+                        self.upsert(vectors[i:i + UPSERT_BATCH_SIZE])
+                        for i in range(0, len(vectors), UPSERT_BATCH_SIZE)
+                    ))
+                except Exception as e:
+                    logger.error(f"Upsert failed for {paper['pmcid']}: {str(e)}")
+                    await give_up(paper, "Upsert failed")
+                    continue
+                logger.info(f"Upserted {len(vectors)} chunks for {paper['pmcid']}")
+                indexed.append(paper["pmcid"])
+                if self.on_indexed:
+                    self.on_indexed(paper)
+                await self._advance("upserted", paper)
+                if len(indexed) >= limit:
+                    # Wake the feeder so it sees the limit and stops
+                    slots.release()
+
+        async def stage(workers: int, worker: Callable, downstream: Optional[asyncio.Queue], downstream_workers: int):
+            await asyncio.gather(*(worker() for _ in range(workers)))
+            if downstream is not None:
+                for _ in range(downstream_workers):
+                    await downstream.put(None)
+
+        async def feed_stage():
+            await feed()
+            for _ in range(self.downloaders):
+                await fetch_queue.put(None)
+
+        tasks = [
+            asyncio.create_task(feed_stage()),
+            asyncio.create_task(stage(self.downloaders, download, parse_queue, self.parsers)),
+            asyncio.create_task(stage(self.parsers, parse, embed_queue, 1)),
+            asyncio.create_task(stage(1, embed, upsert_queue, self.upserters)),
+            asyncio.create_task(stage(self.upserters, upsert, None, 0)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # On failure or cancellation, don't leave stages blocked on their queues
+            for task in tasks:
+                task.cancel()
+        return indexed
@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from concurrency import io_executor, run_blocking
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", os.path.join(os.path.dirname(__file__), "query_cache.sqlite"))
+QUERY_CACHE_TTL_HOURS = float(os.getenv("QUERY_CACHE_TTL_HOURS", "168"))
+QUERY_CACHE_MEMORY_ITEMS = int(os.getenv("QUERY_CACHE_MEMORY_ITEMS", "2048"))
+QUERY_CACHE_MAX_ROWS = int(os.getenv("QUERY_CACHE_MAX_ROWS", "200000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS normalized_queries (
+    key TEXT PRIMARY KEY,
+    normalized TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS normalized_queries_accessed ON normalized_queries (accessed_at);
+"""
+
+def cache_key(text: str) -> str:
+    return " ".join(text.lower().split())
+
+class QueryCache:
+    # In-process LRU in front of a SQLite table shared by every worker on the host.
+    # Maps a case/whitespace-normalized query to its medical-terminology rewrite
+    # and that rewrite's embedding.
+    def __init__(self, path: str, ttl_seconds: float, memory_items: int, max_rows: int):
+        self.path = path
+        self.ttl = ttl_seconds
+        self.memory_items = memory_items
+        self.max_rows = max_rows
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[str, np.ndarray, float]]" = OrderedDict()
+        # _lock guards the LRU and counters and is taken on the event loop, so it is
+        # never held across SQLite calls; _db_lock serializes the connection and is
+        # only taken on executor threads or by blocking callers
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _get_memory(self, key: str, now: float) -> Optional[Tuple[str, np.ndarray]]:
+        # Called with the lock held
+        entry = self._memory.get(key)
+        if entry and now - entry[2] < self.ttl:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0], entry[1]
+        return None
+
+    def get(self, text: str) -> Optional[Tuple[str, np.ndarray]]:
+        # Blocking; request handlers use lookup()
+        key = cache_key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._get_memory(key, now)
+        if entry:
+            return entry
+
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT normalized, embedding, created_at FROM normalized_queries WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is not None:
+                with self._conn:
+                    self._conn.execute("UPDATE normalized_queries SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            normalized, blob, created_at = row
+            embedding = np.frombuffer(blob, dtype=np.float32)
+            self._remember(key, (normalized, embedding, created_at))
+            self.disk_hits += 1
+            return normalized, embedding
+
+    async def lookup(self, text: str) -> Optional[Tuple[str, np.ndarray]]:
+        # Memory hits are answered inline; the SQLite tier is read off the event loop
+        with self._lock:
+            entry = self._get_memory(cache_key(text), time.time())
+        return entry or await run_blocking(self.get, text)
+
+    async def lookup_many(self, texts: List[str]) -> List[Optional[Tuple[str, np.ndarray]]]:
+        # One executor call for every memory miss, however many queries there are
+        now = time.time()
+        with self._lock:
+            entries = [self._get_memory(cache_key(text), now) for text in texts]
+        misses = [i for i, entry in enumerate(entries) if entry is None]
+        if misses:
+            found = await run_blocking(lambda: [self.get(texts[i]) for i in misses])
+            for i, entry in zip(misses, found):
+                entries[i] = entry
+        return entries
+
+    def store(self, text: str, normalized: str, embedding: np.ndarray) -> None:
+        # The in-process tier is updated now and the SQLite write runs in the
+        # background, so the caller never waits on another worker's write lock
+        key = cache_key(text)
+        now = time.time()
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, (normalized, embedding, now))
+        io_executor.submit(self._write, key, normalized, embedding, now)
+
+    def _write(self, key: str, normalized: str, embedding: np.ndarray, now: float) -> None:
+        try:
+            self._write_row(key, normalized, embedding, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Query cache write failed: {str(e)}")
+
+    def put(self, text: str, normalized: str, embedding: np.ndarray) -> None:
+        # Blocking; request handlers use store()
+        key = cache_key(text)
+        now = time.time()
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, (normalized, embedding, now))
+        self._write_row(key, normalized, embedding, now)
+
+    def _write_row(self, key: str, normalized: str, embedding: np.ndarray, now: float) -> None:
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO normalized_queries (key, normalized, embedding, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, normalized, embedding.tobytes(), now, now)
+                )
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                self._prune(now)
+
+    def _remember(self, key: str, entry: Tuple[str, np.ndarray, float]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _prune(self, now: float) -> None:
+        # Called with _db_lock held
+        with self._conn:
+            self._conn.execute("DELETE FROM normalized_queries WHERE created_at <= ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM normalized_queries WHERE key IN ("
+                "SELECT key FROM normalized_queries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,)
+            )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory)
+            }
+
+query_cache = QueryCache(QUERY_CACHE_PATH, QUERY_CACHE_TTL_HOURS * 3600, QUERY_CACHE_MEMORY_ITEMS, QUERY_CACHE_MAX_ROWS)
@@ -1,15 +1,27 @@
 import os
 import logging
-from fastapi import FastAPI, HTTPException
+import json
+import asyncio
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Set
-from pinecone import Pinecone, ServerlessSpec
+from typing import List, Dict, Optional, Set, Tuple
 import time
-from sentence_transformers import SentenceTransformer
-import google.generativeai as genai
+import numpy as np
 from dotenv import load_dotenv
-from utils import fetch_open_access_pmcids, get_paper_metadata, extract_pdf_text, chunk_text, parse_date
-from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+from utils import search_open_access_pmcids, get_paper_metadata, fetch_pdf_bytes, fetch_nxml_chunks, parse_pdf, fetch_paper, chunk_text, parse_date
+from concurrency import run_blocking
+from pipeline import IndexingPipeline
+from ledger import IndexLedger, is_settled
+from membership import MembershipStore, membership_store
+from dedup import INDEX_DEDUP, chunk_deduplicator
+from chunking import CHUNKER
+from chunk_store import CHUNK_TEXT_IN_METADATA, chunk_store
+import startup
+from embedding import EmbeddingService
+from query_cache import query_cache
+from answer_cache import answer_cache
+from vector_store import create_vector_store
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -18,52 +30,93 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "medalpine-rag")
-PINECONE_ENV = os.getenv("PINECONE_ENV", "us-east-1")
-
-# Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
-
-# Ensure index exists at startup
-def ensure_index_exists():
-    try:
-        existing_indexes = pc.list_indexes().names()
-        if PINECONE_INDEX_NAME not in existing_indexes:
-            logger.info(f"Creating index: {PINECONE_INDEX_NAME}")
-            pc.create_index(
-                name=PINECONE_INDEX_NAME,
-                dimension=384,
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud="aws",
-                    region=PINECONE_ENV
-                )
-            )
-            logger.info(f"Waiting for index {PINECONE_INDEX_NAME} to be ready...")
-            time.sleep(30)  # Wait for index to initialize
-        else:
-            logger.info(f"Index {PINECONE_INDEX_NAME} already exists")
-    except Exception as e:
-        logger.error(f"Failed to ensure index exists: {str(e)}")
-        raise
-
-# Initialize index
-ensure_index_exists()
-index = pc.Index(PINECONE_INDEX_NAME)
-
-# Initialize Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-gemini = genai.GenerativeModel('gemini-2.0-flash')
-
-# Initialize embedding model
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Initialize web search
-search = DuckDuckGoSearchAPIWrapper()
+RAG_SPECULATIVE = os.getenv("RAG_SPECULATIVE", "true").lower() == "true"
+# Run one embedding at startup so the first real query doesn't pay for it
+RAG_WARMUP = os.getenv("RAG_WARMUP", "false").lower() == "true"
+# "torch" runs all-MiniLM-L6-v2 through sentence-transformers, "onnx" runs the int8 ONNX export of it
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# Speculative results are kept when the raw and normalized query embeddings are at least this close
+SPECULATIVE_MIN_SIMILARITY = float(os.getenv("SPECULATIVE_MIN_SIMILARITY", "0.9"))
+# /rag-query/batch: queries per normalization prompt, answers generated at once, batch size cap
+RAG_BATCH_NORMALIZE_GROUP = int(os.getenv("RAG_BATCH_NORMALIZE_GROUP", "20"))
+RAG_BATCH_GENERATION_CONCURRENCY = int(os.getenv("RAG_BATCH_GENERATION_CONCURRENCY", "8"))
+# Index queries and web searches a batch may have in flight on the shared io_executor,
+# so a large batch leaves threads for interactive requests
+RAG_BATCH_RETRIEVAL_CONCURRENCY = int(os.getenv("RAG_BATCH_RETRIEVAL_CONCURRENCY", "4"))
+RAG_BATCH_MAX_QUERIES = int(os.getenv("RAG_BATCH_MAX_QUERIES", "5000"))
+# The since-the-watermark search runs in windows of this many days, oldest first;
+# a window with more papers than the cap is split until each part fits
+INDEX_FORWARD_WINDOW_DAYS = int(os.getenv("INDEX_FORWARD_WINDOW_DAYS", "7"))
+INDEX_FORWARD_MAX_PAPERS = int(os.getenv("INDEX_FORWARD_MAX_PAPERS", "1000"))
+# Each specialty is indexed into its own namespace; the default namespace keeps
+# everything indexed before and is always searched too
+VECTOR_PARTITION_BY_SPECIALTY = os.getenv("VECTOR_PARTITION_BY_SPECIALTY", "true").lower() == "true"
+LEGACY_NAMESPACE = ""
+# Opt-in routing: rag_query searches only this many specialties, the ones closest to
+# the query. Off (0, search all) by default since it trades recall for fewer queries
+RAG_ROUTE_SPECIALTIES = int(os.getenv("RAG_ROUTE_SPECIALTIES", "0"))
+PARTITION_CACHE_SECONDS = float(os.getenv("PARTITION_CACHE_SECONDS", "300"))
+
+# Clients and the model are created by init_services() when the app starts, not at
+# import, so the server can answer /healthz while they load
+vector_store = None
+gemini = None
+embedder = None
+embedding_service = None
+search = None
+
+def _init_vector_store():
+    global vector_store
+    # Pinecone by default, VECTOR_STORE=local for on-prem/CI
+    vector_store = create_vector_store()
+
+def _init_gemini():
+    global gemini
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    gemini = genai.GenerativeModel('gemini-2.0-flash')
+
+def _init_embedder():
+    global embedder, embedding_service
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_embedder import OnnxEmbedder
+        model = OnnxEmbedder()
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer('all-MiniLM-L6-v2')
+    if RAG_WARMUP:
+        model.encode(["warm-up"])
+    embedder = model
+    embedding_service = EmbeddingService(embedder)
+
+def _init_search():
+    global search
+    from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+    search = DuckDuckGoSearchAPIWrapper()
+
+_SERVICES = {
+    "vector_store": _init_vector_store,
+    "gemini": _init_gemini,
+    "embedder": _init_embedder,
+    "search": _init_search,
+}
+startup.register(*_SERVICES)
+
+async def init_services() -> None:
+    # All four load concurrently; anything already set (e.g. a test double) is kept
+    for name in _SERVICES:
+        if globals()[name] is not None:
+            startup.status[name] = "ready"
+    await asyncio.gather(*(
+        startup.initialize(name, init) for name, init in _SERVICES.items() if globals()[name] is None
+    ))
 
 class QueryModel(BaseModel):
     query: str
+    stream: bool = False  # Answer as server-sent events: sources, then tokens as they are generated
+
+class BatchQueryModel(BaseModel):
+    queries: List[str]
 
 class CaseStudyModel(BaseModel):
     patient_history: str
@@ -71,6 +124,11 @@ class CaseStudyModel(BaseModel):
     patient_perspective: str
     doctor_opinion: str
     specialties: List[str] = ["general"]
+    stream: bool = False
+
+async def embed(texts: List[str]):
+    # Query and index traffic share one micro-batching scheduler in front of the model
+    return await embedding_service.encode(texts)
 
 async def normalize_medical_terms(query: str) -> str:
     prompt = f"""
@@ -83,258 +141,659 @@ async def normalize_medical_terms(query: str) -> str:
     Input: "{query}"
     Output:
     """
-    response = gemini.generate_content(prompt)
+    response = await gemini.generate_content_async(prompt)
     normalized = response.text.strip()
     logger.info(f"Normalized query: '{query}' -> '{normalized}'")
     return normalized
 
-def get_indexed_papers(specialty: str, db) -> Set[str]:
-    doc_ref = db.collection("indexed_papers").document(specialty)
-    doc = doc_ref.get()
-    if doc.exists:
-        return set(doc.to_dict().get("pmcids", []))
-    return set()
-
-def update_indexed_papers(specialty: str, pmcids: List[str], db) -> None:
-    doc_ref = db.collection("indexed_papers").document(specialty)
-    doc = doc_ref.get()
-    if doc.exists:
-        current_pmcids = set(doc.to_dict().get("pmcids", []))
-        updated_pmcids = list(current_pmcids.union(set(pmcids)))
-        doc_ref.update({"pmcids": updated_pmcids})
-    else:
-        doc_ref.set({"pmcids": pmcids})
+async def normalize_medical_terms_batch(queries: List[str]) -> List[str]:
+    # One prompt for a group of queries; falls back to one call each if the reply
+    # isn't a JSON list of the right length
+    numbered = "\n".join(f"{i + 1}. {json.dumps(query)}" for i, query in enumerate(queries))
+    prompt = f"""
+    Convert each of the following medical queries from layman's terms to proper medical terminology.
+    Return only a JSON array of strings, one per query and in the same order, without explanations or formatting.
+    For example:
+    Input: 1. "heart attack with chest pain and shortness of breath"
+    Output: ["myocardial infarction with angina pectoris and dyspnea"]
 
-async def index_papers(request: Dict, db):
-    niche = request.get("niche", "neurology").lower()
-    num_papers = request.get("num_papers", 30)
-    
-    indexed_papers = get_indexed_papers(niche, db)
-    successfully_indexed = []
-    start_date = "2025/05/18"  # Start from today (May 18, 2025)
-    batch_size = num_papers * 2  # Fetch more papers per batch
+    Input:
+    {numbered}
+    Output:
+    """
+    response = await gemini.generate_content_async(prompt)
+    try:
+        normalized = json.loads(response.text.strip().removeprefix("```json").strip("`").strip())
+        if isinstance(normalized, list) and len(normalized) == len(queries) and all(isinstance(n, str) for n in normalized):
+            return [n.strip() for n in normalized]
+    except ValueError:
+        pass
+    logger.warning(f"Grouped normalization returned an unusable reply for {len(queries)} queries, normalizing one by one")
+    return list(await asyncio.gather(*(normalize_medical_terms(query) for query in queries)))
+
+async def normalize_and_embed(text: str):
+    # Repeated questions skip both the Gemini rewrite and the forward pass
+    cached = await query_cache.lookup(text)
+    if cached:
+        return cached
+    normalized = await normalize_medical_terms(text)
+    embedding = (await embed([normalized]))[0]
+    query_cache.store(text, normalized, embedding)
+    return normalized, embedding
+
+def _needs_indexing(paper: Dict, entry: Optional[Dict], members: Set[str]) -> bool:
+    if entry is None:
+        # Papers indexed before the ledger existed only appear in the membership store
+        return paper["pmcid"] not in members
+    if is_settled(entry):
+        # Settled papers are redone only when PMC has updated them since
+        return entry.get("last_updated") != paper["last_updated"]
+    # Interrupted part-way through, or failed with attempts left; try it again
+    return True
+
+async def _forward_windows(niche: str, since: str, until: str, limit: int = INDEX_FORWARD_MAX_PAPERS):
+    # Yields (since, until, pmcids) for every paper changed in the window, oldest
+    # part first. A window that fills the cap is searched again in halves, and a
+    # single day that fills it with a larger cap, so nothing past the cap is lost
+    pmcids = await search_open_access_pmcids(niche, limit, until, since, "mdat")
+    if len(pmcids) < limit:
+        yield since, until, pmcids
+        return
+    start, end = datetime.strptime(since, "%Y/%m/%d"), datetime.strptime(until, "%Y/%m/%d")
+    days = (end - start).days
+    if days > 1:
+        middle = (start + timedelta(days=days // 2)).strftime("%Y/%m/%d")
+        parts = [(since, middle, limit), (middle, until, limit)]
+    else:
+        parts = [(since, until, limit * 2)]
+    for part in parts:
+        async for window in _forward_windows(niche, *part):
+            yield window
+
+async def _candidate_papers(niche: str, batch_size: int, ledger: IndexLedger, membership: MembershipStore):
+    # Yields papers that still need indexing: first anything added or updated since
+    # the ledger's watermark, then older papers from where the last backfill stopped.
+    # The pipeline stops pulling once it has enough.
+    seen = set()
+    run_date = datetime.now().strftime("%Y/%m/%d")
+
+    async def unindexed(pmcids: List[str]):
+        papers = await run_blocking(get_paper_metadata, pmcids)
+        fresh = [paper for paper in papers if paper["pmcid"] not in seen]
+        seen.update(paper["pmcid"] for paper in fresh)
+        entries, members = await asyncio.gather(
+            ledger.statuses([paper["pmcid"] for paper in fresh]),
+            membership.contains(paper["pmcid"] for paper in fresh)
+        )
+        return papers, [paper for paper in fresh if _needs_indexing(paper, entries.get(paper["pmcid"]), members)]
+
+    if ledger.watermark:
+        # Oldest window first, so the watermark moves up as each one is finished
+        since = ledger.watermark
+        while True:
+            until = min((datetime.strptime(since, "%Y/%m/%d") + timedelta(days=INDEX_FORWARD_WINDOW_DAYS)).strftime("%Y/%m/%d"), run_date)
+            async for window_since, window_until, pmcids in _forward_windows(niche, since, until):
+                _, new_papers = await unindexed(pmcids) if pmcids else ([], [])
+                ledger.track_forward(window_until, new_papers)
+                logger.info(f"{len(new_papers)} papers added or updated in {niche} from {window_since} to {window_until}")
+                for paper in new_papers:
+                    yield paper
+            if until >= run_date:
+                break
+            since = until
+    else:
+        # First run: the backfill below covers everything up to today
+        ledger.track_forward(run_date, [])
 
-    while len(successfully_indexed) < num_papers:
-        pmcids = fetch_open_access_pmcids(niche, batch_size, start_date)
+    start_date = ledger.cursor or run_date
+    while True:
+        pmcids = await search_open_access_pmcids(niche, batch_size, start_date)
         if not pmcids:
             logger.info(f"No more papers available for {niche}")
-            break
+            return
 
-        papers = get_paper_metadata(pmcids)
+        papers, new_papers = await unindexed(pmcids)
         if not papers:
             logger.info(f"No metadata available for fetched PMCIDs in {niche}")
-            break
+            return
+        ledger.track(start_date, new_papers)
 
-        if papers:
-            oldest_date = min(parse_date(paper["last_updated"]) for paper in papers)
-            start_date = oldest_date.strftime("%Y/%m/%d")
-        else:
-            current_date = datetime.strptime(start_date, "%Y/%m/%d")
-            start_date = (current_date - timedelta(days=365)).strftime("%Y/%m/%d")
-
-        new_pmcids = [paper["pmcid"] for paper in papers if paper["pmcid"] not in indexed_papers]
-        new_papers = [paper for paper in papers if paper["pmcid"] in new_pmcids]
+        oldest_date = min(parse_date(paper["last_updated"]) for paper in papers)
+        previous_date, start_date = start_date, oldest_date.strftime("%Y/%m/%d")
+        ledger.backfill_from(start_date)
 
+        if not new_papers and start_date == previous_date:
+            logger.info(f"Search window for {niche} stopped moving, no more papers to index")
+            return
         if not new_papers:
             logger.info(f"No new papers in this batch for {niche}, fetching older papers...")
             continue
-
         for paper in new_papers:
-            if len(successfully_indexed) >= num_papers:
-                break
-            logger.info(f"Processing paper: {paper['pmcid']}")
-            pdf_text = extract_pdf_text(paper["file_path"])
-            if pdf_text:
-                chunks = chunk_text(pdf_text)
-                enriched_chunks = [f"[Medical Specialty: {niche}] {chunk}" for chunk in chunks]
-                embeddings = embedder.encode(enriched_chunks, convert_to_numpy=True)
-                # Convert last_updated to Unix timestamp
-                last_updated_date = parse_date(paper["last_updated"])
-                last_updated_timestamp = int(last_updated_date.timestamp())
-                vectors = [
-                    {
-                        "id": f"{paper['pmcid']}_{i}",
-                        "values": embedding.tolist(),
-                        "metadata": {
-                            "pmcid": paper["pmcid"],
-                            "title": paper["title"],
-                            "specialty": niche,
-                            "chunk_id": i,
-                            "text": chunk[:1000],
-                            "last_updated": last_updated_timestamp  # Store as timestamp
-                        }
-                    }
-                    for i, (embedding, chunk) in enumerate(zip(embeddings, enriched_chunks))
-                ]
-                for i in range(0, len(vectors), 100):
-                    batch = vectors[i:i + 100]
-                    index.upsert(vectors=batch)
-                    logger.info(f"Upserted batch {i//100 + 1} for {paper['pmcid']} ({len(batch)} chunks)")
-                successfully_indexed.append(paper["pmcid"])
-            else:
-                logger.warning(f"No text extracted from {paper['pmcid']}, skipping")
-
-    if successfully_indexed:
-        update_indexed_papers(niche, successfully_indexed, db)
-        logger.info(f"Successfully indexed {len(successfully_indexed)} new papers for {niche}")
+            yield paper
+
+def _chunk_records(paper: Dict, chunks: List[str]) -> Dict[str, Dict]:
+    # What the chunk store keeps per vector id; the same fields older vectors carry in metadata
+    return {f"{paper['pmcid']}_{i}": {"title": paper["title"], "text": chunk} for i, chunk in enumerate(chunks)}
+
+def _paper_vectors(niche: str, paper: Dict, chunks: List[str], embeddings) -> List[Dict]:
+    # Convert last_updated to Unix timestamp
+    last_updated_timestamp = int(parse_date(paper["last_updated"]).timestamp())
+    records = _chunk_records(paper, chunks)
+    vectors = []
+    for i, ((vector_id, record), embedding) in enumerate(zip(records.items(), embeddings)):
+        # Ids and filter fields only; text and title are read from the chunk store
+        metadata = {
+            "pmcid": paper["pmcid"],
+            "specialty": niche,
+            "chunk_id": i,
+            "last_updated": last_updated_timestamp  # Store as timestamp
+        }
+        if CHUNK_TEXT_IN_METADATA:
+            metadata.update(record)
+        vectors.append({"id": vector_id, "values": embedding.tolist(), "metadata": metadata})
+    return vectors
+
+async def index_papers(request: Dict, db, progress=None):
+    niche = request.get("niche", "neurology").lower()
+    num_papers = request.get("num_papers", 30)
     
-    return {"message": f"Indexed {len(successfully_indexed)} papers for {niche}"}
+    membership = membership_store(db, niche)
+    successfully_indexed = []
+    ledger = IndexLedger(db, niche)
+    await ledger.load()
+    batch_size = num_papers * 2  # Fetch more papers per batch
 
-async def rag_query(request: QueryModel):
-    query = request.query
-    if not query:
-        raise HTTPException(status_code=400, detail="Query is required")
+    deduplicator = chunk_deduplicator() if INDEX_DEDUP else None
+    dedup_counts = {"chunks": 0, "repeated_in_paper": 0, "already_indexed": 0}
 
-    normalized_query = await normalize_medical_terms(query)
-    query_embedding = embedder.encode([normalized_query], convert_to_numpy=True)[0].tolist()
-    logger.info(f"Embedded normalized query: {normalized_query}")
+    async def fetch(paper: Dict):
+        if CHUNKER == "nxml":
+            # Chunked from the XML as it streams in; papers without usable NXML fall back to the PDF
+            chunks = await fetch_paper(fetch_nxml_chunks, paper["file_path"], paper["last_updated"])
+            if chunks:
+                return chunks
+        return await fetch_paper(fetch_pdf_bytes, paper["file_path"], paper["last_updated"])
 
+    async def parse(paper: Dict, content) -> List[str]:
+        if isinstance(content, list):
+            chunks = content
+        else:
+            # PDF parsing is CPU-bound, so it runs in worker processes off the event loop
+            pdf_text = await parse_pdf(content, paper["pmcid"])
+            if not pdf_text:
+                return []
+            chunks = chunk_text(pdf_text)
+        if deduplicator is not None:
+            # Boilerplate and repeated text is dropped before it costs an embedding and a vector
+            chunks, counts = await run_blocking(deduplicator.filter, niche, paper["pmcid"], chunks)
+            for key, count in counts.items():
+                dedup_counts[key] += count
+        chunks = [f"[Medical Specialty: {niche}] {chunk}" for chunk in chunks]
+        # Stored before the vectors exist, so a query never finds a vector without its text
+        await run_blocking(chunk_store.put, _chunk_records(paper, chunks))
+        return chunks
+
+    async def upsert(batch: List[Dict]) -> None:
+        await run_blocking(vector_store.upsert, vectors=batch, namespace=niche if VECTOR_PARTITION_BY_SPECIALTY else None)
+
+    def on_indexed(paper: Dict) -> None:
+        successfully_indexed.append(paper["pmcid"])
+        if VECTOR_PARTITION_BY_SPECIALTY and niche not in _partition_names:
+            _partition_names.append(niche)
+        answer_cache.invalidate_specialties([niche])
+
+    async def on_stage(stage: str, paper: Dict) -> None:
+        if stage == "failed" and deduplicator is not None:
+            await run_blocking(deduplicator.forget, niche, paper["pmcid"])
+        await ledger.mark(paper, stage)
+
+    pipeline = IndexingPipeline(
+        fetch=fetch,
+        parse=parse,
+        embed=embed,
+        upsert=upsert,
+        build_vectors=lambda paper, chunks, embeddings: _paper_vectors(niche, paper, chunks, embeddings),
+        on_indexed=on_indexed,
+        on_stage=on_stage,
+        progress=progress
+    )
     try:
-        # First attempt: Query without time filter to check if we have any relevant data
-        results = index.query(
-            vector=query_embedding,
-            top_k=10,
-            include_metadata=True
-            # Remove time filter initially
-        )
-        
-        # Track origins of information
-        pinecone_sources = []
-        web_sources = []
-        
-        # Safely format contexts with proper error handling for dates
-        contexts = []
-        for match in results["matches"]:
-            try:
-                metadata = match.get('metadata', {})
-                title = metadata.get('title', 'Unknown')
-                pmcid = metadata.get('pmcid', 'Unknown')
-                text = metadata.get('text', 'No content')
-                specialty = metadata.get('specialty', 'Unknown')
-                
-                # Handle timestamp with proper error checking
-                date_str = "Unknown date"
-                if 'last_updated' in metadata:
-                    last_updated = metadata['last_updated']
-                    if isinstance(last_updated, (int, float)):
-                        date_str = datetime.fromtimestamp(last_updated).strftime('%Y-%m-%d')
-                
-                context = f"Source: {title} (Document ID: {pmcid}, Specialty: {specialty}, Last Updated: {date_str})\n\nContent: {text}"
-                contexts.append(context)
-                
-                # Track this source
-                if pmcid != 'Unknown':
-                    pinecone_sources.append({
-                        "pmcid": pmcid,
-                        "title": title,
-                        "date": date_str,
-                        "score": match.get('score', 0)
-                    })
-                    
-            except Exception as e:
-                logger.error(f"Error formatting context: {str(e)}")
-                continue  # Skip this result if there's an error
-                
-        context_text = "\n\n===\n\n".join(contexts) if contexts else ""
-        logger.info(f"Retrieved {len(contexts)} contexts from Pinecone")
-
-        # Determine if we need web search based on:
-        # 1. No results from Pinecone
-        # 2. Low relevance of results
-        query_terms = normalized_query.lower().split()
-        relevant_terms = ["treatment", "therapy", "drug", "medication", "management"]
-        
-        # Check if any result contains our search terms or relevant medical terms
-        relevant_contexts = []
-        for content in contexts:
-            content_lower = content.lower()
-            if any(term in content_lower for term in query_terms) or any(term in content_lower for term in relevant_terms):
-                relevant_contexts.append(content)
+        await pipeline.run(_candidate_papers(niche, batch_size, ledger, membership), num_papers)
+    finally:
+        # Checkpoint even when the run fails or is cancelled, so the next one resumes here
+        await ledger.flush()
+        if successfully_indexed:
+            await membership.add(successfully_indexed)
+
+    if successfully_indexed:
+        logger.info(f"Successfully indexed {len(successfully_indexed)} new papers for {niche}")
+    result = {"message": f"Indexed {len(successfully_indexed)} papers for {niche}"}
+    if deduplicator is not None:
+        dropped = dedup_counts["repeated_in_paper"] + dedup_counts["already_indexed"]
+        # Every chunk is one forward pass over a 1000-character window and one vector
+        saved = dropped / dedup_counts["chunks"] if dedup_counts["chunks"] else 0.0
+        logger.info(f"Dedup for {niche}: {dropped} of {dedup_counts['chunks']} chunks skipped "
+                    f"({dedup_counts['repeated_in_paper']} repeated within a paper, {dedup_counts['already_indexed']} "
+                    f"already indexed), {saved:.1%} fewer embeddings and vectors")
+        result["dedup"] = {**dedup_counts, "embeddings_saved": dropped, "vectors_saved": dropped, "saved_fraction": saved}
+    return result
+
+async def _timed(timings: Dict[str, float], stage: str, awaitable):
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[stage] = (time.perf_counter() - started) * 1000
+
+def _server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
+
+async def _with_chunk_text(results) -> Dict:
+    # One bulk read for the top-k matches whose vectors don't carry their text.
+    # A match whose text is in neither place is dropped, not sent to Gemini as
+    # an empty context.
+    missing = [match["id"] for match in results["matches"] if "text" not in match.get("metadata", {})]
+    if not missing:
+        return results
+    records = await run_blocking(chunk_store.get, missing)
+    matches = []
+    for match in results["matches"]:
+        if match["id"] in records:
+            match["metadata"].update(records[match["id"]])
+        elif "text" not in match.get("metadata", {}):
+            continue
+        matches.append(match)
+    if len(records) < len(missing):
+        logger.warning(f"Dropped {len(missing) - len(records)} of {len(results['matches'])} matches with no text "
+                       f"in vector metadata or the chunk store at {chunk_store.root}")
+    return {"matches": matches}
+
+_partition_names: List[str] = []
+_partitions_fetched = float("-inf")
+_specialty_embeddings: Dict[str, np.ndarray] = {}
+
+async def _partitions() -> List[str]:
+    global _partition_names, _partitions_fetched
+    if time.monotonic() - _partitions_fetched >= PARTITION_CACHE_SECONDS:
+        _partition_names = await run_blocking(vector_store.namespaces)
+        _partitions_fetched = time.monotonic()
+    return _partition_names
+
+async def _route(embedding) -> Optional[List[str]]:
+    # The specialties whose "[Medical Specialty: ...]" chunk prefix embeds closest
+    # to the query, or None to search them all
+    specialties = [name for name in await _partitions() if name != LEGACY_NAMESPACE]
+    if not RAG_ROUTE_SPECIALTIES or len(specialties) <= RAG_ROUTE_SPECIALTIES:
+        return None
+    missing = [name for name in specialties if name not in _specialty_embeddings]
+    if missing:
+        vectors = await embed([f"[Medical Specialty: {name}]" for name in missing])
+        _specialty_embeddings.update(zip(missing, vectors))
+    scores = {name: float(np.dot(_specialty_embeddings[name], embedding)) for name in specialties}
+    return sorted(specialties, key=scores.get, reverse=True)[:RAG_ROUTE_SPECIALTIES]
+
+async def _search(vector: List[float], top_k: int, specialties: Optional[List[str]] = None,
+                  filter: Optional[Dict] = None) -> Dict:
+    # Fans out one query per partition in parallel and merges their top-k into one
+    if VECTOR_PARTITION_BY_SPECIALTY:
+        namespaces = [name for name in await _partitions()
+                      if name == LEGACY_NAMESPACE or specialties is None or name in specialties]
+    else:
+        namespaces = [LEGACY_NAMESPACE]
+    responses = await asyncio.gather(*(
+        run_blocking(vector_store.query, vector=vector, top_k=top_k, include_metadata=True, filter=filter, namespace=namespace)
+        for namespace in namespaces
+    ))
+    matches, seen = [], set()
+    # A paper re-indexed since partitioning also has its old vectors in the default namespace
+    for match in sorted((match for response in responses for match in response["matches"]),
+                        key=lambda match: match["score"], reverse=True):
+        if match["id"] not in seen:
+            seen.add(match["id"])
+            matches.append(match)
+    return await _with_chunk_text({"matches": matches[:top_k]})
+
+async def _query_index(embedding) -> Dict:
+    # Query without time filter to check if we have any relevant data
+    specialties = await _route(embedding) if VECTOR_PARTITION_BY_SPECIALTY else None
+    return await _search(embedding.tolist(), 10, specialties)
+
+async def _retrieve(embedding_task: asyncio.Task):
+    # Cancelling this also cancels the embedding if it is still running
+    embedding = (await embedding_task)[0]
+    return embedding, await _query_index(embedding)
+
+def _needs_web_search(text: str) -> bool:
+    return "alzheimer" in text.lower()
+
+async def _web_search(text: str) -> List[Dict]:
+    web_query = f"{text} 2024 OR 2025 FDA approved clinical trials site:nih.gov OR site:alzheimer.org OR site:clinicaltrials.gov"
+    return await run_blocking(search.results, web_query, max_results=5)
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _stream_answer(prompt: Optional[str], field: str, sources: List[str], answer: Optional[str] = None,
+                   on_complete=None, headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    # Sends sources straight away, then the answer as the model generates it (or a
+    # ready-made answer in one piece). Starlette closes this generator when the client
+    # goes away, which stops pulling from the Gemini stream and drops it.
+    async def events():
+        yield _sse("sources", {"sources": sources})
+        if answer is not None:
+            yield _sse("token", {"text": answer})
+            yield _sse("done", {})
+            return
+        parts = []
+        completed = False
+        try:
+            stream = await gemini.generate_content_async(prompt, stream=True)
+            async for chunk in stream:
+                parts.append(chunk.text)
+                yield _sse("token", {"text": chunk.text})
+            completed = True
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {str(e)}", exc_info=True)
+            yield _sse("error", {"detail": f"Generation failed: {str(e)}"})
+            return
+        finally:
+            if not completed:
+                logger.info(f"Stopped streaming {field} after {len(parts)} chunks")
+        if on_complete:
+            on_complete({field: "".join(parts), "sources": sources})
+        yield _sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **(headers or {})})
+
+async def _answer_prompt(query: str, normalized_query: str, results: Dict, timings: Dict[str, float],
+                         speculative_web: Optional[asyncio.Task] = None) -> Tuple[str, List[str]]:
+    # Track origins of information
+    pinecone_sources = []
+    web_sources = []
+    
+    # Safely format contexts with proper error handling for dates
+    contexts = []
+    for match in results["matches"]:
+        try:
+            metadata = match.get('metadata', {})
+            title = metadata.get('title', 'Unknown')
+            pmcid = metadata.get('pmcid', 'Unknown')
+            text = metadata.get('text', 'No content')
+            specialty = metadata.get('specialty', 'Unknown')
+            
+            # Handle timestamp with proper error checking
+            date_str = "Unknown date"
+            if 'last_updated' in metadata:
+                last_updated = metadata['last_updated']
+                if isinstance(last_updated, (int, float)):
+                    date_str = datetime.fromtimestamp(last_updated).strftime('%Y-%m-%d')
+            
+            context = f"Source: {title} (Document ID: {pmcid}, Specialty: {specialty}, Last Updated: {date_str})\n\nContent: {text}"
+            contexts.append(context)
+            
+            # Track this source
+            if pmcid != 'Unknown':
+                pinecone_sources.append({
+                    "pmcid": pmcid,
+                    "title": title,
+                    "date": date_str,
+                    "score": match.get('score', 0)
+                })
                 
-        has_relevant_context = len(relevant_contexts) >= 3  # Lower threshold to 3
-        
-        # Step 3: Fallback to web search if needed
-        web_search_results = []
-        
-        # Add specific handling for Alzheimer's
-        if "alzheimer" in normalized_query.lower() and not has_relevant_context:
-            logger.info("Query is about Alzheimer's disease and insufficient Pinecone results, using targeted web search")
-            web_query = f"{normalized_query} 2024 OR 2025 FDA approved clinical trials site:nih.gov OR site:alzheimer.org OR site:clinicaltrials.gov"
-            web_search_results = search.results(web_query, max_results=5)
-            web_contexts = [
-                f"Source: Web Search Result (URL: {result['link']})\n\nContent: {result['snippet']}"
-                for result in web_search_results
-            ]
+        except Exception as e:
+            logger.error(f"Error formatting context: {str(e)}")
+            continue  # Skip this result if there's an error
             
-            # Add web search results to context
-            if web_contexts:
-                if context_text:
-                    context_text += "\n\n===\n\n" + "\n\n===\n\n".join(web_contexts)
-                else:
-                    context_text = "\n\n===\n\n".join(web_contexts)
-                    
-            logger.info(f"Retrieved {len(web_search_results)} web search results")
+    context_text = "\n\n===\n\n".join(contexts) if contexts else ""
+    logger.info(f"Retrieved {len(contexts)} contexts from Pinecone")
+
+    # Determine if we need web search based on:
+    # 1. No results from Pinecone
+    # 2. Low relevance of results
+    query_terms = normalized_query.lower().split()
+    relevant_terms = ["treatment", "therapy", "drug", "medication", "management"]
+    
+    # Check if any result contains our search terms or relevant medical terms
+    relevant_contexts = []
+    for content in contexts:
+        content_lower = content.lower()
+        if any(term in content_lower for term in query_terms) or any(term in content_lower for term in relevant_terms):
+            relevant_contexts.append(content)
             
-            # Track web sources
-            web_sources = [result['link'] for result in web_search_results]
-
-        # Step 4: Generate response with Gemini
-        prompt = f"""
-        You are MedAlpine AI, a medical research assistant for healthcare professionals.
-        Answer the following question based on the provided context from recent medical papers and web search results.
-        Even when context is limited, provide the most up-to-date information available from reliable sources.
-        ALWAYS provide specific treatment options, their mechanisms of action, approval status, and evidence of efficacy when available.
-        NEVER respond with "I am unable to answer" unless absolutely no relevant information exists.
+    has_relevant_context = len(relevant_contexts) >= 3  # Lower threshold to 3
+    
+    # Step 3: Fallback to web search if needed
+    web_search_results = []
+    
+    # Add specific handling for Alzheimer's
+    if _needs_web_search(normalized_query) and not has_relevant_context:
+        logger.info("Query is about Alzheimer's disease and insufficient Pinecone results, using targeted web search")
+        if speculative_web:
+            web_search_results = await speculative_web
+        else:
+            web_search_results = await _timed(timings, "web", _web_search(normalized_query))
+        web_contexts = [
+            f"Source: Web Search Result (URL: {result['link']})\n\nContent: {result['snippet']}"
+            for result in web_search_results
+        ]
         
-        Make sure to properly cite your sources:
-        - For medical papers, cite them as (Document ID: PMCID)
-        - For web sources, cite them as (Source: URL)
-        - If multiple sources support a claim, cite all of them
+        # Add web search results to context
+        if web_contexts:
+            if context_text:
+                context_text += "\n\n===\n\n" + "\n\n===\n\n".join(web_contexts)
+            else:
+                context_text = "\n\n===\n\n".join(web_contexts)
+                
+        logger.info(f"Retrieved {len(web_search_results)} web search results")
         
-        CONTEXT:
-        {context_text}
+        # Track web sources
+        web_sources = [result['link'] for result in web_search_results]
+    elif speculative_web:
+        speculative_web.cancel()
 
-        QUESTION: {query}
+    # Step 4: Generate response with Gemini
+    prompt = f"""
+    You are MedAlpine AI, a medical research assistant for healthcare professionals.
+    Answer the following question based on the provided context from recent medical papers and web search results.
+    Even when context is limited, provide the most up-to-date information available from reliable sources.
+    ALWAYS provide specific treatment options, their mechanisms of action, approval status, and evidence of efficacy when available.
+    NEVER respond with "I am unable to answer" unless absolutely no relevant information exists.
+    
+    Make sure to properly cite your sources:
+    - For medical papers, cite them as (Document ID: PMCID)
+    - For web sources, cite them as (Source: URL)
+    - If multiple sources support a claim, cite all of them
+    
+    CONTEXT:
+    {context_text}
 
-        ANSWER (be specific about treatment options and include citations):
-        """
+    QUESTION: {query}
+
+    ANSWER (be specific about treatment options and include citations):
+    """
+    
+    # Add Alzheimer's-specific information if requested
+    if "alzheimer" in normalized_query.lower():
+        prompt += """
+        Include the following FDA-approved treatments if not already covered in the context:
+        - Cholinesterase inhibitors (donepezil, rivastigmine, galantamine) for symptom management
+        - NMDA receptor antagonists (memantine) for moderate to severe cases
+        - Monoclonal antibodies: aducanumab (Aduhelm, 2021), lecanemab (Leqembi, 2023), and donanemab (2024) which target amyloid plaques
         
-        # Add Alzheimer's-specific information if requested
-        if "alzheimer" in normalized_query.lower():
-            prompt += """
-            Include the following FDA-approved treatments if not already covered in the context:
-            - Cholinesterase inhibitors (donepezil, rivastigmine, galantamine) for symptom management
-            - NMDA receptor antagonists (memantine) for moderate to severe cases
-            - Monoclonal antibodies: aducanumab (Aduhelm, 2021), lecanemab (Leqembi, 2023), and donanemab (2024) which target amyloid plaques
-            
-            Also make sure to distinguish between:
-            1. Symptomatic treatments (improving symptoms but not affecting disease progression)
-            2. Disease-modifying treatments (targeting the underlying pathophysiology)
-            """
+        Also make sure to distinguish between:
+        1. Symptomatic treatments (improving symptoms but not affecting disease progression)
+        2. Disease-modifying treatments (targeting the underlying pathophysiology)
+        """
+    
+    # Combine and deduplicate source IDs
+    all_sources = []
+    
+    # Add Pinecone sources first (with more detail)
+    for source in pinecone_sources:
+        all_sources.append(f"{source['pmcid']} - {source['title']}")
         
-        response = gemini.generate_content(prompt)
+    # Then add web sources
+    all_sources.extend(web_sources)
+    
+    # If we have no sources but generated a response, mark it as using general knowledge
+    if not all_sources:
+        all_sources = ["Response generated using general medical knowledge"]
+    return prompt, all_sources
+
+async def rag_query(request: QueryModel, response: Response):
+    query = request.query
+    if not query:
+        raise HTTPException(status_code=400, detail="Query is required")
+
+    timings = {}
+    started = time.perf_counter()
+    speculative_embedding = None
+    speculative_retrieval = None
+    speculative_web = None
+    cached = await query_cache.lookup(query)
+    if cached:
+        normalized_query, query_embedding = cached
+    else:
+        if RAG_SPECULATIVE:
+            # Retrieve on the raw query (and start a likely web search) while Gemini normalizes it
+            speculative_embedding = asyncio.create_task(embed([query]))
+            speculative_retrieval = asyncio.create_task(_timed(timings, "retrieve", _retrieve(speculative_embedding)))
+            if _needs_web_search(query):
+                speculative_web = asyncio.create_task(_timed(timings, "web", _web_search(query)))
+
+        try:
+            normalized_query = await _timed(timings, "normalize", normalize_medical_terms(query))
+        except Exception:
+            for task in (speculative_retrieval, speculative_web):
+                if task:
+                    task.cancel()
+            raise
+
+    try:
+        if not cached:
+            if speculative_embedding and normalized_query.strip().lower() == query.strip().lower():
+                query_embedding = (await speculative_embedding)[0]
+            else:
+                query_embedding = (await _timed(timings, "embed", embed([normalized_query])))[0]
+            query_cache.store(query, normalized_query, query_embedding)
+        logger.info(f"Embedded normalized query: {normalized_query}")
+
+        # Paraphrases of a recently answered question reuse its answer without an index query
+        cached_answer = answer_cache.lookup(query_embedding)
+        if cached_answer:
+            for task in (speculative_retrieval, speculative_web):
+                if task:
+                    task.cancel()
+            timings["total"] = (time.perf_counter() - started) * 1000
+            if request.stream:
+                return _stream_answer(None, "answer", cached_answer["sources"], answer=cached_answer["answer"],
+                                      headers={"Server-Timing": _server_timing(timings)})
+            response.headers["Server-Timing"] = _server_timing(timings)
+            return cached_answer
+
+        if speculative_retrieval:
+            raw_embedding, results = await speculative_retrieval
+            if raw_embedding is not query_embedding:
+                similarity = float(np.dot(raw_embedding, query_embedding) /
+                                   (np.linalg.norm(raw_embedding) * np.linalg.norm(query_embedding)))
+                if similarity < SPECULATIVE_MIN_SIMILARITY:
+                    logger.info(f"Normalized query diverged from raw query (cosine {similarity:.3f}), re-querying index")
+                    results = await _timed(timings, "requery", _query_index(query_embedding))
+        else:
+            results = await _timed(timings, "retrieve", _query_index(query_embedding))
+
+        prompt, all_sources = await _answer_prompt(query, normalized_query, results, timings, speculative_web)
+        specialties = _result_specialties(results)
+
+        if request.stream:
+            # Server-Timing covers everything up to the start of generation
+            timings["total"] = (time.perf_counter() - started) * 1000
+            return _stream_answer(prompt, "answer", all_sources,
+                                  on_complete=lambda answer: answer_cache.store(query_embedding, answer, specialties),
+                                  headers={"Server-Timing": _server_timing(timings)})
+
+        generation = await _timed(timings, "generate", gemini.generate_content_async(prompt))
         logger.info(f"Generated response for query: {query}")
 
-        # Combine and deduplicate source IDs
-        all_sources = []
-        
-        # Add Pinecone sources first (with more detail)
-        for source in pinecone_sources:
-            all_sources.append(f"{source['pmcid']} - {source['title']}")
-            
-        # Then add web sources
-        all_sources.extend(web_sources)
-        
-        # If we have no sources but generated a response, mark it as using general knowledge
-        if not all_sources:
-            all_sources = ["Response generated using general medical knowledge"]
-        
-        return {"answer": response.text, "sources": all_sources}
+        answer = {"answer": generation.text, "sources": all_sources}
+        answer_cache.store(query_embedding, answer, specialties)
+
+        timings["total"] = (time.perf_counter() - started) * 1000
+        response.headers["Server-Timing"] = _server_timing(timings)
+        return answer
         
     except Exception as e:
         logger.error(f"Query failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to query Pinecone or web: {str(e)}")
     
+def _result_specialties(results: Dict) -> Set[str]:
+    return {match.get('metadata', {}).get('specialty') for match in results["matches"]} - {None}
+
+async def _batch_answer(query: str, normalized_query: str, query_embedding, generation_slots: asyncio.Semaphore,
+                        retrieval_slots: asyncio.Semaphore) -> Dict:
+    cached_answer = answer_cache.lookup(query_embedding)
+    if cached_answer:
+        return cached_answer
+    async with retrieval_slots:
+        results = await _query_index(query_embedding)
+        prompt, all_sources = await _answer_prompt(query, normalized_query, results, {})
+    async with generation_slots:
+        generation = await gemini.generate_content_async(prompt)
+    answer = {"answer": generation.text, "sources": all_sources}
+    answer_cache.store(query_embedding, answer, _result_specialties(results))
+    return answer
+
+async def rag_query_batch(request: BatchQueryModel):
+    queries = request.queries
+    if not queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if len(queries) > RAG_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {RAG_BATCH_MAX_QUERIES} queries per batch")
+
+    # Normalize cache misses a group per prompt and embed them in one call
+    prepared = dict(enumerate(await query_cache.lookup_many(queries)))
+    misses = [i for i, entry in prepared.items() if entry is None]
+    generation_slots = asyncio.Semaphore(RAG_BATCH_GENERATION_CONCURRENCY)
+    retrieval_slots = asyncio.Semaphore(RAG_BATCH_RETRIEVAL_CONCURRENCY)
+    if misses:
+        async def normalize_group(group: List[int]) -> List[str]:
+            async with generation_slots:
+                return await normalize_medical_terms_batch([queries[i] for i in group])
+        groups = [misses[g:g + RAG_BATCH_NORMALIZE_GROUP] for g in range(0, len(misses), RAG_BATCH_NORMALIZE_GROUP)]
+        try:
+            normalized = [n for group in await asyncio.gather(*(normalize_group(group) for group in groups)) for n in group]
+            embeddings = await embed(normalized)
+        except Exception as e:
+            logger.error(f"Batch normalization failed: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Failed to normalize queries: {str(e)}")
+        for i, normalized_query, embedding in zip(misses, normalized, embeddings):
+            query_cache.store(queries[i], normalized_query, embedding)
+            prepared[i] = (normalized_query, embedding)
+    logger.info(f"Batch of {len(queries)}: {len(misses)} normalized, {len(queries) - len(misses)} from the query cache")
+
+    async def answer(i: int) -> Dict:
+        normalized_query, embedding = prepared[i]
+        try:
+            return {"index": i, "query": queries[i], **await _batch_answer(queries[i], normalized_query, embedding,
+                                                                          generation_slots, retrieval_slots)}
+        except Exception as e:
+            logger.error(f"Batch query {i} failed: {str(e)}")
+            return {"index": i, "query": queries[i], "error": str(e)}
+
+    async def results():
+        # One NDJSON line per answer, in completion order
+        tasks = [asyncio.create_task(answer(i)) for i in range(len(queries))]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            # The client went away: stop the answers nobody will read
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 async def analyze_case(case: CaseStudyModel):
     case_description = f"""
     Patient History: {case.patient_history}
@@ -342,11 +801,13 @@ async def analyze_case(case: CaseStudyModel):
     Patient's Perspective: {case.patient_perspective}
     Doctor's Initial Assessment: {case.doctor_opinion}
     """
-    normalized_case = await normalize_medical_terms(case_description)
-    case_embedding = embedder.encode([normalized_case], convert_to_numpy=True)[0].tolist()
+    normalized_case, case_embedding = await normalize_and_embed(case_description)
+    case_embedding = case_embedding.tolist()
 
-    filter_condition = {"specialty": {"$in": case.specialties}} if case.specialties and "general" not in case.specialties else {}
-    results = index.query(vector=case_embedding, top_k=8, include_metadata=True, filter=filter_condition)
+    specialties = case.specialties if case.specialties and "general" not in case.specialties else None
+    # The filter still applies to the default namespace, where specialties are mixed
+    filter_condition = {"specialty": {"$in": specialties}} if specialties else {}
+    results = await _search(case_embedding, 8, specialties, filter_condition)
     contexts = [
         f"Source: {match['metadata'].get('title', 'Unknown')} (Document ID: {match['metadata'].get('pmcid', 'Unknown')}) [Specialty: {match['metadata'].get('specialty', 'Unknown')}, Last Updated: {datetime.fromtimestamp(match['metadata'].get('last_updated', 0)).strftime('%Y-%m-%d')}])\n\nContent: {match['metadata'].get('text', 'No content')}"
         for match in results["matches"]
@@ -378,8 +839,10 @@ async def analyze_case(case: CaseStudyModel):
     5. Cites specific research papers (using Document IDs) that support your analysis, including their last updated dates
     Be thorough yet concise. Acknowledge uncertainty where appropriate. Focus on evidence-based medicine.
     """
-    response = gemini.generate_content(prompt)
-    logger.info("Generated case study analysis")
-
     source_ids = list(set(match['metadata'].get('pmcid', 'Unknown') for match in results["matches"]))
+    if case.stream:
+        return _stream_answer(prompt, "analysis", source_ids)
+
+    response = await gemini.generate_content_async(prompt)
+    logger.info("Generated case study analysis")
     return {"analysis": response.text, "sources": source_ids}
\ No newline at end of file
@@ -0,0 +1,45 @@
+import os
+import asyncio
+import logging
+from typing import Callable, Dict
+from dotenv import load_dotenv
+from concurrency import run_blocking
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", "30"))
+
+# name -> "pending", "ready" or the last error; reported by /readyz
+status: Dict[str, str] = {}
+
+def register(*names: str) -> None:
+    for name in names:
+        status.setdefault(name, "pending")
+
+def is_ready(*names: str) -> bool:
+    # With names, only those dependencies; otherwise every registered one
+    states = [status.get(name, "pending") for name in names] if names else list(status.values())
+    return bool(states) and all(state == "ready" for state in states)
+
+async def initialize(name: str, init: Callable) -> None:
+    # Runs one dependency's setup (blocking ones on an IO thread), retrying with
+    # backoff so a slow network at cold start delays readiness instead of crashing
+    register(name)
+    delay = 1.0
+    while True:
+        try:
+            if asyncio.iscoroutinefunction(init):
+                await init()
+            else:
+                await run_blocking(init)
+            status[name] = "ready"
+            logger.info(f"Initialized {name}")
+            return
+        except Exception as e:
+            status[name] = f"failed: {str(e)}"
+            logger.error(f"Initializing {name} failed, retrying in {delay:.0f}s: {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
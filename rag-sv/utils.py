@@ -1,16 +1,26 @@
 import os
+import re
+import asyncio
 import requests
 import tarfile
 import io
+import zlib
+import tempfile
+import urllib3
 import xml.etree.ElementTree as ET
 import fitz  # PyMuPDF
 from datetime import datetime, timedelta
 import logging
-from typing import List
-import csv  
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from contextlib import ExitStack, closing
+from urllib.parse import urlparse
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+import oa_index
+from archive_cache import archive_cache
+from chunking import iter_nxml_chunks
+from concurrency import FETCH_CONCURRENCY_PER_HOST, fetch_in_order, fetch_limited, run_blocking, io_executor, process_executor
 
 # Load environment variables
 load_dotenv()
@@ -18,11 +28,51 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+PMC_BASE_URL = os.getenv("PMC_BASE_URL", "https://ftp.ncbi.nlm.nih.gov/pub/pmc")
+NCBI_EUTILS_URL = os.getenv("NCBI_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+# Query year-long date windows concurrently instead of walking them one request at a time
+PMC_PARALLEL_SEARCH = os.getenv("PMC_PARALLEL_SEARCH", "true").lower() == "true"
+PMC_SEARCH_WINDOWS_PER_WAVE = int(os.getenv("PMC_SEARCH_WINDOWS_PER_WAVE", "4"))
+# With the Entrez history server, pages of a window are read from the stored result set in bulk
+PMC_SEARCH_USE_HISTORY = os.getenv("PMC_SEARCH_USE_HISTORY", "false").lower() == "true"
+PMC_SEARCH_HISTORY_PAGE_SIZE = int(os.getenv("PMC_SEARCH_HISTORY_PAGE_SIZE", "5000"))
+ESEARCH_PAGE_SIZE = 100
+SEARCH_FLOOR_DATE = "2000/01/01"
+PMC_STREAMING_EXTRACTION = os.getenv("PMC_STREAMING_EXTRACTION", "true").lower() == "true"
+PMC_MAX_ARCHIVE_MB = int(os.getenv("PMC_MAX_ARCHIVE_MB", "200"))
+# Archives up to this size are read to the end in the background after the
+# extractor has what it needs, so the archive cache keeps a copy; larger ones are abandoned early
+PMC_CACHE_DRAIN_MB = int(os.getenv("PMC_CACHE_DRAIN_MB", "32"))
+PDF_PARALLEL_PAGES = os.getenv("PDF_PARALLEL_PAGES", "true").lower() == "true"
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+# Extraction budget per paper; 0 disables a limit
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "200"))
+PDF_MAX_TEXT_CHARS = int(os.getenv("PDF_MAX_TEXT_CHARS", "1000000"))
+# Dropping everything after a References/Acknowledgements heading saves chunks, but a
+# heading matched mid-paper would drop body text with it, so it is opt-in
+PDF_SKIP_BACK_MATTER = os.getenv("PDF_SKIP_BACK_MATTER", "false").lower() == "true"
+
+NXML_SUFFIXES = (".nxml", ".xml")
+PDF_SUFFIXES = (".pdf",)
+# A heading on a line of its own that starts the reference list or supplementary material
+BACK_MATTER_HEADING = re.compile(
+    r"^\s*(references|bibliography|literature cited|supplementary (material|materials|information|data)|supporting information)\s*:?\s*$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+class ArchiveTooLarge(Exception):
+    pass
+
+# Reading response.raw directly raises urllib3's errors rather than requests'
+ARCHIVE_READ_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, tarfile.TarError,
+                       EOFError, zlib.error, ArchiveTooLarge)
 
 # Configure a session with retry logic for requests
 session = requests.Session()
 retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-session.mount("https://", HTTPAdapter(max_retries=retries))
+adapter = HTTPAdapter(max_retries=retries, pool_maxsize=FETCH_CONCURRENCY_PER_HOST)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
 
 def parse_date(date_str: str) -> datetime:
     try:
@@ -33,20 +83,25 @@ def parse_date(date_str: str) -> datetime:
         except ValueError:
             return datetime.min
 
-def fetch_open_access_pmcids(niche: str, num_papers: int = 30, start_date: str = None) -> list:
+def fetch_open_access_pmcids(niche: str, num_papers: int = 30, start_date: str = None,
+                             min_date: str = None, date_type: str = "pdat") -> list:
+    # Walks back a year at a time from start_date, never past min_date when given.
+    # date_type "mdat" matches on modification date, which also catches updated papers
     if not start_date:
         start_date = datetime.now().strftime("%Y/%m/%d")
     end_date = (datetime.strptime(start_date, "%Y/%m/%d") - timedelta(days=365)).strftime("%Y/%m/%d")
+    if min_date:
+        end_date = max(end_date, min_date)
     all_pmcids = []
     retstart = 0
     retmax = min(num_papers, 100)  # NCBI API limit per request
 
     while len(all_pmcids) < num_papers:
         url = (
-            f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pmc"
+            f"{NCBI_EUTILS_URL}/esearch.fcgi?db=pmc"
             f"&term={niche}%5Bmesh%5D+AND+open+access%5Bfilter%5D"
             f"&retstart={retstart}&retmax={retmax}&retmode=json"
-            f"&mindate={end_date}&maxdate={start_date}&datetype=pdat"
+            f"&mindate={end_date}&maxdate={start_date}&datetype={date_type}"
             f"&api_key={NCBI_API_KEY}"  # Add API key to the request
         )
         try:
@@ -62,65 +117,227 @@ def fetch_open_access_pmcids(niche: str, num_papers: int = 30, start_date: str =
 
         # If fewer results than expected, adjust date range and continue
         if len(pmcids) < retmax:
+            if min_date and end_date <= min_date:
+                break
             start_date = end_date
             end_date = (datetime.strptime(start_date, "%Y/%m/%d") - timedelta(days=365)).strftime("%Y/%m/%d")
+            if min_date:
+                end_date = max(end_date, min_date)
             retstart = 0
-            if start_date <= "2000/01/01":  # Stop if we go too far back
+            if start_date <= SEARCH_FLOOR_DATE:  # Stop if we go too far back
                 break
         else:
             retstart += retmax
 
     return all_pmcids[:num_papers]
 
+def _search_windows(start_date: str, min_date: str = None) -> List[Tuple[str, str]]:
+    # The same year-long (mindate, maxdate) windows fetch_open_access_pmcids walks, newest first
+    windows = []
+    while True:
+        end_date = (datetime.strptime(start_date, "%Y/%m/%d") - timedelta(days=365)).strftime("%Y/%m/%d")
+        if min_date:
+            end_date = max(end_date, min_date)
+        windows.append((end_date, start_date))
+        if (min_date and end_date <= min_date) or end_date <= SEARCH_FLOOR_DATE:
+            return windows
+        start_date = end_date
+
+def _esearch(params: Dict) -> Dict:
+    try:
+        response = session.get(
+            f"{NCBI_EUTILS_URL}/esearch.fcgi",
+            params={"db": "pmc", "retmode": "json", "api_key": NCBI_API_KEY, **params},
+            timeout=10
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Failed to fetch PMCIDs from NCBI: {str(e)}")
+        raise ValueError(f"Failed to fetch PMCIDs from NCBI: {str(e)}")
+    return response.json()["esearchresult"]
+
+async def search_open_access_pmcids(niche: str, num_papers: int = 30, start_date: str = None,
+                                    min_date: str = None, date_type: str = "pdat") -> list:
+    # Same results as fetch_open_access_pmcids, but windows are searched a wave at a
+    # time, only the pages needed to reach num_papers are requested, and each wave's
+    # requests run at once under the shared NCBI rate limit
+    if not PMC_PARALLEL_SEARCH:
+        return await run_blocking(fetch_open_access_pmcids, niche, num_papers, start_date, min_date, date_type)
+
+    host = urlparse(NCBI_EUTILS_URL).netloc
+    term = f"{niche}[mesh] AND open access[filter]"
+    windows = _search_windows(start_date or datetime.now().strftime("%Y/%m/%d"), min_date)
+    page_size = PMC_SEARCH_HISTORY_PAGE_SIZE if PMC_SEARCH_USE_HISTORY else ESEARCH_PAGE_SIZE
+    all_pmcids = []
+    seen = set()
+
+    for w in range(0, len(windows), PMC_SEARCH_WINDOWS_PER_WAVE):
+        wave = windows[w:w + PMC_SEARCH_WINDOWS_PER_WAVE]
+        needed = num_papers - len(all_pmcids)
+        window_params = [
+            {"term": term, "mindate": end_date, "maxdate": start_date, "datetype": date_type}
+            for end_date, start_date in wave
+        ]
+        # The first request per window returns its count along with the first page
+        first_page = min(page_size, needed)
+        firsts = await asyncio.gather(*(
+            fetch_limited(_esearch, {**params, "retmax": first_page, **({"usehistory": "y"} if PMC_SEARCH_USE_HISTORY else {})}, host)
+            for params in window_params
+        ))
+
+        # Plan the remaining pages from the counts, newest window first
+        window_ids = []
+        pages = []
+        for params, first in zip(window_params, firsts):
+            take = min(int(first.get("count", 0)), needed)
+            needed -= take
+            ids = first["idlist"][:take]
+            if PMC_SEARCH_USE_HISTORY and first.get("webenv"):
+                params = {"term": term, "WebEnv": first["webenv"], "query_key": first["querykey"]}
+            window_pages = [{**params, "retstart": retstart, "retmax": min(page_size, take - retstart)}
+                            for retstart in range(len(ids), take, page_size)]
+            window_ids.append((ids, len(pages), len(window_pages)))
+            pages.extend(window_pages)
+
+        results = await asyncio.gather(*(fetch_limited(_esearch, params, host) for params in pages))
+        # Adjacent windows share their boundary day, so the same paper can come back twice
+        for ids, offset, count in window_ids:
+            for id in ids + [id for result in results[offset:offset + count] for id in result["idlist"]]:
+                pmcid = f"PMC{id}"
+                if pmcid not in seen:
+                    seen.add(pmcid)
+                    all_pmcids.append(pmcid)
+        if len(all_pmcids) >= num_papers:
+            break
+
+    return all_pmcids[:num_papers]
+
 def get_paper_metadata(pmcids: list) -> list:
-    csv_path = os.path.join(os.path.dirname(__file__), "oa_file_list.csv")
-    if not os.path.exists(csv_path):
-        logger.info("CSV file not found. Downloading...")
-        url = "https://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_file_list.csv"
-        try:
-            response = session.get(url, stream=True, timeout=10)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to download CSV file from NCBI: {str(e)}")
-            raise ValueError(f"Failed to download CSV file from NCBI: {str(e)}")
-        
-        with open(csv_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        logger.info("CSV file downloaded successfully")
-
-    papers = []
-    with open(csv_path, newline='', encoding='utf-8') as f:
-        csv_reader = csv.DictReader(f)
-        for row in csv_reader:
-            if row["Accession ID"] in pmcids:
-                papers.append({
-                    "pmcid": row["Accession ID"],
-                    "file_path": row["File"],
-                    "title": row["Article Citation"].split(".")[0],
-                    "last_updated": row["Last Updated (YYYY-MM-DD HH:MM:SS)"] or "1970-01-01 00:00:00"
-                })
+    oa_index.refresh_index(session)
+    papers = oa_index.lookup(pmcids)
     return sorted(papers, key=lambda x: parse_date(x["last_updated"]), reverse=True)
 
-def extract_paper_content(file_path: str) -> str:
-    url = f"https://ftp.ncbi.nlm.nih.gov/pub/pmc/{file_path}"
+def fetch_archive(file_path: str, version: Optional[str] = None) -> str:
+    cached_path = archive_cache.get(file_path, version)
+    if cached_path:
+        return cached_path
+
+    url = f"{PMC_BASE_URL}/{file_path}"
     try:
         response = session.get(url, stream=True, timeout=10)
         response.raise_for_status()
+        with archive_cache.writer(file_path, version) as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if chunk:
+                    f.write(chunk)
     except requests.exceptions.RequestException as e:
         logger.error(f"Failed to download tar file for {file_path}: {str(e)}")
-        return "No content available"
+        return None
+    return archive_cache.path_for(file_path, version)
+
+class _ArchiveReader:
+    # File-like wrapper that enforces the per-paper byte cap and can tee the
+    # compressed stream into the archive cache
+    def __init__(self, raw, max_bytes: int, sink=None):
+        self.raw = raw
+        self.max_bytes = max_bytes
+        self.sink = sink
+        self.bytes_read = 0
 
-    tar = tarfile.open(fileobj=io.BytesIO(response.content), mode="r:gz")
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_bytes:
+            raise ArchiveTooLarge(f"Archive exceeds {self.max_bytes} bytes")
+        if self.sink is not None:
+            self.sink.write(data)
+        return data
+
+    def drain(self, limit: Optional[int] = None) -> bool:
+        # True once the stream is exhausted, False if limit bytes were read first
+        while limit is None or self.bytes_read < limit:
+            if not self.read(64 * 1024):
+                return True
+        return False
+
+def _finish_for_cache(reader: _ArchiveReader, stack: ExitStack, file_path: str) -> None:
+    # Runs on io_executor after the extractor has returned. stack owns the
+    # response and the cache writer: leaving it normally commits the archive,
+    # leaving it with an error discards the partial copy.
+    try:
+        with stack:
+            if not reader.drain(PMC_CACHE_DRAIN_MB * 1024 * 1024):
+                raise ArchiveTooLarge(f"Archive exceeds {PMC_CACHE_DRAIN_MB} MB")
+    except ARCHIVE_READ_ERRORS as e:
+        logger.warning(f"Not caching {file_path}, reading the rest failed: {str(e)}")
+
+def _iter_tar_members(fileobj, suffixes: tuple, max_bytes: int, streams: bool = False) -> Iterator[Tuple[str, bytes]]:
+    # "r|gz" decompresses sequentially, so members are read as the bytes
+    # arrive and nothing after the last member we consume is ever inflated.
+    # With streams=True each member is a file object, valid until the next one.
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.lower().endswith(suffixes):
+                continue
+            if member.size > max_bytes:
+                logger.warning(f"Skipping oversized member {member.name} ({member.size} bytes)")
+                continue
+            data = tar.extractfile(member)
+            yield member.name.lower(), data if streams else data.read()
+
+def iter_archive_members(file_path: str, suffixes: tuple, streams: bool = False,
+                         version: Optional[str] = None) -> Iterator[Tuple[str, bytes]]:
+    # version is the paper's last_updated, which keys the archive cache
+    max_bytes = PMC_MAX_ARCHIVE_MB * 1024 * 1024
+    if not PMC_STREAMING_EXTRACTION:
+        archive_path = fetch_archive(file_path, version)
+        if not archive_path:
+            return
+        with open(archive_path, "rb") as f:
+            yield from _iter_tar_members(_ArchiveReader(f, max_bytes), suffixes, max_bytes, streams)
+        return
+
+    cached_path = archive_cache.get(file_path, version)
+    if cached_path:
+        with open(cached_path, "rb") as f:
+            yield from _iter_tar_members(_ArchiveReader(f, max_bytes), suffixes, max_bytes, streams)
+        return
+
+    response = session.get(f"{PMC_BASE_URL}/{file_path}", stream=True, timeout=10)
+    with ExitStack() as stack:
+        stack.callback(response.close)
+        response.raise_for_status()
+        # The tarball itself is gzip; never let urllib3 inflate it for us
+        response.raw.decode_content = False
+        # Only a complete archive is cached. When the consumer stops early, a small
+        # archive is read to the end in the background, so the caller doesn't wait
+        # on it; a large one is discarded
+        sink = stack.enter_context(archive_cache.writer(file_path, version))
+        reader = _ArchiveReader(response.raw, max_bytes, sink)
+        try:
+            yield from _iter_tar_members(reader, suffixes, max_bytes, streams)
+        except GeneratorExit:
+            if int(response.headers.get("Content-Length") or 0) <= PMC_CACHE_DRAIN_MB * 1024 * 1024:
+                io_executor.submit(_finish_for_cache, reader, stack.pop_all(), file_path)
+            raise
+        reader.drain()
+
+def extract_paper_content(file_path: str, version: Optional[str] = None) -> str:
     nxml_content = None
     pdf_content = None
-    for member in tar.getmembers():
-        member_name = member.name.lower()
-        if member_name.endswith((".nxml", ".xml")):
-            nxml_content = tar.extractfile(member).read()
-        elif member_name.endswith((".pdf", ".PDF")):
-            pdf_content = tar.extractfile(member).read()
+    try:
+        with closing(iter_archive_members(file_path, NXML_SUFFIXES + PDF_SUFFIXES, version=version)) as members:
+            for member_name, data in members:
+                if member_name.endswith(NXML_SUFFIXES):
+                    nxml_content = data
+                    break
+                if pdf_content is None:
+                    # Keep the first PDF as a fallback while looking for the NXML
+                    pdf_content = data
+    except ARCHIVE_READ_ERRORS as e:
+        logger.error(f"Failed to read tar file for {file_path}: {str(e)}")
+        if not (nxml_content or pdf_content):
+            return "No content available"
 
     if nxml_content:
         try:
@@ -183,36 +400,119 @@ def extract_paper_content(file_path: str) -> str:
     logger.warning(f"No NXML or PDF found in tar file for {file_path}")
     return "No content extracted"
 
-def extract_pdf_text(file_path: str) -> str:
-    url = f"https://ftp.ncbi.nlm.nih.gov/pub/pmc/{file_path}"
+def fetch_pdf_bytes(file_path: str, version: Optional[str] = None) -> Optional[bytes]:
     try:
-        response = session.get(url, stream=True, timeout=10)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to download tar file for {file_path}: {str(e)}")
-        return ""
-    
-    tar = tarfile.open(fileobj=io.BytesIO(response.content), mode="r:gz")
-    pdf_content = None
-    for member in tar.getmembers():
-        if member.name.lower().endswith((".pdf", ".PDF")):
-            pdf_content = tar.extractfile(member).read()
-            break
-    
-    if pdf_content:
-        try:
-            doc = fitz.open(stream=pdf_content, filetype="pdf")
-            text = ""
-            for page in doc:
-                text += page.get_text("text")
-            doc.close()
-            logger.info(f"Extracted text from PDF for {file_path}")
-            return text
-        except Exception as e:
-            logger.error(f"PDF extraction failed for {file_path}: {str(e)}")
-            return ""
+        with closing(iter_archive_members(file_path, PDF_SUFFIXES, version=version)) as members:
+            for _, data in members:
+                return data
+    except ARCHIVE_READ_ERRORS as e:
+        logger.error(f"Failed to read tar file for {file_path}: {str(e)}")
+        return None
     logger.warning(f"No PDF found in tar file for {file_path}")
-    return ""
+    return None
+
+def fetch_nxml_chunks(file_path: str, version: Optional[str] = None) -> List[str]:
+    # The NXML is parsed straight off the archive stream, so only its chunks are ever held
+    try:
+        with closing(iter_archive_members(file_path, NXML_SUFFIXES, streams=True, version=version)) as members:
+            for _, stream in members:
+                return list(iter_nxml_chunks(stream))
+    except ARCHIVE_READ_ERRORS + (ET.ParseError,) as e:
+        logger.error(f"Failed to chunk NXML for {file_path}: {str(e)}")
+        return []
+    logger.warning(f"No NXML found in tar file for {file_path}")
+    return []
+
+def _write_pdf(pdf_content: bytes) -> Tuple[str, int]:
+    # The page-range tasks open the PDF from disk rather than each being sent a copy of its bytes
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(pdf_content)
+    with fitz.open(f.name) as doc:
+        return f.name, doc.page_count
+
+def _pdf_page_texts(pdf_path: str, start: int, stop: int) -> List[str]:
+    # Worker-process task: one contiguous run of pages
+    with fitz.open(pdf_path) as doc:
+        return [doc[i].get_text("text") for i in range(start, min(stop, doc.page_count))]
+
+def _join_pages(pages: Iterable[str], skip_back_matter: bool, max_chars: int) -> str:
+    # pages may be lazy, so stopping early also stops parsing
+    parts = []
+    size = 0
+    for page_no, page_text in enumerate(pages):
+        if skip_back_matter and page_no > 0:
+            heading = BACK_MATTER_HEADING.search(page_text)
+            if heading:
+                parts.append(page_text[:heading.start()])
+                break
+        parts.append(page_text)
+        size += len(page_text)
+        if max_chars and size >= max_chars:
+            break
+    text = "".join(parts)
+    return text[:max_chars] if max_chars else text
+
+def pdf_bytes_to_text(pdf_content: bytes, file_path: str = "", max_pages: int = PDF_MAX_PAGES,
+                      max_chars: int = PDF_MAX_TEXT_CHARS, skip_back_matter: bool = PDF_SKIP_BACK_MATTER) -> str:
+    # Top-level and free of module state so it can run in a worker process
+    try:
+        with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+            page_count = min(doc.page_count, max_pages) if max_pages else doc.page_count
+            text = _join_pages((doc[i].get_text("text") for i in range(page_count)), skip_back_matter, max_chars)
+        logger.info(f"Extracted text from PDF for {file_path}")
+        return text
+    except Exception as e:
+        logger.error(f"PDF extraction failed for {file_path}: {str(e)}")
+        return ""
+
+async def parse_pdf(pdf_content: bytes, file_path: str = "") -> str:
+    # Long PDFs are split into page ranges that parse in parallel in the process
+    # pool; short ones go to a single worker whole
+    if not PDF_PARALLEL_PAGES:
+        return await run_blocking(pdf_bytes_to_text, pdf_content, file_path, executor=process_executor)
+    pdf_path = None
+    try:
+        pdf_path, page_count = await run_blocking(_write_pdf, pdf_content)
+        if PDF_MAX_PAGES:
+            page_count = min(page_count, PDF_MAX_PAGES)
+        if page_count <= PDF_PAGES_PER_TASK:
+            return await run_blocking(pdf_bytes_to_text, pdf_content, file_path, executor=process_executor)
+        ranges = await asyncio.gather(*(
+            run_blocking(_pdf_page_texts, pdf_path, start, start + PDF_PAGES_PER_TASK, executor=process_executor)
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)
+        ))
+        text = _join_pages((page for pages in ranges for page in pages), PDF_SKIP_BACK_MATTER, PDF_MAX_TEXT_CHARS)
+        logger.info(f"Extracted text from {page_count} PDF pages in {len(ranges)} tasks for {file_path}")
+        return text
+    except Exception as e:
+        logger.error(f"PDF extraction failed for {file_path}: {str(e)}")
+        return ""
+    finally:
+        if pdf_path:
+            os.unlink(pdf_path)
+
+def extract_pdf_text(file_path: str, version: Optional[str] = None) -> str:
+    pdf_content = fetch_pdf_bytes(file_path, version)
+    if not pdf_content:
+        return ""
+    return pdf_bytes_to_text(pdf_content, file_path)
+
+def _extract_version(extract):
+    # fetch_limited hands over one item: a (file_path, version) pair here
+    return lambda item: extract(*item)
+
+def _archive_cached(item: Tuple[str, Optional[str]]) -> bool:
+    return archive_cache.contains(*item)
+
+async def fetch_papers(extract, file_paths: List[str], versions: Optional[List[str]] = None) -> list:
+    # versions are the papers' last_updated dates, so an updated package isn't
+    # served from the cache. Cached archives don't touch NCBI, so they skip the rate limiter
+    items = list(zip(file_paths, versions or [None] * len(file_paths)))
+    return await fetch_in_order(_extract_version(extract), items, urlparse(PMC_BASE_URL).netloc, skip_limit=_archive_cached)
+
+async def fetch_paper(extract, file_path: str, version: Optional[str] = None):
+    return await fetch_limited(_extract_version(extract), (file_path, version), urlparse(PMC_BASE_URL).netloc,
+                               skip_limit=_archive_cached)
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
     chunks = []
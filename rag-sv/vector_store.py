@@ -0,0 +1,426 @@
+import os
+import re
+import json
+import hashlib
+import time
+import fcntl
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone").lower()
+EMBEDDING_DIM = 384
+
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "medalpine-rag")
+PINECONE_ENV = os.getenv("PINECONE_ENV", "us-east-1")
+PINECONE_READY_TIMEOUT_SECONDS = float(os.getenv("PINECONE_READY_TIMEOUT_SECONDS", "300"))
+
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR", os.path.join(os.path.dirname(__file__), "vector_store"))
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float16")
+LOCAL_IVF_MIN_ROWS = int(os.getenv("LOCAL_IVF_MIN_ROWS", "20000"))
+LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", "16"))
+NAMESPACE_FILE = "namespace"
+
+class VectorStore(ABC):
+    # Pinecone-shaped interface: vectors are {"id", "values", "metadata"} dicts
+    # and query() returns {"matches": [{"id", "score", "metadata"}]}. Namespaces
+    # partition the index; "" (or None) is the default namespace.
+    @abstractmethod
+    def upsert(self, vectors: List[Dict], namespace: Optional[str] = None) -> None:
+        ...
+
+    @abstractmethod
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = True,
+              filter: Optional[Dict] = None, namespace: Optional[str] = None) -> Dict:
+        ...
+
+    @abstractmethod
+    def namespaces(self) -> List[str]:
+        ...
+
+class PineconeStore(VectorStore):
+    def __init__(self, index_name: str = PINECONE_INDEX_NAME):
+        from pinecone import Pinecone
+        self.pc = Pinecone(api_key=PINECONE_API_KEY)
+        self.index_name = index_name
+        self.ensure_index_exists()
+        self.index = self.pc.Index(index_name)
+
+    def ensure_index_exists(self):
+        from pinecone import ServerlessSpec
+        try:
+            existing_indexes = self.pc.list_indexes().names()
+            if self.index_name not in existing_indexes:
+                logger.info(f"Creating index: {self.index_name}")
+                self.pc.create_index(
+                    name=self.index_name,
+                    dimension=EMBEDDING_DIM,
+                    metric="cosine",
+                    spec=ServerlessSpec(
+                        cloud="aws",
+                        region=PINECONE_ENV
+                    )
+                )
+            else:
+                logger.info(f"Index {self.index_name} already exists")
+            self.wait_until_ready()
+        except Exception as e:
+            logger.error(f"Failed to ensure index exists: {str(e)}")
+            raise
+
+    def wait_until_ready(self):
+        # Polls with backoff rather than sleeping a fixed time; an existing index returns at once
+        deadline = time.monotonic() + PINECONE_READY_TIMEOUT_SECONDS
+        delay = 0.5
+        while not self.pc.describe_index(self.index_name).status.ready:
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Index {self.index_name} not ready after {PINECONE_READY_TIMEOUT_SECONDS:.0f}s")
+            logger.info(f"Waiting for index {self.index_name} to be ready...")
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    def upsert(self, vectors: List[Dict], namespace: Optional[str] = None) -> None:
+        self.index.upsert(vectors=vectors, namespace=namespace or "")
+
+    def query(self, vector, top_k=10, include_metadata=True, filter=None, namespace=None) -> Dict:
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, filter=filter or None,
+                                namespace=namespace or "")
+
+    def namespaces(self) -> List[str]:
+        return list(self.index.describe_index_stats().namespaces)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    row INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    specialty TEXT,
+    last_updated INTEGER,
+    cluster INTEGER NOT NULL DEFAULT -1,
+    metadata TEXT NOT NULL
+);
+"""
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _kmeans(sample: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    # Spherical k-means: vectors are unit length and scored by dot product
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        # Re-seed empty clusters so every list stays useful
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+class LocalStore(VectorStore):
+    # Unit-length vectors live in a memory-mapped .npy matrix (float16 by
+    # default); ids, filter fields and metadata live in SQLite. Below
+    # LOCAL_IVF_MIN_ROWS queries are exact. Above it an IVF index (spherical
+    # k-means centroids + per-row cluster ids) narrows each query to the
+    # nprobe closest lists. Worker processes on one host can share a store:
+    # writes take an flock, and each process reloads rows others have committed.
+    def __init__(self, root: str = LOCAL_VECTOR_STORE_DIR, dtype: str = LOCAL_VECTOR_DTYPE,
+                 ivf_min_rows: int = LOCAL_IVF_MIN_ROWS, nprobe: int = LOCAL_IVF_NPROBE):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(root, "vectors.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock_file = open(os.path.join(root, "writer.lock"), "a")
+        self._partitions: Dict[str, "LocalStore"] = {}
+        self._load()
+
+    def _partition(self, namespace: Optional[str]) -> "LocalStore":
+        # Each namespace is a LocalStore of its own under namespaces/, with its own IVF lists
+        if not namespace:
+            return self
+        with self._lock:
+            if namespace not in self._partitions:
+                # Readable but lossy, so a hash of the real name keeps "a b" and "a_b" apart
+                digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:8]
+                directory = os.path.join(self.root, "namespaces", f"{re.sub(r'[^a-z0-9_-]', '_', namespace.lower())}-{digest}")
+                partition = LocalStore(directory, self.dtype.name, self.ivf_min_rows, self.nprobe)
+                # The real name, for namespaces() after a restart
+                with open(os.path.join(directory, NAMESPACE_FILE), "w", encoding="utf-8") as f:
+                    f.write(namespace)
+                self._partitions[namespace] = partition
+            return self._partitions[namespace]
+
+    def namespaces(self) -> List[str]:
+        directory = os.path.join(self.root, "namespaces")
+        names = set(self._partitions)
+        for entry in os.listdir(directory) if os.path.isdir(directory) else []:
+            try:
+                with open(os.path.join(directory, entry, NAMESPACE_FILE), encoding="utf-8") as f:
+                    names.add(f.read())
+            except FileNotFoundError:
+                continue
+        return ([""] if self.count else []) + sorted(names)
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.root, "vectors.npy")
+
+    @property
+    def _centroids_path(self) -> str:
+        return os.path.join(self.root, "centroids.npy")
+
+    @contextmanager
+    def _exclusive(self):
+        # Row numbers are handed out from self.count, so writers in different
+        # processes take turns, each first catching up on the others' rows
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        # Called with the lock held. data_version only moves when another connection commits
+        if self._conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+            logger.info(f"Reloading local vector store at {self.root} after writes from another process")
+            self._load()
+
+    def _load(self) -> None:
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        rows = self._conn.execute("SELECT row, id, specialty, last_updated, cluster FROM vectors ORDER BY row").fetchall()
+        self.count = len(rows)
+        self._row_by_id = {vector_id: row for row, vector_id, _, _, _ in rows}
+        self._specialty_codes: Dict[str, int] = {}
+        if os.path.exists(self._vectors_path):
+            self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        else:
+            self._vectors = np.lib.format.open_memmap(self._vectors_path, mode="w+", dtype=self.dtype,
+                                                      shape=(max(1024, self.count), EMBEDDING_DIM))
+        capacity = len(self._vectors)
+        self._specialty = np.full(capacity, -1, dtype=np.int32)
+        self._last_updated = np.zeros(capacity, dtype=np.int64)
+        self._cluster = np.full(capacity, -1, dtype=np.int32)
+        for row, _, specialty, last_updated, cluster in rows:
+            self._specialty[row] = self._specialty_code(specialty)
+            self._last_updated[row] = last_updated or 0
+            self._cluster[row] = cluster
+
+        self._centroids = np.load(self._centroids_path) if os.path.exists(self._centroids_path) else None
+        self._trained_rows = int(self._conn.execute(
+            "SELECT COUNT(*) FROM vectors WHERE cluster >= 0").fetchone()[0]) if self._centroids is not None else 0
+        self._lists = None
+
+    def _specialty_code(self, specialty: Optional[str]) -> int:
+        if specialty is None:
+            return -1
+        return self._specialty_codes.setdefault(specialty, len(self._specialty_codes))
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._vectors)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        grown_path = self._vectors_path + ".grow"
+        grown = np.lib.format.open_memmap(grown_path, mode="w+", dtype=self.dtype, shape=(new_capacity, EMBEDDING_DIM))
+        grown[:capacity] = self._vectors
+        grown.flush()
+        del grown
+        os.replace(grown_path, self._vectors_path)
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        extra = new_capacity - len(self._specialty)
+        self._specialty = np.concatenate([self._specialty, np.full(extra, -1, dtype=np.int32)])
+        self._last_updated = np.concatenate([self._last_updated, np.zeros(extra, dtype=np.int64)])
+        self._cluster = np.concatenate([self._cluster, np.full(extra, -1, dtype=np.int32)])
+
+    def upsert(self, vectors: List[Dict], namespace: Optional[str] = None) -> None:
+        if namespace:
+            return self._partition(namespace).upsert(vectors)
+        if not vectors:
+            return
+        values = _normalize_rows(np.asarray([v["values"] for v in vectors], dtype=np.float32))
+        with self._exclusive():
+            rows = []
+            for v in vectors:
+                row = self._row_by_id.get(v["id"])
+                if row is None:
+                    row = self._row_by_id[v["id"]] = self.count
+                    self.count += 1
+                rows.append(row)
+            self._grow(self.count)
+            rows = np.asarray(rows)
+            self._vectors[rows] = values.astype(self.dtype)
+            self._vectors.flush()
+
+            clusters = np.full(len(rows), -1, dtype=np.int32)
+            if self._centroids is not None:
+                clusters = np.argmax(values @ self._centroids.T, axis=1).astype(np.int32)
+            records = []
+            for row, v, cluster in zip(rows, vectors, clusters):
+                metadata = v.get("metadata", {})
+                self._specialty[row] = self._specialty_code(metadata.get("specialty"))
+                self._last_updated[row] = int(metadata.get("last_updated", 0) or 0)
+                self._cluster[row] = cluster
+                records.append((int(row), v["id"], metadata.get("specialty"), int(metadata.get("last_updated", 0) or 0),
+                                int(cluster), json.dumps(metadata)))
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO vectors (row, id, specialty, last_updated, cluster, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                    records
+                )
+            self._lists = None
+            if self.count >= self.ivf_min_rows and self.count >= 2 * self._trained_rows:
+                self._train()
+
+    def train(self) -> None:
+        with self._exclusive():
+            self._train()
+
+    def _train(self) -> None:
+        # Called under _exclusive()
+        n = self.count
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n, min(n, nlist * 64), replace=False))
+        sample = np.asarray(self._vectors[sample_rows], dtype=np.float32)
+        started = time.time()
+        centroids = _kmeans(sample, nlist).astype(np.float32)
+        for start in range(0, n, 65536):
+            block = np.asarray(self._vectors[start:min(n, start + 65536)], dtype=np.float32)
+            self._cluster[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        np.save(self._centroids_path, centroids)
+        with self._conn:
+            self._conn.executemany("UPDATE vectors SET cluster = ? WHERE row = ?",
+                                   ((int(self._cluster[row]), row) for row in range(n)))
+        self._centroids = centroids
+        self._trained_rows = n
+        self._lists = None
+        logger.info(f"Trained IVF index with {nlist} lists over {n} vectors in {time.time() - started:.1f}s")
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            clusters = self._cluster[:self.count]
+            order = np.argsort(clusters, kind="stable")
+            offsets = np.searchsorted(clusters[order], np.arange(len(self._centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def _filter_mask(self, rows: np.ndarray, filter: Optional[Dict]) -> np.ndarray:
+        mask = np.ones(len(rows), dtype=bool)
+        for field, condition in (filter or {}).items():
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            if field == "specialty":
+                column = self._specialty[rows]
+                for op, value in condition.items():
+                    values = value if op in ("$in", "$nin") else [value]
+                    codes = [self._specialty_codes[v] for v in values if v in self._specialty_codes]
+                    hit = np.isin(column, codes)
+                    if op in ("$eq", "$in"):
+                        mask &= hit
+                    elif op in ("$ne", "$nin"):
+                        mask &= ~hit
+                    else:
+                        raise ValueError(f"Unsupported filter operator {op} on specialty")
+            elif field == "last_updated":
+                column = self._last_updated[rows]
+                for op, value in condition.items():
+                    if op == "$gte":
+                        mask &= column >= value
+                    elif op == "$gt":
+                        mask &= column > value
+                    elif op == "$lte":
+                        mask &= column <= value
+                    elif op == "$lt":
+                        mask &= column < value
+                    elif op == "$eq":
+                        mask &= column == value
+                    else:
+                        raise ValueError(f"Unsupported filter operator {op} on last_updated")
+            else:
+                raise ValueError(f"Local vector store cannot filter on {field}")
+        return mask
+
+    def _candidate_rows(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        if self._centroids is None or self.count < self.ivf_min_rows:
+            return np.arange(self.count)
+        order, offsets = self._inverted_lists()
+        probes = np.argsort(-(self._centroids @ query))[:nprobe]
+        lists = [order[offsets[p]:offsets[p + 1]] for p in probes]
+        # Rows added since the last training run have no list yet
+        lists.append(np.flatnonzero(self._cluster[:self.count] < 0))
+        return np.concatenate(lists)
+
+    def query(self, vector, top_k=10, include_metadata=True, filter=None, namespace: Optional[str] = None,
+              nprobe: Optional[int] = None, exact: bool = False) -> Dict:
+        if namespace:
+            return self._partition(namespace).query(vector, top_k, include_metadata, filter, nprobe=nprobe, exact=exact)
+        q = np.asarray(vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        with self._lock:
+            self._refresh()
+            count = self.count
+            rows = np.arange(count) if exact else self._candidate_rows(q, nprobe or self.nprobe)
+            rows = rows[self._filter_mask(rows, filter)] if filter else rows
+            vectors = self._vectors
+
+        if len(rows) == 0:
+            return {"matches": []}
+        # Sorted rows keep memory-mapped reads sequential; a full scan reads plain slices
+        rows = np.sort(rows)
+        full_scan = len(rows) == count
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start:start + 65536]
+            block = vectors[chunk[0]:chunk[-1] + 1] if full_scan else vectors[chunk]
+            scores[start:start + len(chunk)] = np.asarray(block, dtype=np.float32) @ q
+        k = min(top_k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        with self._lock:
+            matches = self._matches(rows[best], scores[best], include_metadata)
+        return {"matches": matches}
+
+    def _matches(self, rows: np.ndarray, scores: np.ndarray, include_metadata: bool) -> List[Dict]:
+        placeholders = ",".join("?" * len(rows))
+        records = {
+            row: (vector_id, metadata)
+            for row, vector_id, metadata in self._conn.execute(
+                f"SELECT row, id, metadata FROM vectors WHERE row IN ({placeholders})", [int(r) for r in rows])
+        }
+        matches = []
+        for row, score in zip(rows, scores):
+            vector_id, metadata = records[int(row)]
+            match = {"id": vector_id, "score": float(score)}
+            if include_metadata:
+                match["metadata"] = json.loads(metadata)
+            matches.append(match)
+        return matches
+
+def create_vector_store(backend: str = VECTOR_STORE) -> VectorStore:
+    if backend == "local":
+        logger.info(f"Using local vector store at {LOCAL_VECTOR_STORE_DIR}")
+        return LocalStore()
+    if backend == "pinecone":
+        return PineconeStore()
+    raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")